@@ -32,6 +32,7 @@ class AppStage(Stage):
             output_keys["user_pool_stack"]["stack_name"],
             env=env,
             props=props["user_pool_stack"],
+            stage_name=id,
             user_pool_id_output_key=output_keys["user_pool_stack"][
                 "pool_id_output_key"
             ],
@@ -47,6 +48,8 @@ class AppStage(Stage):
             stage_name=id,
             user_pool_arn=user_pool.user_pool_arn,
             user_pool_client_id=user_pool.user_pool_client_id,
+            user_profiles_table_name=user_pool.user_profiles_table_name,
+            user_profiles_table_arn=user_pool.user_profiles_table_arn,
             graphql_url_output_key=output_keys["websocket_chat_stack"][
                 "graphql_url_output_key"
             ],
@@ -5,6 +5,24 @@ from constructs import Construct
 from aws_cdk import aws_lambda, aws_iam as iam, Duration
 
 
+# Performance profiles are declared per stack in config.json ("performance_profiles"), with the optional keys
+# memory_size, architecture, runtime, reserved_concurrency, provisioned_concurrency and snap_start
+
+
+def resolve_profile(
+    performance_profiles: Union[dict, None], stage_name: str, function_id: str
+) -> dict:
+    # From the most generic to the most specific: defaults, function, stage defaults, stage function
+    performance_profiles = performance_profiles or {}
+    stage = performance_profiles.get("stages", {}).get(stage_name, {})
+    return {
+        **performance_profiles.get("defaults", {}),
+        **performance_profiles.get("functions", {}).get(function_id, {}),
+        **stage.get("defaults", {}),
+        **stage.get("functions", {}).get(function_id, {}),
+    }
+
+
 # Generic helper construct. Consider replacing it by the CDK 'PythonFunction' L2 construct when it comes out
 class LambdaPython(Construct):
     def __init__(
@@ -16,16 +34,59 @@ class LambdaPython(Construct):
         memory_size=128,
         timeout=Duration.seconds(3),
         layers: list[str] = [],
+        tracing=False,
+        profile: Union[dict, None] = None,
         **kwargs
     ):
         super().__init__(scope, id, **kwargs)
 
-        # Layers
+        # Performance profile
+
+        profile = profile or {}
+        assert set(profile).issubset(
+            [
+                "memory_size",
+                "architecture",
+                "runtime",
+                "reserved_concurrency",
+                "provisioned_concurrency",
+                "snap_start",
+            ]
+        ), "Error: Invalid performance profile key. See aws_lambda_construct.py for the valid keys."
+        memory_size = profile.get("memory_size", memory_size)
+        assert profile.get("architecture", "x86_64") in [
+            "x86_64",
+            "arm64",
+        ], "Error: Invalid architecture. Valid architectures are: 'x86_64', 'arm64'."
+        arm64 = profile.get("architecture") == "arm64"
+        architecture = (
+            aws_lambda.Architecture.ARM_64 if arm64 else aws_lambda.Architecture.X86_64
+        )
+        runtime_name = profile.get("runtime", "python3.9")
+        runtime = getattr(
+            aws_lambda.Runtime,
+            runtime_name.replace("python", "PYTHON_").replace(".", "_"),
+            None,
+        ) or aws_lambda.Runtime(runtime_name, aws_lambda.RuntimeFamily.PYTHON)
+        provisioned_concurrency = profile.get("provisioned_concurrency")
+        snap_start = profile.get("snap_start", False)
+        if snap_start:
+            assert tuple(
+                int(part) for part in runtime_name[len("python") :].split(".")
+            ) >= (3, 12), "Error: SnapStart needs the python3.12 runtime or later."
+            assert (
+                not provisioned_concurrency
+            ), "Error: SnapStart and provisioned concurrency can't be combined."
+
+        # Layers. The third party layers contain compiled dependencies, so they must be built for the runtime and the
+        # architecture of the function
 
         powertools_layer = aws_lambda.LayerVersion.from_layer_version_arn(
             self,
             "PowertoolsLayer",
-            "arn:aws:lambda:eu-west-1:017000801446:layer:AWSLambdaPowertoolsPythonV2:26",
+            "arn:aws:lambda:eu-west-1:017000801446:layer:AWSLambdaPowertoolsPythonV2{}:26".format(
+                "-Arm64" if arm64 else ""
+            ),
         )
 
         jose_layer = aws_lambda.LayerVersion(
@@ -34,10 +95,8 @@ class LambdaPython(Construct):
             code=aws_lambda.Code.from_asset(
                 os.path.join("aws_lambda_shared/layers/python_jose/", "python_jose.zip")
             ),
-            compatible_runtimes=[
-                aws_lambda.Runtime.PYTHON_3_8,
-                aws_lambda.Runtime.PYTHON_3_9,
-            ],
+            compatible_runtimes=[runtime],
+            compatible_architectures=[architecture],
             license="BSD 3",
             description="Verifies JWT tokens",
         )
@@ -48,22 +107,41 @@ class LambdaPython(Construct):
             code=aws_lambda.Code.from_asset(
                 os.path.join("aws_lambda_shared/layers/openai/", "openai.zip")
             ),
-            compatible_runtimes=[
-                aws_lambda.Runtime.PYTHON_3_8,
-                aws_lambda.Runtime.PYTHON_3_9,
-            ],
+            compatible_runtimes=[runtime],
+            compatible_architectures=[architecture],
             license="BSD 3",
             description="Libraries to call the OpenAI API",
         )
 
+        shared_runtime_layer = aws_lambda.LayerVersion(
+            self,
+            "SharedRuntimeLayer",
+            code=aws_lambda.Code.from_asset("aws_lambda_shared/shared_runtime"),
+            compatible_runtimes=[runtime],
+            compatible_architectures=[
+                aws_lambda.Architecture.X86_64,
+                aws_lambda.Architecture.ARM_64,
+            ],
+            description="Code shared by the chat runtime functions",
+        )
+
         assert set(layers).issubset(
-            ["lambda_powertools", "jose", "openai"]
-        ), "Error: Invalid layer. Valid layers are: 'lambda_powertools', 'jose', 'openai. See aws_lambda_constructs.py for more details."
+            ["lambda_powertools", "jose", "openai", "shared_runtime"]
+        ), "Error: Invalid layer. Valid layers are: 'lambda_powertools', 'jose', 'openai', 'shared_runtime'. See aws_lambda_constructs.py for more details."
         layers_ = [powertools_layer]
         if "jose" in layers:
             layers_.append(jose_layer)
         if "openai" in layers:
             layers_.append(openai_layer)
+        if "shared_runtime" in layers:
+            layers_.append(shared_runtime_layer)
+
+        # Tracing. Without active tracing the Powertools Tracer is swapped for a pass-through, which saves importing
+        # the X-Ray SDK, most of the import time of a function
+
+        env_vars = dict(env_vars or {})
+        if not tracing:
+            env_vars.setdefault("POWERTOOLS_TRACE_DISABLED", "true")
 
         # Lambda definition
 
@@ -72,14 +150,34 @@ class LambdaPython(Construct):
             self,
             self._id,
             function_name=self._id.replace("_", "-"),
-            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            runtime=runtime,
+            architecture=architecture,
             code=aws_lambda.Code.from_asset(code_path),
             handler="lambda_function.handler",
             memory_size=memory_size,
             timeout=timeout,
             layers=layers_,
             environment=env_vars,
+            tracing=aws_lambda.Tracing.ACTIVE if tracing else None,
+            reserved_concurrent_executions=profile.get("reserved_concurrency"),
         )
+        if snap_start:  # Not in this CDK version's Function props yet
+            self.fn.node.default_child.add_property_override(
+                "SnapStart", {"ApplyOn": "PublishedVersions"}
+            )
+
+        # What callers invoke: the "live" alias when the profile publishes versions, the function otherwise
+
+        if provisioned_concurrency or snap_start:
+            self.target = aws_lambda.Alias(
+                self,
+                "LiveAlias",
+                alias_name="live",
+                version=self.fn.current_version,
+                provisioned_concurrent_executions=provisioned_concurrency,
+            )
+        else:
+            self.target = self.fn
 
     # Add policy method
 
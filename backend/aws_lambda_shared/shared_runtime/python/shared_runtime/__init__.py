@@ -0,0 +1,5 @@
+from time import perf_counter
+
+# The functions import shared_runtime first thing, so this is about when the init of their container started. See
+# instrumentation.py
+init_started_at = perf_counter()
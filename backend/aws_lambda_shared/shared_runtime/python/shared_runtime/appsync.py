@@ -0,0 +1,72 @@
+from os import environ
+from json import dumps, loads
+from urllib.parse import urlparse
+
+from shared_runtime.clients import get_http_pool
+from shared_runtime.deadlines import deadline
+from shared_runtime.instrumentation import dependency_call
+
+# Calls the AppSync GraphQL API from a function, signed with the function's IAM role. Used to run the @aws_iam
+# mutations that only exist to publish events to subscribers. The calls share the keep-alive connections of
+# clients.get_http_pool, and their timeouts fit in what is left of the invocation
+
+
+class AppSyncError(Exception):
+    pass
+
+
+class AppSyncClient:
+    def __init__(
+        self,
+        graphql_url: str,
+        region_name: str = None,
+        timeout: float = 5,
+        connect_timeout: float = 1,
+    ):
+        self._graphql_url = graphql_url
+        self._host = urlparse(graphql_url).netloc
+        self._region_name = region_name or environ["AWS_REGION"]
+        self._timeout = timeout
+        self._connect_timeout = connect_timeout
+        self._credentials = None
+
+    def execute(self, query: str, variables: dict = None) -> dict:
+        from botocore.auth import SigV4Auth
+        from botocore.awsrequest import AWSRequest
+        from botocore.session import Session
+        from urllib3 import Timeout
+
+        if self._credentials is None:
+            self._credentials = Session().get_credentials()
+        aws_request = AWSRequest(
+            method="POST",
+            url=self._graphql_url,
+            data=dumps({"query": query, "variables": variables or {}}),
+            headers={"Content-Type": "application/json", "Host": self._host},
+        )
+        SigV4Auth(
+            self._credentials.get_frozen_credentials(), "appsync", self._region_name
+        ).add_auth(aws_request)
+        connect_timeout, read_timeout = deadline.timeouts(
+            self._connect_timeout, self._timeout
+        )
+        with dependency_call("AppSync"):
+            response = get_http_pool().request(
+                "POST",
+                self._graphql_url,
+                body=(
+                    aws_request.body.encode()
+                    if isinstance(aws_request.body, str)
+                    else aws_request.body
+                ),
+                headers=dict(aws_request.headers.items()),
+                timeout=Timeout(connect=connect_timeout, read=read_timeout),
+            )
+        if response.status >= 400:
+            raise AppSyncError(
+                "HTTP {}: {}".format(response.status, response.data[:200])
+            )
+        body = loads(response.data)
+        if body.get("errors"):
+            raise AppSyncError(body["errors"])
+        return body["data"]
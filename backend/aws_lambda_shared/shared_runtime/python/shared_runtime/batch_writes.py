@@ -0,0 +1,72 @@
+from time import sleep
+
+from shared_runtime.retry import backoff_delay
+
+# Puts or deletes items 25 at a time, sending again with backoff the ones DynamoDB leaves unprocessed. Writing the
+# same items again is harmless, so the stream consumers retry a failed batch whole. client_batch_delete is thread safe
+
+BATCH_WRITE_MAX_ITEMS = 25
+
+
+class UnprocessedItemsError(Exception):
+    pass
+
+
+def chunks(items: list, size: int = BATCH_WRITE_MAX_ITEMS):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def batch_put(table, items: list, max_attempts: int = 8, sleep=sleep) -> int:
+    # Returns the number of items written
+    return _batch_write(
+        table.meta.client,
+        table.name,
+        [{"PutRequest": {"Item": item}} for item in items],
+        max_attempts,
+        sleep,
+    )
+
+
+def batch_delete(table, keys: list, max_attempts: int = 8, sleep=sleep) -> int:
+    # Same as batch_put, with the keys of the items to delete
+    return _batch_write(
+        table.meta.client,
+        table.name,
+        [{"DeleteRequest": {"Key": key}} for key in keys],
+        max_attempts,
+        sleep,
+    )
+
+
+def client_batch_delete(
+    client, table_name: str, keys: list, max_attempts: int = 8, sleep=sleep
+) -> int:
+    return _batch_write(
+        client,
+        table_name,
+        [{"DeleteRequest": {"Key": key}} for key in keys],
+        max_attempts,
+        sleep,
+    )
+
+
+def _batch_write(
+    client, table_name: str, requests: list, max_attempts: int, sleep
+) -> int:
+    for chunk in chunks(requests):
+        request_items = {table_name: chunk}
+        for attempt in range(max_attempts):
+            response = client.batch_write_item(RequestItems=request_items)
+            request_items = response.get("UnprocessedItems") or {}
+            if not request_items:
+                break
+            if attempt + 1 < max_attempts:
+                sleep(backoff_delay(attempt, base_delay=0.05, max_delay=2))
+        else:
+            raise UnprocessedItemsError(
+                "{} writes were still unprocessed after {} attempts".format(
+                    len(request_items[table_name]), max_attempts
+                )
+            )
+    return len(requests)
@@ -0,0 +1,206 @@
+import socket
+from threading import Lock, local
+
+from shared_runtime.env import env_float, env_int
+from shared_runtime.deadlines import deadline, DeadlineExceeded
+from shared_runtime.instrumentation import instrument_client, count_connections
+
+# boto3 clients and resources, created on first use by a LazyProxy and reused by the container, as importing boto3 is
+# one of the largest costs of a cold start. Every client keeps keep-alive connections, retries in the adaptive mode,
+# and reads each attempt within what is left of the invocation (deadlines.py)
+
+max_pool_connections = env_int("CLIENT_MAX_POOL_CONNECTIONS", 16)
+max_attempts = env_int("CLIENT_MAX_ATTEMPTS", 3)
+connect_timeout_seconds = env_float("CLIENT_CONNECT_TIMEOUT_SECONDS", 1)
+read_timeout_seconds = env_float("CLIENT_READ_TIMEOUT_SECONDS", 10)
+
+KEEPALIVE_SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+_lock = Lock()
+_clients = {}
+_resources = {}
+_tables = {}
+_http = {}
+# boto3 resources are not thread safe, so the worker threads of the handlers get their own
+_thread_local = local()
+
+
+def client_config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "max_attempts": max_attempts},
+        connect_timeout=connect_timeout_seconds,
+        read_timeout=read_timeout_seconds,
+    )
+
+
+def _check_deadline(**kwargs):
+    deadline.check()
+
+
+def _no_retry_after_deadline(response, caught_exception, **kwargs):
+    # Before botocore sleeps its backoff: a failed attempt that used up the invocation is not retried. The
+    # throttling errors are not told apart from the others here, their backoff ends at _check_deadline
+    failed = caught_exception is not None or (
+        response is not None and response[0].status_code >= 500
+    )
+    if failed and deadline.remaining_seconds() <= 0:
+        raise DeadlineExceeded("No time left in the invocation for a retry")
+
+
+class _FitInDeadline:
+    # Mixin of the connection pools of the AWS clients
+    def urlopen(self, *args, **kwargs):
+        from urllib3 import Timeout
+
+        remaining = deadline.remaining_seconds()
+        if remaining < read_timeout_seconds:
+            kwargs["timeout"] = Timeout(
+                connect=connect_timeout_seconds, read=max(remaining, 0.001)
+            )
+        return super().urlopen(*args, **kwargs)
+
+
+def _fit_pools_in_deadline(pool_manager):
+    # Makes the connection pools that a urllib3 PoolManager creates from now on read the responses within what is
+    # left of the invocation
+    pool_manager.pool_classes_by_scheme = {
+        scheme: type(pool_class.__name__, (_FitInDeadline, pool_class), {})
+        for scheme, pool_class in pool_manager.pool_classes_by_scheme.items()
+    }
+    return pool_manager
+
+
+def _configure(client):
+    instrument_client(client)
+    # botocore has no public access to the PoolManager of a client
+    _fit_pools_in_deadline(count_connections(client._endpoint.http_session._manager))
+    client.meta.events.register("before-send", _check_deadline)
+    client.meta.events.register_first("needs-retry", _no_retry_after_deadline)
+    return client
+
+
+def get_client(service_name: str):
+    if service_name not in _clients:
+        with _lock:
+            if service_name not in _clients:
+                from boto3 import client
+
+                _clients[service_name] = _configure(
+                    client(service_name, config=client_config())
+                )
+    return _clients[service_name]
+
+
+def get_resource(service_name: str):
+    if service_name not in _resources:
+        with _lock:
+            if service_name not in _resources:
+                from boto3 import resource
+
+                _resources[service_name] = resource(
+                    service_name, config=client_config()
+                )
+                _configure(_resources[service_name].meta.client)
+    return _resources[service_name]
+
+
+def get_table(table_name: str):
+    if table_name not in _tables:
+        table = get_resource("dynamodb").Table(table_name)
+        with _lock:
+            _tables.setdefault(table_name, table)
+    return _tables[table_name]
+
+
+def thread_table(table_name: str):
+    # The Table of the calling thread, for the handlers that query from a thread pool
+    tables = getattr(_thread_local, "tables", None)
+    if tables is None:
+        tables = _thread_local.tables = {}
+    if table_name not in tables:
+        from boto3 import session
+
+        resource = session.Session().resource("dynamodb", config=client_config())
+        _configure(resource.meta.client)
+        tables[table_name] = resource.Table(table_name)
+    return tables[table_name]
+
+
+def get_http_pool():
+    # urllib3 pool of keep-alive connections, per host
+    if "pool" not in _http:
+        with _lock:
+            if "pool" not in _http:
+                from urllib3 import PoolManager
+                from urllib3.connection import HTTPConnection
+
+                _http["pool"] = count_connections(
+                    PoolManager(
+                        maxsize=max_pool_connections,
+                        retries=False,
+                        socket_options=HTTPConnection.default_socket_options
+                        + KEEPALIVE_SOCKET_OPTIONS,
+                    )
+                )
+    return _http["pool"]
+
+
+def get_requests_session():
+    # requests.Session of keep-alive connections, for the openai package. Its errors are retried by the callers
+    if "session" not in _http:
+        with _lock:
+            if "session" not in _http:
+                from requests import Session
+                from requests.adapters import HTTPAdapter
+                from urllib3.connection import HTTPConnection
+
+                class KeepAliveAdapter(HTTPAdapter):
+                    def init_poolmanager(self, *args, **kwargs):
+                        kwargs["socket_options"] = (
+                            HTTPConnection.default_socket_options
+                            + KEEPALIVE_SOCKET_OPTIONS
+                        )
+                        super().init_poolmanager(*args, **kwargs)
+                        count_connections(self.poolmanager)
+
+                session = Session()
+                session.mount(
+                    "https://",
+                    KeepAliveAdapter(pool_maxsize=max_pool_connections, max_retries=0),
+                )
+                session.mount(
+                    "http://",
+                    KeepAliveAdapter(pool_maxsize=max_pool_connections, max_retries=0),
+                )
+                _http["session"] = session
+    return _http["session"]
+
+
+class LazyProxy:
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._target_lock = Lock()
+
+    def __getattr__(self, name):
+        # Only called for the attributes the proxy itself does not have
+        if self._target is None:
+            with self._target_lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return getattr(self._target, name)
+
+
+def lazy_client(service_name: str) -> LazyProxy:
+    return LazyProxy(lambda: get_client(service_name))
+
+
+def lazy_table(table_name: str) -> LazyProxy:
+    return LazyProxy(lambda: get_table(table_name))
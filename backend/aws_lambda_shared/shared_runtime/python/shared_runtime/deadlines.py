@@ -0,0 +1,48 @@
+from time import monotonic
+
+from shared_runtime.env import env_float
+
+# Time budget of the current invocation, from context.get_remaining_time_in_millis() when instrument_handler starts
+# it. The calls to the dependencies take their timeouts from what is left, so a slow dependency fails the call in time
+# for the handler to handle the error, instead of Lambda killing the invocation. Outside of an invocation (scripts,
+# tests without a context) there is no deadline
+
+# Kept for the handler to report the error
+SAFETY_MARGIN_SECONDS = env_float("DEADLINE_SAFETY_MARGIN_SECONDS", 0.25)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self):
+        self._expires_at = None
+
+    def start(self, context):
+        if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+            self._expires_at = None
+            return
+        self._expires_at = (
+            monotonic()
+            + context.get_remaining_time_in_millis() / 1000
+            - SAFETY_MARGIN_SECONDS
+        )
+
+    def remaining_seconds(self) -> float:
+        if self._expires_at is None:
+            return float("inf")
+        return self._expires_at - monotonic()
+
+    def check(self):
+        if self.remaining_seconds() <= 0:
+            raise DeadlineExceeded("No time left in the invocation for the call")
+
+    def timeouts(self, connect_seconds: float, read_seconds: float) -> tuple:
+        # (connect, read) timeouts of a call: the defaults, shortened to what is left of the invocation
+        self.check()
+        remaining = self.remaining_seconds()
+        return min(connect_seconds, remaining), min(read_seconds, remaining)
+
+
+deadline = Deadline()
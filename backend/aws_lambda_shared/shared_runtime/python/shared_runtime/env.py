@@ -0,0 +1,15 @@
+from os import environ
+
+# Typed reads of the optional settings the functions get from their environment variables
+
+
+def env_int(name: str, default: int) -> int:
+    return int(environ.get(name, default))
+
+
+def env_float(name: str, default: float) -> float:
+    return float(environ.get(name, default))
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    return environ.get(name, str(default)).lower() == "true"
@@ -0,0 +1,91 @@
+import re
+from time import time
+
+from shared_runtime.messages import room_pk
+
+# The first request with an idempotency key claims it with a conditional write of its response, under
+# SK = "IDEMPOTENCY#<mutation>#<tenant id>#<key>" of the room, and the retries get the stored response until it expires
+
+IDEMPOTENCY_SK_PREFIX = "IDEMPOTENCY#"
+IDEMPOTENCY_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+def idempotency_key_or_none(idempotency_key):
+    if idempotency_key is None:
+        return None
+    if not IDEMPOTENCY_KEY_PATTERN.match(idempotency_key):
+        raise ValueError(
+            "Invalid idempotency key, use 1 to 64 letters, digits, '_' or '-'"
+        )
+    return idempotency_key
+
+
+def idempotency_item_key(
+    room_id: str, mutation: str, tenant_id: str, idempotency_key: str
+) -> dict:
+    return {
+        "PK": room_pk(room_id),
+        "SK": "{}{}#{}#{}".format(
+            IDEMPOTENCY_SK_PREFIX, mutation, tenant_id, idempotency_key
+        ),
+    }
+
+
+def _claim(table, item_key: dict, attributes: dict, ttl_seconds: int):
+    # Returns (the claim item, whether this request claimed the key)
+    item = {**item_key, **attributes, "ExpiresAt": int(time()) + ttl_seconds}
+    try:
+        table.put_item(Item=item, ConditionExpression="attribute_not_exists(PK)")
+        return item, True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        stored = table.get_item(Key=item_key, ConsistentRead=True).get("Item")
+        if stored is None:  # Released in between
+            return _claim(table, item_key, attributes, ttl_seconds)
+        return stored, False
+
+
+def claim(
+    table, item_key: dict, response: dict, ttl_seconds: int = DEFAULT_TTL_SECONDS
+):
+    # Returns (response to send back, whether this request claimed the key)
+    item, claimed = _claim(table, item_key, {"Response": response}, ttl_seconds)
+    return item["Response"], claimed
+
+
+def claim_write(
+    table,
+    item_key: dict,
+    response: dict,
+    written_id: str,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+):
+    # Returns (response to send back, W to save the item with, whether this request claimed the key): the response and
+    # the W of the first request with the key
+    item, claimed = _claim(
+        table,
+        item_key,
+        {"Response": response, "WrittenId": written_id},
+        ttl_seconds,
+    )
+    # Claims stored before WrittenId have none
+    return item["Response"], item.get("WrittenId", written_id), claimed
+
+
+def store_response(table, item_key: dict, response: dict):
+    # Replaces the stored response, e.g. with the answer once it is generated. Does nothing if the claim expired
+    try:
+        table.update_item(
+            Key=item_key,
+            UpdateExpression="SET #response = :response",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeNames={"#response": "Response"},
+            ExpressionAttributeValues={":response": response},
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def release(table, item_key: dict):
+    # Lets the key be used again, when the request it claimed failed for good
+    table.delete_item(Key=item_key)
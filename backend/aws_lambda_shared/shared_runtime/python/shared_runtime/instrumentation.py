@@ -0,0 +1,230 @@
+import platform
+from os import environ
+from time import perf_counter
+from random import random
+from threading import Lock
+from functools import wraps
+from contextlib import contextmanager
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+from shared_runtime import init_started_at
+from shared_runtime.deadlines import deadline
+from shared_runtime.observability import logger, metrics, tracer
+
+# Metrics of where the time and the money of each invocation go, emitted once per invocation by instrument_handler:
+# the calls and time of each dependency, the DynamoDB capacity, the OpenAI tokens, the new HTTP connections,
+# InitDuration and, on a sample, EstimatedCostMicroDollars. instrument_handler also starts the deadline
+
+DYNAMODB_READS = {"GetItem", "BatchGetItem", "Query", "Scan", "TransactGetItems"}
+DYNAMODB_WRITES = {
+    "PutItem",
+    "UpdateItem",
+    "DeleteItem",
+    "BatchWriteItem",
+    "TransactWriteItems",
+}
+AWS_DEPENDENCIES = {
+    "dynamodb": "DynamoDB",
+    "cognito-idp": "Cognito",
+    "secretsmanager": "SecretsManager",
+    "sqs": "SQS",
+}
+
+# us-east-1 on-demand prices in dollars, as in tests/benchmark/memory_sweep.py
+PRICE_PER_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+PRICE_PER_LAMBDA_REQUEST = 0.0000002
+PRICE_PER_READ_UNIT = 0.25 / 10**6
+PRICE_PER_WRITE_UNIT = 1.25 / 10**6
+PRICE_PER_PROMPT_TOKEN = 0.0015 / 1000
+PRICE_PER_COMPLETION_TOKEN = 0.002 / 1000
+
+_cold_start = True
+cost_sample_rate = float(environ.get("COST_SAMPLE_RATE", "0.1"))
+
+
+class Usage:
+    # What the current invocation used. Some handlers call AWS from several threads
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = {}  # dependency -> (calls, seconds)
+        self.read_capacity = 0.0
+        self.write_capacity = 0.0
+        self.scanned_items = 0
+        self.returned_items = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.http_requests = 0
+        self.http_new_connections = 0
+
+    def add_call(self, dependency: str, seconds: float):
+        with self._lock:
+            count, total = self.calls.get(dependency, (0, 0.0))
+            self.calls[dependency] = (count + 1, total + seconds)
+
+    def add_capacity(self, operation_name: str, consumed_capacity):
+        # A dict, or a list of them for the batch operations
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        capacity_units = sum(c.get("CapacityUnits", 0.0) for c in consumed_capacity)
+        with self._lock:
+            if operation_name in DYNAMODB_READS:
+                self.read_capacity += capacity_units
+            else:
+                self.write_capacity += capacity_units
+
+    def add_items(self, scanned: int, returned: int):
+        with self._lock:
+            self.scanned_items += scanned
+            self.returned_items += returned
+
+    def add_tokens(self, prompt: int, completion: int):
+        with self._lock:
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+
+    def add_http(self, requests: int, new_connections: int):
+        with self._lock:
+            self.http_requests += requests
+            self.http_new_connections += new_connections
+
+    def cost(self, duration_seconds: float, memory_mb: int) -> dict:
+        architecture = "arm64" if platform.machine() == "aarch64" else "x86_64"
+        gb_seconds = memory_mb / 1024 * duration_seconds
+        return {
+            "lambda": gb_seconds * PRICE_PER_GB_SECOND[architecture]
+            + PRICE_PER_LAMBDA_REQUEST,
+            "dynamodb": self.read_capacity * PRICE_PER_READ_UNIT
+            + self.write_capacity * PRICE_PER_WRITE_UNIT,
+            "openai": self.prompt_tokens * PRICE_PER_PROMPT_TOKEN
+            + self.completion_tokens * PRICE_PER_COMPLETION_TOKEN,
+        }
+
+
+usage = Usage()
+
+
+def _counting_connection_class(connection_class):
+    class CountingConnection(connection_class):
+        def connect(self):
+            # Once per socket: on the first request of the connection, or to replace a dropped one
+            usage.add_http(0, 1)
+            return super().connect()
+
+        def request(self, *args, **kwargs):
+            usage.add_http(1, 0)
+            return super().request(*args, **kwargs)
+
+    return CountingConnection
+
+
+def count_connections(pool_manager):
+    # Makes the connection pools that a urllib3 PoolManager creates from now on count the requests they send and the
+    # connections they open. Their classes are subclassed as they are, e.g. the ones of botocore
+    pool_manager.pool_classes_by_scheme = {
+        scheme: type(
+            pool_class.__name__,
+            (pool_class,),
+            {"ConnectionCls": _counting_connection_class(pool_class.ConnectionCls)},
+        )
+        for scheme, pool_class in pool_manager.pool_classes_by_scheme.items()
+    }
+    return pool_manager
+
+
+@contextmanager
+def dependency_call(dependency: str):
+    # Times a call to a dependency that is not an AWS client, e.g. OpenAI
+    started_at = perf_counter()
+    try:
+        with tracer.provider.in_subsegment("## " + dependency):
+            yield
+    finally:
+        usage.add_call(dependency, perf_counter() - started_at)
+
+
+# Hooks of the AWS clients. The DynamoDB operations that can report their consumed capacity are asked to
+def _ask_for_capacity(params, model, **kwargs):
+    if model.name in DYNAMODB_READS | DYNAMODB_WRITES:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _start_call(context, **kwargs):
+    context["instrumentation_started_at"] = perf_counter()
+
+
+def _end_call(parsed, model, context, **kwargs):
+    started_at = context.get("instrumentation_started_at")
+    service_name = model.service_model.service_name
+    if started_at is not None:
+        usage.add_call(
+            AWS_DEPENDENCIES.get(service_name, service_name),
+            perf_counter() - started_at,
+        )
+    if service_name == "dynamodb":
+        if parsed.get("ConsumedCapacity"):
+            usage.add_capacity(model.name, parsed["ConsumedCapacity"])
+        if "ScannedCount" in parsed:
+            usage.add_items(parsed["ScannedCount"], parsed.get("Count", 0))
+
+
+def instrument_client(client):
+    events = client.meta.events
+    events.register("provide-client-params.dynamodb", _ask_for_capacity)
+    events.register("before-call", _start_call)
+    events.register("after-call", _end_call)
+    return client
+
+
+def _count(name: str, value: float):
+    metrics.add_metric(name=name, unit=MetricUnit.Count, value=value)
+
+
+def _milliseconds(name: str, value: float):
+    metrics.add_metric(name=name, unit=MetricUnit.Milliseconds, value=value)
+
+
+def _emit(duration_seconds: float, context):
+    global _cold_start
+    if _cold_start:
+        _cold_start = False
+        _milliseconds("InitDuration", (perf_counter() - init_started_at) * 1000)
+    for dependency, (calls, seconds) in usage.calls.items():
+        _count(dependency + "Calls", calls)
+        _milliseconds(dependency + "Time", seconds * 1000)
+    if usage.read_capacity or usage.write_capacity:
+        _count("DynamoDBReadCapacity", usage.read_capacity)
+        _count("DynamoDBWriteCapacity", usage.write_capacity)
+    if usage.scanned_items:
+        _count("DynamoDBScannedItems", usage.scanned_items)
+        _count("DynamoDBReturnedItems", usage.returned_items)
+    if usage.prompt_tokens or usage.completion_tokens:
+        _count("OpenAIPromptTokens", usage.prompt_tokens)
+        _count("OpenAICompletionTokens", usage.completion_tokens)
+    if usage.http_requests:
+        _count("HttpRequests", usage.http_requests)
+        _count("HttpNewConnections", usage.http_new_connections)
+    if context is not None and random() < cost_sample_rate:
+        cost = usage.cost(duration_seconds, int(context.memory_limit_in_mb))
+        _count("EstimatedCostMicroDollars", sum(cost.values()) * 10**6)
+        logger.info(
+            "Estimated cost of the invocation, in dollars", extra={"cost": cost}
+        )
+
+
+def instrument_handler(handler):
+    # Innermost decorator of the handlers, so metrics.log_metrics flushes what it emits
+    @wraps(handler)
+    def instrumented(event, context):
+        usage.reset()
+        deadline.start(context)
+        started_at = perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            _emit(perf_counter() - started_at, context)
+
+    return instrumented
@@ -0,0 +1,168 @@
+import zlib
+from time import time
+
+from shared_runtime.messages import (
+    message_key,
+    room_meta_key,
+    visible_to,
+    new_message_id,
+    ulid_from_timestamp,
+    ulid_timestamp,
+    message_id_from_sk,
+)
+from shared_runtime.ttl_cache import TTLCache
+
+# Both versions of the message items are read: v1 (no V) with Text, AiGenerated, Username and TenantId, and v2 with
+# X (the text) or Z (the text compressed with zlib), U (the tenant of an AI message), W (the ULID of the write) and
+# ExpiresAt, from the RetentionDays of the room's META item. The readers resolve the usernames of the v2 items
+#
+# The cursors of messagesSince are the W of the messages rewound by SYNC_SETTLE_MS, as the writes of different
+# containers can land slightly out of order. The clients drop the messages they get twice by id
+
+COMPACT_VERSION = 2
+TENANT_AUDIENCE_SEPARATOR = "#TENANT#"
+SYNC_INDEX = "SyncIndex"
+SYNC_SETTLE_MS = 5000
+# What the readers project, of both versions
+MESSAGE_ATTRIBUTES = (
+    "PK",
+    "SK",
+    "VisibleTo",
+    "V",
+    "X",
+    "Z",
+    "U",
+    "W",
+    "Text",
+    "AiGenerated",
+    "Username",
+    "TenantId",
+)
+
+
+def compact_message_item(
+    room_id: str,
+    message_id: str,
+    tenant_id: str,
+    text: str,
+    ai_generated: bool,
+    expires_at: int = None,
+    compress_min_chars: int = 0,
+    written_id: str = None,
+) -> dict:
+    # compress_min_chars: texts at least this long are compressed, 0 never compresses. written_id: W, a new ULID by
+    # default
+    item = {
+        **message_key(room_id, message_id),
+        "VisibleTo": visible_to(room_id, tenant_id, ai_generated),
+        "V": COMPACT_VERSION,
+        "W": written_id or new_message_id(),
+    }
+    compressed = (
+        zlib.compress(text.encode(), 9)
+        if compress_min_chars and len(text) >= compress_min_chars
+        else None
+    )
+    if compressed is not None and len(compressed) < len(text.encode()):
+        item["Z"] = compressed
+    else:
+        item["X"] = text
+    if ai_generated:
+        item["U"] = tenant_id
+    if expires_at is not None:
+        item["ExpiresAt"] = expires_at
+    return item
+
+
+def sync_cursor(written_id: str) -> str:
+    # Cursor to resume from after the message written at 'written_id'
+    return ulid_from_timestamp(max(0, ulid_timestamp(written_id) - SYNC_SETTLE_MS))
+
+
+def read_message_item(item: dict) -> dict:
+    # Either version. The username is None for v2 items, and the cursor for the items without a W
+    if "V" not in item:
+        return {
+            "id": message_id_from_sk(item["SK"]),
+            "text": item["Text"],
+            "aiGenerated": item["AiGenerated"],
+            "tenantId": item["TenantId"],
+            "username": item.get("Username"),
+            "cursor": None,
+        }
+    ai_generated = "U" in item
+    if "Z" in item:
+        text = zlib.decompress(bytes(item["Z"])).decode()
+    else:
+        text = item.get("X", "")
+    return {
+        "id": message_id_from_sk(item["SK"]),
+        "text": text,
+        "aiGenerated": ai_generated,
+        "tenantId": (
+            item["U"]
+            if ai_generated
+            else item["VisibleTo"].split(TENANT_AUDIENCE_SEPARATOR, 1)[1]
+        ),
+        "username": None,
+        "cursor": sync_cursor(item["W"]) if "W" in item else None,
+    }
+
+
+def graphql_messages(items: list, room_id: str, username_resolver) -> list:
+    # Message objects of the GraphQL API, in the order of 'items'. Expired messages the TTL didn't delete yet are left
+    # out, and the usernames the compact items don't carry are resolved in one batch
+    messages = [read_message_item(item) for item in items if not is_expired(item)]
+    usernames = username_resolver.resolve_tenants(
+        [message["tenantId"] for message in messages if message["username"] is None]
+    )
+    return [
+        {
+            **message,
+            "roomId": room_id,
+            "username": (
+                message["username"]
+                if message["username"] is not None
+                else usernames[message["tenantId"]]
+            ),
+        }
+        for message in messages
+    ]
+
+
+def expires_at(message_id: str, retention_days) -> int:
+    # None when the room keeps its messages
+    if not retention_days:
+        return None
+    return ulid_timestamp(message_id) // 1000 + int(retention_days) * 24 * 60 * 60
+
+
+class RoomRetention:
+    # The retention of the rooms, cached per container. A change reaches the new messages within 'ttl_seconds'. The
+    # rooms without a RetentionDays get 'default_days', and a RetentionDays of 0 keeps the messages of a room
+    def __init__(self, table, default_days: int = 0, ttl_seconds: float = 60):
+        self._table = table
+        self._default_days = default_days
+        self._cache = TTLCache(max_size=1024, ttl_seconds=ttl_seconds)
+
+    def days(self, room_id: str):
+        retention_days = self._cache.get(room_id, False)
+        if retention_days is False:
+            item = self._table.get_item(
+                Key=room_meta_key(room_id), ProjectionExpression="RetentionDays"
+            ).get("Item")
+            retention_days = (
+                int(item["RetentionDays"])
+                if item and "RetentionDays" in item
+                else self._default_days
+            )
+            self._cache.put(room_id, retention_days)
+        return retention_days
+
+    def expires_at(self, room_id: str, message_id: str):
+        return expires_at(message_id, self.days(room_id))
+
+
+def is_expired(item: dict, now: float = None) -> bool:
+    # The TTL deletes the expired items up to a couple of days late, so the readers also check it
+    return "ExpiresAt" in item and int(item["ExpiresAt"]) <= (now or time())
@@ -0,0 +1,200 @@
+import re
+from os import urandom
+from json import dumps, loads
+from time import time
+from heapq import merge
+from threading import Lock
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
+# Messages are stored under PK = "ROOM#<room id>", SK = "MSG#<ULID>", and the VisibilityIndex (VisibleTo, SK) holds
+# each one under its audience: "ROOM#<room id>#AI" or "ROOM#<room id>#TENANT#<tenant id>". Messages not newer than the
+# ClearedBefore of the room's META item were cleared
+
+DEFAULT_ROOM_ID = "global"
+ROOM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+MESSAGE_SK_PREFIX = "MSG#"
+ROOM_META_SK = "META"
+ROOM_RECENT_SK = "RECENT"
+
+VISIBILITY_INDEX = "VisibilityIndex"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def room_id_or_default(room_id) -> str:
+    # Room ids come from the clients and end up in the keys, so they can't contain the '#' separator
+    if room_id is None:
+        return DEFAULT_ROOM_ID
+    if not ROOM_ID_PATTERN.match(room_id):
+        raise ValueError(
+            "Invalid room id, use 1 to 64 letters, digits, '_' or '-': {}".format(
+                room_id
+            )
+        )
+    return room_id
+
+
+def room_pk(room_id: str) -> str:
+    return "ROOM#" + room_id
+
+
+def message_sk(message_id: str) -> str:
+    return MESSAGE_SK_PREFIX + message_id
+
+
+def message_key(room_id: str, message_id: str) -> dict:
+    return {"PK": room_pk(room_id), "SK": message_sk(message_id)}
+
+
+def message_id_from_sk(sk: str) -> str:
+    return sk[len(MESSAGE_SK_PREFIX) :]
+
+
+def room_meta_key(room_id: str) -> dict:
+    return {"PK": room_pk(room_id), "SK": ROOM_META_SK}
+
+
+def room_recent_key(room_id: str) -> dict:
+    return {"PK": room_pk(room_id), "SK": ROOM_RECENT_SK}
+
+
+def ai_audience(room_id: str) -> str:
+    return room_pk(room_id) + "#AI"
+
+
+def tenant_audience(room_id: str, tenant_id: str) -> str:
+    return room_pk(room_id) + "#TENANT#" + tenant_id
+
+
+def visible_to(room_id: str, tenant_id: str, ai_generated: bool) -> str:
+    return ai_audience(room_id) if ai_generated else tenant_audience(room_id, tenant_id)
+
+
+# Message ids
+
+_CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_ulid_lock = Lock()
+_last_ulid = (0, 0)  # (timestamp ms, randomness) of the last id generated by this container
+
+
+def _encode_base32(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(_CROCKFORD_BASE32[index])
+    return "".join(reversed(chars))
+
+
+def ulid_from_timestamp(timestamp_ms: int, randomness: int = 0) -> str:
+    return _encode_base32(timestamp_ms, 10) + _encode_base32(randomness, 16)
+
+
+def ulid_timestamp(ulid: str) -> int:
+    timestamp_ms = 0
+    for char in ulid[:10]:
+        timestamp_ms = timestamp_ms * 32 + _CROCKFORD_BASE32.index(char)
+    return timestamp_ms
+
+
+def new_message_id() -> str:
+    # ULID: 48 bits of milliseconds + 80 random bits. Ids generated within the same millisecond
+    # by the same container increment the random part so they keep sorting in creation order
+    global _last_ulid
+    with _ulid_lock:
+        timestamp_ms = int(time() * 1000)
+        last_timestamp_ms, last_randomness = _last_ulid
+        if timestamp_ms <= last_timestamp_ms:
+            timestamp_ms = last_timestamp_ms
+            randomness = (last_randomness + 1) % (1 << 80)
+        else:
+            randomness = int.from_bytes(urandom(10), "big")
+        _last_ulid = (timestamp_ms, randomness)
+    return ulid_from_timestamp(timestamp_ms, randomness)
+
+
+# Clearing a room in O(1)
+
+
+def clear_room(table, room_id: str) -> str:
+    # Hides every message created up to now, whatever the size of the room
+    cleared_before = message_sk(ulid_from_timestamp(int(time() * 1000), (1 << 80) - 1))
+    table.update_item(
+        Key=room_meta_key(room_id),
+        UpdateExpression="SET ClearedBefore = :cleared_before",
+        ExpressionAttributeValues={":cleared_before": cleared_before},
+    )
+    return cleared_before
+
+
+def get_cleared_before(table, room_id: str):
+    response = table.get_item(
+        Key=room_meta_key(room_id), ProjectionExpression="ClearedBefore"
+    )
+    return response.get("Item", {}).get("ClearedBefore")
+
+
+def audience_condition(audience: str, cleared_before: str = None):
+    # Key condition on the VisibilityIndex for the visible messages of an audience
+    from boto3.dynamodb.conditions import Key
+
+    condition = Key("VisibleTo").eq(audience)
+    if cleared_before:
+        condition = condition & Key("SK").gt(cleared_before)
+    return condition
+
+
+# Pagination cursors. They are opaque to the client: the DynamoDB LastEvaluatedKey serialized as url-safe base64
+
+
+def encode_cursor(last_evaluated_key) -> str:
+    if not last_evaluated_key:
+        return None
+    return urlsafe_b64encode(
+        dumps(last_evaluated_key, separators=(",", ":")).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str):
+    if not cursor:
+        return None
+    try:
+        return loads(urlsafe_b64decode(cursor.encode()))
+    except ValueError as e:
+        raise ValueError("Invalid pagination cursor") from e
+
+
+def merge_newest_first(pages: dict, start_keys: dict, limit: int):
+    # pages is {audience: (items, last_evaluated_key)}, and the start keys returned drop the exhausted audiences, so
+    # an empty dict means there are no more pages
+    streams = [
+        [(item["SK"], audience, item) for item in items]
+        for audience, (items, _) in pages.items()
+    ]
+    merged = []
+    for _, audience, item in merge(*streams, key=lambda each: each[0], reverse=True):
+        if len(merged) == limit:
+            break
+        merged.append((audience, item))
+    next_start_keys = {}
+    for audience, (items, last_evaluated_key) in pages.items():
+        consumed = [item for audience_, item in merged if audience_ == audience]
+        if len(consumed) == len(items):
+            if last_evaluated_key:
+                next_start_keys[audience] = last_evaluated_key
+        elif consumed:
+            last = consumed[-1]
+            next_start_keys[audience] = {
+                "PK": last["PK"],
+                "SK": last["SK"],
+                "VisibleTo": last["VisibleTo"],
+            }
+        else:
+            next_start_keys[audience] = start_keys.get(audience)
+    return [item for _, item in merged], next_start_keys
+
+
+def page_size(limit) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
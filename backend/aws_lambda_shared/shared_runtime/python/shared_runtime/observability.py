@@ -0,0 +1,52 @@
+from os import environ
+from contextlib import nullcontext
+
+from aws_lambda_powertools import Logger, Metrics
+
+from shared_runtime.env import env_bool
+
+# The Powertools setup shared by the functions. The service and namespace can be overridden with the standard
+# Powertools environment variables. The Tracer imports the X-Ray SDK, most of the import time of a function, so
+# when tracing is disabled (POWERTOOLS_TRACE_DISABLED, set by LambdaPython unless active tracing is on) a
+# pass-through is used instead
+
+service = environ.get("POWERTOOLS_SERVICE_NAME", "websocket_chat")
+namespace = environ.get("POWERTOOLS_METRICS_NAMESPACE", "serverless_demo")
+
+
+class DisabledSubsegments:
+    def in_subsegment(self, name: str = None, **kwargs):
+        return nullcontext()
+
+
+class DisabledTracer:
+    provider = DisabledSubsegments()
+
+    def capture_lambda_handler(self, lambda_handler=None, **kwargs):
+        if lambda_handler is None:
+            return lambda function: function
+        return lambda_handler
+
+    def capture_method(self, method=None, **kwargs):
+        if method is None:
+            return lambda function: function
+        return method
+
+    def put_annotation(self, key: str, value):
+        pass
+
+    def put_metadata(self, key: str, value, namespace: str = None):
+        pass
+
+
+def _tracer():
+    if env_bool("POWERTOOLS_TRACE_DISABLED"):
+        return DisabledTracer()
+    from aws_lambda_powertools import Tracer
+
+    return Tracer(service=service)
+
+
+metrics = Metrics(service=service, namespace=namespace)
+tracer = _tracer()
+logger = Logger(service=service)
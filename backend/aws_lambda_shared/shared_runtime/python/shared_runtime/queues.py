@@ -0,0 +1,84 @@
+from json import dumps
+from uuid import uuid4
+from collections import deque
+
+# Producers depend on a queue with a 'send(body: dict)' method, so the SQS queue in the cloud can be swapped for the
+# LocalQueue below when running the pipeline offline
+
+
+class SqsQueue:
+    def __init__(self, queue_url: str, client_factory=None):
+        self._queue_url = queue_url
+        self._client_factory = client_factory
+        self._client = None
+
+    def send(self, body: dict):
+        if self._client is None:
+            if self._client_factory is None:
+                from boto3 import client
+
+                self._client = client("sqs")
+            else:
+                self._client = self._client_factory()
+        response = self._client.send_message(
+            QueueUrl=self._queue_url, MessageBody=dumps(body)
+        )
+        return response["MessageId"]
+
+
+class LocalQueue:
+    # In-process stand-in for an SQS queue with a redrive policy, feeding a Lambda handler that reports partial batch
+    # failures. Messages that fail 'max_receive_count' times end up in 'dead_letters'
+    def __init__(self, handler, max_receive_count: int = 3, batch_size: int = 1):
+        self._handler = handler
+        self._max_receive_count = max_receive_count
+        self._batch_size = batch_size
+        self._messages = deque()  # (message id, body, receive count)
+        self.dead_letters = []
+
+    def send(self, body: dict):
+        message_id = str(uuid4())
+        self._messages.append((message_id, dumps(body), 0))
+        return message_id
+
+    def __len__(self):
+        return len(self._messages)
+
+    def drain(self, context=None):
+        # Delivers messages until the queue is empty
+        while self._messages:
+            batch = [
+                self._messages.popleft()
+                for _ in range(min(self._batch_size, len(self._messages)))
+            ]
+            records = {
+                message_id: (body, receive_count + 1)
+                for message_id, body, receive_count in batch
+            }
+            event = {
+                "Records": [
+                    {
+                        "messageId": message_id,
+                        "receiptHandle": message_id,
+                        "body": body,
+                        "attributes": {"ApproximateReceiveCount": str(receive_count)},
+                        "messageAttributes": {},
+                        "eventSource": "aws:sqs",
+                    }
+                    for message_id, (body, receive_count) in records.items()
+                ]
+            }
+            try:
+                response = self._handler(event, context) or {}
+                failed = [
+                    failure["itemIdentifier"]
+                    for failure in response.get("batchItemFailures", [])
+                ]
+            except Exception:
+                failed = list(records)
+            for message_id in failed:
+                body, receive_count = records[message_id]
+                if receive_count >= self._max_receive_count:
+                    self.dead_letters.append(body)
+                else:
+                    self._messages.append((message_id, body, receive_count))
@@ -0,0 +1,84 @@
+from time import time
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Token buckets of the generic cell rate algorithm, one item per bucket: PK = "RATE#<bucket name>#<subject>" with Tat,
+# the time (epoch ms) at which the bucket is full again. A take is a single conditional write of Tat
+
+RATE_PK_PREFIX = "RATE#"
+RATE_SK = "RATE"
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, bucket: str, retry_after_seconds: float):
+        super().__init__(
+            "Too many requests, retry in {:.1f} seconds".format(retry_after_seconds)
+        )
+        self.bucket = bucket
+        self.retry_after_seconds = retry_after_seconds
+
+
+def rate_limit_key(name: str, subject: str) -> dict:
+    return {"PK": "{}{}#{}".format(RATE_PK_PREFIX, name, subject), "SK": RATE_SK}
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        table,
+        name: str,
+        per_minute: float,
+        burst: int,
+        metrics=None,
+        clock=time,
+    ):
+        self._table = table
+        self._name = name
+        self._metrics = metrics
+        self._interval_ms = 60_000 / per_minute
+        self._burst = burst
+        self._clock = clock
+
+    def take(self, subject: str, cost: float = 1):
+        # Raises RateLimitExceeded when the bucket of 'subject' doesn't have 'cost' tokens left
+        cost = min(cost, self._burst)
+        now = int(self._clock() * 1000)
+        increment = int(cost * self._interval_ms)
+        # Tat never goes past now + burst intervals, after which the bucket is full and its item no longer needed
+        expires_at = (now + int(self._burst * self._interval_ms)) // 1000 + 1
+        key = rate_limit_key(self._name, subject)
+        exceptions = self._table.meta.client.exceptions
+        try:
+            self._table.update_item(
+                Key=key,
+                UpdateExpression="SET Tat = :tat, ExpiresAt = :expires_at",
+                ConditionExpression="attribute_not_exists(Tat) OR Tat < :now",
+                ExpressionAttributeValues={
+                    ":tat": now + increment,
+                    ":now": now,
+                    ":expires_at": expires_at,
+                },
+            )
+            return
+        except exceptions.ConditionalCheckFailedException:
+            pass
+        limit = now + int((self._burst - cost) * self._interval_ms)
+        try:
+            self._table.update_item(
+                Key=key,
+                UpdateExpression="ADD Tat :increment SET ExpiresAt = :expires_at",
+                ConditionExpression="Tat <= :limit",
+                ExpressionAttributeValues={
+                    ":increment": increment,
+                    ":limit": limit,
+                    ":expires_at": expires_at,
+                },
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            )
+        except exceptions.ConditionalCheckFailedException as e:
+            tat = int(e.response.get("Item", {}).get("Tat", {}).get("N", limit))
+            if self._metrics:
+                self._metrics.add_metric(
+                    name=self._name + "RateLimited", unit=MetricUnit.Count, value=1
+                )
+            raise RateLimitExceeded(self._name, max(0, tat - limit) / 1000) from e
@@ -0,0 +1,185 @@
+from json import dumps
+
+from shared_runtime.messages import (
+    MESSAGE_SK_PREFIX,
+    ROOM_META_SK,
+    room_pk,
+    room_recent_key,
+    get_cleared_before,
+)
+from shared_runtime.message_items import MESSAGE_ATTRIBUTES
+
+# The RECENT item of a room holds its newest messages, kept up to date from the table stream, so the first page of a
+# room is a single GetItem. Every message with an SK greater than CompleteAfter is in it
+
+# ExpiresAt is left out, an expired message leaves the view when the TTL deletes it
+RECENT_ATTRIBUTES = MESSAGE_ATTRIBUTES
+
+DEFAULT_MAX_MESSAGES = 100
+# DynamoDB items are limited to 400 KB
+DEFAULT_MAX_BYTES = 300_000
+
+
+class RecentVersionConflict(Exception):
+    pass
+
+
+def empty_recent() -> dict:
+    return {"Messages": [], "ClearedBefore": "", "CompleteAfter": ""}
+
+
+def apply_changes(
+    recent: dict,
+    changes: list,
+    max_messages: int = DEFAULT_MAX_MESSAGES,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> dict:
+    # changes: ("put", message item), ("remove", SK) or ("clear", ClearedBefore), in stream order. Applying a change
+    # twice has no effect, so a batch can be retried
+    messages = {message["SK"]: message for message in recent["Messages"]}
+    cleared_before = recent.get("ClearedBefore") or ""
+    complete_after = recent.get("CompleteAfter") or ""
+    for kind, value in changes:
+        if kind == "put":
+            if value["SK"] > max(cleared_before, complete_after):
+                messages[value["SK"]] = {
+                    name: value[name] for name in RECENT_ATTRIBUTES if name in value
+                }
+        elif kind == "remove":
+            messages.pop(value, None)
+        elif kind == "clear" and value and value > cleared_before:
+            cleared_before = value
+    ordered = sorted(
+        (message for sk, message in messages.items() if sk > cleared_before),
+        key=lambda message: message["SK"],
+        reverse=True,
+    )
+    # Evict the oldest messages beyond the limits. The view is then only complete after the newest evicted one
+    size = sum(len(dumps(message, default=str)) for message in ordered)
+    while ordered and (len(ordered) > max_messages or size > max_bytes):
+        evicted = ordered.pop()
+        size -= len(dumps(evicted, default=str))
+        complete_after = max(complete_after, evicted["SK"])
+    return {
+        "Messages": ordered,
+        "ClearedBefore": cleared_before,
+        "CompleteAfter": complete_after,
+    }
+
+
+def recent_page(recent, audiences: list, limit: int):
+    # First page of the room for a reader of the 'audiences', in the format of merge_newest_first. None when the view
+    # does not hold enough of the room to answer, and the caller has to query the VisibilityIndex
+    if not recent:
+        return None
+    cleared_before = recent.get("ClearedBefore") or ""
+    complete = (recent.get("CompleteAfter") or "") <= cleared_before
+    visible = [
+        message
+        for message in recent["Messages"]
+        if message["VisibleTo"] in audiences and message["SK"] > cleared_before
+    ]
+    if len(visible) < limit and not complete:
+        return None
+    page = visible[:limit]
+    next_start_keys = {}
+    for audience in audiences:
+        consumed = [message for message in page if message["VisibleTo"] == audience]
+        remaining = len(
+            [message for message in visible if message["VisibleTo"] == audience]
+        ) > len(consumed)
+        if complete and not remaining:
+            continue  # Exhausted
+        if consumed:
+            last = consumed[-1]
+            next_start_keys[audience] = {
+                "PK": last["PK"],
+                "SK": last["SK"],
+                "VisibleTo": last["VisibleTo"],
+            }
+        else:
+            next_start_keys[audience] = None
+    return page, next_start_keys
+
+
+def room_changes(stream_records: list) -> dict:
+    # {room id: changes} from the records of the messages table stream, in stream order
+    from boto3.dynamodb.types import TypeDeserializer
+
+    deserializer = TypeDeserializer()
+    changes = {}
+    for record in stream_records:
+        keys = record["dynamodb"]["Keys"]
+        room_id = keys["PK"]["S"][len(room_pk("")) :]
+        sk = keys["SK"]["S"]
+        new_image = {
+            name: deserializer.deserialize(value)
+            for name, value in record["dynamodb"].get("NewImage", {}).items()
+        }
+        if sk.startswith(MESSAGE_SK_PREFIX):
+            change = (
+                ("remove", sk)
+                if record["eventName"] == "REMOVE"
+                else ("put", new_image)
+            )
+        elif sk == ROOM_META_SK and new_image.get("ClearedBefore"):
+            change = ("clear", new_image["ClearedBefore"])
+        else:
+            continue
+        changes.setdefault(room_id, []).append(change)
+    return changes
+
+
+def get_recent(table, room_id: str):
+    return table.get_item(Key=room_recent_key(room_id)).get("Item")
+
+
+def seed_recent(table, room_id: str, max_messages: int = DEFAULT_MAX_MESSAGES):
+    # Builds the view from the table, for a room that doesn't have one yet
+    from boto3.dynamodb.conditions import Key
+
+    response = table.query(
+        KeyConditionExpression=Key("PK").eq(room_pk(room_id))
+        & Key("SK").begins_with(MESSAGE_SK_PREFIX),
+        ScanIndexForward=False,
+        Limit=max_messages,
+    )
+    recent = empty_recent()
+    recent["ClearedBefore"] = get_cleared_before(table, room_id) or ""
+    recent["Messages"] = [
+        {name: item[name] for name in RECENT_ATTRIBUTES if name in item}
+        for item in response["Items"]
+    ]
+    if response.get("LastEvaluatedKey"):
+        recent["CompleteAfter"] = response["Items"][-1]["SK"]
+    return recent
+
+
+def update_recent(
+    table,
+    room_id: str,
+    changes: list,
+    max_messages: int = DEFAULT_MAX_MESSAGES,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+):
+    # Read, apply and write back the view of a room, if nobody else wrote it in between
+    item = get_recent(table, room_id)
+    recent = item or seed_recent(table, room_id, max_messages)
+    version = int(item["Version"]) if item else 0
+    updated = apply_changes(recent, changes, max_messages, max_bytes)
+    condition = (
+        {
+            "ConditionExpression": "Version = :version",
+            "ExpressionAttributeValues": {":version": version},
+        }
+        if item
+        else {"ConditionExpression": "attribute_not_exists(PK)"}
+    )
+    try:
+        table.put_item(
+            Item={**room_recent_key(room_id), **updated, "Version": version + 1},
+            **condition,
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException as e:
+        raise RecentVersionConflict(room_id) from e
+    return updated
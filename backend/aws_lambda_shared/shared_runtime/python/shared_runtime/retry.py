@@ -0,0 +1,32 @@
+from time import sleep
+from random import uniform
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def backoff_delay(attempt: int, base_delay: float = 0.1, max_delay: float = 5) -> float:
+    # Exponential backoff with full jitter. attempt starts at 0
+    return uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def retry_with_backoff(
+    fn,
+    retryable: tuple = (Exception,),
+    attempts: int = 3,
+    base_delay: float = 0.1,
+    max_delay: float = 5,
+    sleep=sleep,
+):
+    # Calls fn() until it succeeds, up to 'attempts' times. Only the 'retryable' exceptions are retried
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except retryable as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(
+                "Attempt {} failed, retrying in {:.2f}s: {}".format(attempt + 1, delay, e)
+            )
+            sleep(delay)
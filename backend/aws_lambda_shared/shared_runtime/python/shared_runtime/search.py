@@ -0,0 +1,154 @@
+import re
+from math import log
+from logging import getLogger
+from collections import Counter
+
+from shared_runtime.messages import (
+    MESSAGE_SK_PREFIX,
+    message_key,
+    message_sk,
+    message_id_from_sk,
+)
+from shared_runtime.message_items import read_message_item, is_expired
+
+logger = getLogger(__name__)
+
+# Inverted index of the messages, kept up to date from the table stream: one posting per message and term, under
+# PK = "SEARCH#<VisibleTo>#<term>" and SK = "<message id>", so a reader only reads the postings of its audiences
+
+SEARCH_PK_PREFIX = "SEARCH#"
+TERM_PATTERN = re.compile(r"\w+")
+MIN_TERM_CHARS = 2
+# Longer words are rarely searched, and would make long keys
+MAX_TERM_CHARS = 32
+# The most frequent terms of a message are indexed, to bound the writes of long messages
+MAX_TERMS_PER_MESSAGE = 32
+MAX_QUERY_TERMS = 5
+# Newest postings read per list. Older matches of very common terms are not found
+MAX_CANDIDATES_PER_LIST = 200
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have i if in is it its me my no not of on or so that the their them
+    then there these they this to was we were what when which who will with you your
+    """.split())
+
+
+def terms(text: str) -> Counter:
+    # {term: occurrences}
+    return Counter(
+        term
+        for term in (word.casefold() for word in TERM_PATTERN.findall(text))
+        if MIN_TERM_CHARS <= len(term) <= MAX_TERM_CHARS and term not in STOP_WORDS
+    )
+
+
+def query_terms(query: str) -> list:
+    # The distinct terms of a query, in order
+    found = list(terms(query))
+    if not found:
+        raise ValueError("The query has no searchable words")
+    if len(found) > MAX_QUERY_TERMS:
+        raise ValueError("Search at most {} words".format(MAX_QUERY_TERMS))
+    return found
+
+
+def posting_pk(audience: str, term: str) -> str:
+    return SEARCH_PK_PREFIX + audience + "#" + term
+
+
+def postings(item: dict) -> dict:
+    # {(PK, SK): posting} of a message item, of either version
+    message_id = message_id_from_sk(item["SK"])
+    hits = terms(read_message_item(item)["text"]).most_common(MAX_TERMS_PER_MESSAGE)
+    result = {}
+    for term, count in hits:
+        posting = {
+            "PK": posting_pk(item["VisibleTo"], term),
+            "SK": message_id,
+            "Hits": count,
+        }
+        if "ExpiresAt" in item:
+            posting["ExpiresAt"] = item["ExpiresAt"]
+        result[(posting["PK"], posting["SK"])] = posting
+    return result
+
+
+def posting_changes(stream_records: list):
+    # The postings to put and the keys of the postings to delete, from the records of the messages table stream (with
+    # the old images). A posting written or deleted twice in a batch only gets its last change, BatchWriteItem
+    # rejects duplicate keys. Applying the changes twice has no effect, so a batch can be retried
+    from boto3.dynamodb.types import TypeDeserializer
+
+    deserializer = TypeDeserializer()
+
+    def image(record: dict, name: str) -> dict:
+        return {
+            attribute: deserializer.deserialize(value)
+            for attribute, value in record["dynamodb"].get(name, {}).items()
+        }
+
+    changes = {}
+    for record in stream_records:
+        if not record["dynamodb"]["Keys"]["SK"]["S"].startswith(MESSAGE_SK_PREFIX):
+            continue
+        old, new = image(record, "OldImage"), image(record, "NewImage")
+        old_postings = postings(old) if old else {}
+        new_postings = postings(new) if new else {}
+        for key in old_postings.keys() - new_postings.keys():
+            changes[key] = None
+        for key, posting in new_postings.items():
+            # E.g. the migration setting a W changes no posting
+            if old_postings.get(key) != posting:
+                changes[key] = posting
+    puts = [posting for posting in changes.values() if posting is not None]
+    deletes = [
+        {"PK": pk, "SK": sk} for (pk, sk), posting in changes.items() if posting is None
+    ]
+    return puts, deletes
+
+
+def rank(posting_lists: list, cleared_before: str = None, now: float = None) -> list:
+    # Message ids, best match first. posting_lists: (term, postings read newest first) for each audience and term
+    # of the query. The score of a message adds up, for each term it contains, the dampened number of hits weighted
+    # by how rare the term is among the candidates (tf-idf). Ties go to the newest message
+    scores = {}
+    document_frequency = Counter()
+    matches = []
+    for term, items in posting_lists:
+        for posting in items:
+            if is_expired(posting, now):
+                continue
+            if cleared_before and message_sk(posting["SK"]) <= cleared_before:
+                continue
+            document_frequency[term] += 1
+            matches.append((term, posting["SK"], int(posting["Hits"])))
+    candidates = len({message_id for _, message_id, _ in matches})
+    for term, message_id, hits in matches:
+        weight = log(1 + candidates / document_frequency[term])
+        scores[message_id] = scores.get(message_id, 0.0) + (1 + log(hits)) * weight
+    return sorted(
+        scores, key=lambda message_id: (scores[message_id], message_id), reverse=True
+    )
+
+
+def get_messages(table, room_id: str, message_ids: list) -> list:
+    # The message items, in the order of 'message_ids', with one BatchGetItem. The messages deleted since they were
+    # indexed are left out
+    if not message_ids:
+        return []
+    request = {table.name: {"Keys": [message_key(room_id, m) for m in message_ids]}}
+    items = {}
+    # Unprocessed keys are retried a few times, like the usernames
+    for _ in range(3):
+        response = table.meta.client.batch_get_item(RequestItems=request)
+        for item in response["Responses"].get(table.name, []):
+            items[item["SK"]] = item
+        request = response.get("UnprocessedKeys")
+        if not request:
+            break
+    else:
+        logger.warning(
+            "{} messages left out of the results, still unprocessed after 3 attempts".format(
+                len(request[table.name]["Keys"])
+            )
+        )
+    return [items[message_sk(m)] for m in message_ids if message_sk(m) in items]
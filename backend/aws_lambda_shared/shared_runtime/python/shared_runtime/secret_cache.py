@@ -0,0 +1,117 @@
+from os import environ
+from json import loads
+from time import monotonic
+from threading import Lock, Thread
+from logging import getLogger
+
+from shared_runtime.clients import get_client
+from shared_runtime.env import env_float
+
+logger = getLogger(__name__)
+
+# Secrets Manager values cached for the lifetime of the container. A value is served from memory until it is
+# 'ttl_seconds' old. In its last 'refresh_ahead_seconds' the first reader triggers a refresh in a background thread
+# and keeps getting the cached value meanwhile, so warm invocations never wait on Secrets Manager. If a refresh
+# fails (e.g. throttling) the previous value is served until a later refresh succeeds
+
+
+def _secretsmanager_client():
+    return get_client("secretsmanager")
+
+
+class SecretCache:
+    def __init__(
+        self,
+        client_factory=_secretsmanager_client,
+        ttl_seconds: float = 300,
+        refresh_ahead_seconds: float = 60,
+        clock=monotonic,
+    ):
+        self._client_factory = client_factory
+        self._client = None
+        self._ttl_seconds = ttl_seconds
+        self._refresh_ahead_seconds = min(refresh_ahead_seconds, ttl_seconds)
+        self._clock = clock
+        self._lock = Lock()
+        self._entries = {}  # secret id -> (secret string, fetched at)
+        self._refreshing = set()
+
+    def get(self, secret_id: str) -> str:
+        entry = self._entries.get(secret_id)
+        if entry is None:
+            return self.refresh(secret_id)
+        value, fetched_at = entry
+        age = self._clock() - fetched_at
+        if age >= self._ttl_seconds:
+            try:
+                return self.refresh(secret_id)
+            except Exception:
+                logger.exception("Error refreshing secret, serving the cached value")
+                return value
+        if age >= self._ttl_seconds - self._refresh_ahead_seconds:
+            self._refresh_in_background(secret_id)
+        return value
+
+    def refresh(self, secret_id: str) -> str:
+        if self._client is None:
+            self._client = self._client_factory()
+        response = self._client.get_secret_value(SecretId=secret_id)
+        value = response["SecretString"]
+        with self._lock:
+            self._entries[secret_id] = (value, self._clock())
+        return value
+
+    def invalidate(self, secret_id: str):
+        with self._lock:
+            self._entries.pop(secret_id, None)
+
+    def _refresh_in_background(self, secret_id: str):
+        with self._lock:
+            if secret_id in self._refreshing:
+                return
+            self._refreshing.add(secret_id)
+
+        def refresh():
+            try:
+                self.refresh(secret_id)
+            except Exception:
+                logger.exception("Error refreshing secret in the background")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(secret_id)
+
+        Thread(target=refresh, daemon=True).start()
+
+
+secret_cache = SecretCache(
+    ttl_seconds=env_float("SECRET_CACHE_TTL_SECONDS", 300),
+    refresh_ahead_seconds=env_float("SECRET_CACHE_REFRESH_AHEAD_SECONDS", 60),
+)
+
+
+# By convention the functions receive the name of each secret in a '*_SECRET_NAME' environment variable, and a JSON
+# secret stores its value under a key equal to the secret name
+
+
+def _secret_value(secret_name: str, secret_string: str) -> str:
+    try:
+        secret = loads(secret_string)
+    except ValueError:
+        return secret_string
+    if isinstance(secret, dict) and secret_name in secret:
+        return secret[secret_name]
+    return secret_string
+
+
+def get_secret_from_env(env_var_name: str, cache: SecretCache = None) -> str:
+    assert env_var_name.endswith(
+        "_SECRET_NAME"
+    ), "Error: Secret names are read from '*_SECRET_NAME' environment variables"
+    secret_name = environ[env_var_name]
+    return _secret_value(secret_name, (cache or secret_cache).get(secret_name))
+
+
+def refresh_secret_from_env(env_var_name: str, cache: SecretCache = None) -> str:
+    # For when the secret was rotated and the cached value got rejected
+    secret_name = environ[env_var_name]
+    return _secret_value(secret_name, (cache or secret_cache).refresh(secret_name))
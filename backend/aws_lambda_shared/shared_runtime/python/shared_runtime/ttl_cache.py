@@ -0,0 +1,42 @@
+from time import monotonic
+from threading import Lock
+from collections import OrderedDict
+
+# In-memory LRU cache whose entries also expire after 'ttl_seconds'. Lives as long as the Lambda container
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 300, clock=monotonic):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key -> (value, expires at)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if self._clock() >= expires_at:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl_seconds: float = None):
+        ttl_seconds = self._ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def __len__(self):
+        return len(self._entries)
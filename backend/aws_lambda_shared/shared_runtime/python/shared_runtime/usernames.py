@@ -0,0 +1,128 @@
+from logging import getLogger
+
+from shared_runtime.ttl_cache import TTLCache
+from shared_runtime.clients import get_client
+from shared_runtime.env import env_float, env_int
+
+logger = getLogger(__name__)
+
+BATCH_GET_MAX_KEYS = 100
+
+# Resolves usernames cheapest source first: the token claims, a TTL cache per container, the user profiles table, and
+# last Cognito AdminGetUser, whose answer is written back to the profiles table
+
+
+def _cognito_client():
+    return get_client("cognito-idp")
+
+
+class UsernameResolver:
+    def __init__(
+        self,
+        user_pool_id: str,
+        profiles_table=None,
+        cognito_client_factory=_cognito_client,
+        cache: TTLCache = None,
+    ):
+        self._user_pool_id = user_pool_id
+        self._profiles_table = profiles_table
+        self._cognito_client_factory = cognito_client_factory
+        self._cognito_client = None
+        self._cache = cache or TTLCache(
+            max_size=env_int("USERNAME_CACHE_MAX_SIZE", 1024),
+            ttl_seconds=env_float("USERNAME_CACHE_TTL_SECONDS", 300),
+        )
+
+    def resolve(self, identity: dict) -> str:
+        claims = identity["claims"]
+        tenant_id = claims["sub"]
+        preferred_username = claims.get("preferred_username")
+        if preferred_username:
+            self._cache.put(tenant_id, preferred_username)
+            return preferred_username
+        preferred_username = self._cache.get(tenant_id)
+        if preferred_username:
+            return preferred_username
+        preferred_username = self._from_profiles_table(tenant_id)
+        if not preferred_username:
+            preferred_username = self._from_cognito(tenant_id)
+            self._save_profile(tenant_id, preferred_username)
+        self._cache.put(tenant_id, preferred_username)
+        return preferred_username
+
+    def resolve_tenants(self, tenant_ids) -> dict:
+        # {tenant id: preferred_username}, "" for the tenants without a profile
+        usernames = {}
+        missing = []
+        for tenant_id in set(tenant_ids):
+            preferred_username = self._cache.get(tenant_id)
+            if preferred_username is not None:
+                usernames[tenant_id] = preferred_username
+            else:
+                missing.append(tenant_id)
+        for start in range(0, len(missing), BATCH_GET_MAX_KEYS):
+            batch = missing[start : start + BATCH_GET_MAX_KEYS]
+            found = self._batch_from_profiles_table(batch)
+            for tenant_id in batch:
+                # The tenants without a profile are cached too, resolve still looks them up
+                usernames[tenant_id] = found.get(tenant_id, "")
+                self._cache.put(tenant_id, usernames[tenant_id])
+        return {tenant_id: usernames.get(tenant_id, "") for tenant_id in tenant_ids}
+
+    def _batch_from_profiles_table(self, tenant_ids: list) -> dict:
+        if self._profiles_table is None or not tenant_ids:
+            return {}
+        table_name = self._profiles_table.name
+        request = {
+            table_name: {
+                "Keys": [{"TenantId": tenant_id} for tenant_id in tenant_ids],
+                "ProjectionExpression": "TenantId, PreferredUsername",
+            }
+        }
+        usernames = {}
+        # Unprocessed keys are retried a few times, the tenants left get the fallback
+        for _ in range(3):
+            response = self._profiles_table.meta.client.batch_get_item(
+                RequestItems=request
+            )
+            for item in response["Responses"].get(table_name, []):
+                usernames[item["TenantId"]] = item.get("PreferredUsername", "")
+            request = response.get("UnprocessedKeys")
+            if not request:
+                break
+        else:
+            logger.warning(
+                "{} usernames left to the fallback, still unprocessed after 3 attempts".format(
+                    len(request[table_name]["Keys"])
+                )
+            )
+        return usernames
+
+    def _from_profiles_table(self, tenant_id: str):
+        if self._profiles_table is None:
+            return None
+        response = self._profiles_table.get_item(
+            Key={"TenantId": tenant_id}, ProjectionExpression="PreferredUsername"
+        )
+        return response.get("Item", {}).get("PreferredUsername")
+
+    def _from_cognito(self, tenant_id: str):
+        if self._cognito_client is None:
+            self._cognito_client = self._cognito_client_factory()
+        user = self._cognito_client.admin_get_user(
+            UserPoolId=self._user_pool_id, Username=tenant_id
+        )
+        for attribute in user["UserAttributes"]:
+            if attribute["Name"] == "preferred_username":
+                return attribute["Value"]
+        return None
+
+    def _save_profile(self, tenant_id: str, preferred_username: str):
+        if self._profiles_table is None or not preferred_username:
+            return
+        try:
+            self._profiles_table.put_item(
+                Item={"TenantId": tenant_id, "PreferredUsername": preferred_username}
+            )
+        except Exception:
+            logger.exception("Error saving the user profile")
@@ -0,0 +1,271 @@
+import os
+import sys
+from time import sleep
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+        "aws_lambda_shared",
+        "shared_runtime",
+        "python",
+    ),
+)
+
+from shared_runtime.messages import (
+    MESSAGE_SK_PREFIX,
+    DEFAULT_ROOM_ID,
+    room_pk,
+    room_meta_key,
+    message_id_from_sk,
+)
+from shared_runtime.message_items import compact_message_item, RoomRetention
+from move_messages_to_rooms import is_pre_room_item, pre_room_message_id
+
+# Rewrites the messages written before the rooms and the v1 items as v2 items of message_items.py, and gives the v2
+# items their ExpiresAt and W. The writes are conditional and paced, so it runs beside the chat and can run again
+#
+# Usage, from the backend folder:
+#   python scripts/migrate_messages.py --table <messages table> --profiles-table <user profiles table>
+#   python scripts/migrate_messages.py --table <messages table> --set-retention global=90 --retention-days 90
+
+MigrationResult = namedtuple(
+    "MigrationResult", ["compacted", "updated", "unchanged", "moved"]
+)
+
+
+def set_room_retention(table, room_id: str, retention_days: int):
+    table.update_item(
+        Key=room_meta_key(room_id),
+        UpdateExpression="SET RetentionDays = :retention_days",
+        ExpressionAttributeValues={":retention_days": retention_days},
+    )
+
+
+def save_profile(profiles_table, tenant_id: str, username: str):
+    # Only for the tenants without a profile, the triggers of the user pool keep the others up to date
+    try:
+        profiles_table.put_item(
+            Item={"TenantId": tenant_id, "PreferredUsername": username},
+            ConditionExpression="attribute_not_exists(TenantId)",
+        )
+    except profiles_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def save_username(profiles_table, item: dict, saved_tenants: set):
+    if (
+        profiles_table is not None
+        and item.get("Username")
+        and item["TenantId"] not in saved_tenants
+    ):
+        save_profile(profiles_table, item["TenantId"], item["Username"])
+        saved_tenants.add(item["TenantId"])
+
+
+def move_pre_room_item(
+    table,
+    profiles_table,
+    room_retention: RoomRetention,
+    item: dict,
+    saved_tenants: set,
+    compress_min_chars: int = 0,
+) -> str:
+    message_id = pre_room_message_id(item)
+    save_username(profiles_table, item, saved_tenants)
+    try:
+        table.put_item(
+            Item=compact_message_item(
+                DEFAULT_ROOM_ID,
+                message_id,
+                item["TenantId"],
+                item["Text"],
+                item["AiGenerated"],
+                room_retention.expires_at(DEFAULT_ROOM_ID, message_id),
+                compress_min_chars,
+                message_id,
+            ),
+            ConditionExpression="attribute_not_exists(PK)",
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass  # Moved by a run that stopped before deleting the old item
+    table.delete_item(Key={"PK": item["PK"], "SK": item["SK"]})
+    return "moved"
+
+
+def migrate_item(
+    table,
+    profiles_table,
+    room_retention: RoomRetention,
+    item: dict,
+    saved_tenants: set,
+    compress_min_chars: int = 0,
+) -> str:
+    # Returns which of the MigrationResult counters the item goes to
+    room_id = item["PK"][len(room_pk("")) :]
+    message_id = message_id_from_sk(item["SK"])
+    exceptions = table.meta.client.exceptions
+    if "V" not in item:
+        save_username(profiles_table, item, saved_tenants)
+        try:
+            table.put_item(
+                Item=compact_message_item(
+                    room_id,
+                    message_id,
+                    item["TenantId"],
+                    item["Text"],
+                    item["AiGenerated"],
+                    room_retention.expires_at(room_id, message_id),
+                    compress_min_chars,
+                    message_id,
+                ),
+                ConditionExpression="attribute_exists(PK) AND attribute_not_exists(V)",
+            )
+            return "compacted"
+        except exceptions.ConditionalCheckFailedException:
+            return "unchanged"
+    # The missing attributes, set in one update
+    missing = {}
+    if "W" not in item:
+        missing["W"] = message_id
+    if "ExpiresAt" not in item:
+        expires_at = room_retention.expires_at(room_id, message_id)
+        if expires_at is not None:
+            missing["ExpiresAt"] = expires_at
+    if not missing:
+        return "unchanged"
+    try:
+        table.update_item(
+            Key={"PK": item["PK"], "SK": item["SK"]},
+            UpdateExpression="SET "
+            + ", ".join("{0} = :{0}".format(name) for name in missing),
+            ConditionExpression=" AND ".join(
+                ["attribute_exists(PK)"]
+                + ["attribute_not_exists({})".format(name) for name in missing]
+            ),
+            ExpressionAttributeValues={
+                ":" + name: value for name, value in missing.items()
+            },
+        )
+        return "updated"
+    except exceptions.ConditionalCheckFailedException:
+        return "unchanged"
+
+
+def migrate_segment(
+    table,
+    profiles_table,
+    segment: int,
+    total_segments: int,
+    default_retention_days: int = 0,
+    compress_min_chars: int = 0,
+    write_interval_seconds: float = 0,
+    sleep=sleep,
+) -> MigrationResult:
+    room_retention = RoomRetention(table, default_retention_days)
+    saved_tenants = set()
+    counts = {field: 0 for field in MigrationResult._fields}
+    scan_kwargs = {"Segment": segment, "TotalSegments": total_segments}
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response["Items"]:
+            if is_pre_room_item(item):
+                migrate = move_pre_room_item
+            elif item["SK"].startswith(MESSAGE_SK_PREFIX):
+                migrate = migrate_item
+            else:
+                continue
+            counter = migrate(
+                table,
+                profiles_table,
+                room_retention,
+                item,
+                saved_tenants,
+                compress_min_chars,
+            )
+            counts[counter] += 1
+            if counter != "unchanged" and write_interval_seconds:
+                sleep(write_interval_seconds)
+        if "LastEvaluatedKey" not in response:
+            return MigrationResult(**counts)
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def migrate_table(
+    table_factory,
+    profiles_table_factory,
+    total_segments: int = 4,
+    default_retention_days: int = 0,
+    compress_min_chars: int = 0,
+    writes_per_second: float = 0,
+) -> MigrationResult:
+    # The factories build a table per segment, the boto3 resources are not thread safe
+    write_interval_seconds = (
+        total_segments / writes_per_second if writes_per_second else 0
+    )
+
+    def run(segment: int) -> MigrationResult:
+        return migrate_segment(
+            table_factory(),
+            profiles_table_factory(),
+            segment,
+            total_segments,
+            default_retention_days,
+            compress_min_chars,
+            write_interval_seconds,
+        )
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        results = list(executor.map(run, range(total_segments)))
+    return MigrationResult(*(sum(counts) for counts in zip(*results)))
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Migrate the messages to the compact items")
+    parser.add_argument("--table", required=True, help="Name of the messages table")
+    parser.add_argument("--profiles-table", help="Name of the user profiles table")
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--writes-per-second", type=float, default=100)
+    parser.add_argument("--retention-days", type=int, default=0)
+    parser.add_argument("--compress-min-chars", type=int, default=0)
+    parser.add_argument(
+        "--set-retention",
+        action="append",
+        default=[],
+        metavar="ROOM=DAYS",
+        help="Retention of a room, 0 keeps its messages. Can be repeated",
+    )
+    args = parser.parse_args(argv)
+
+    from boto3 import session
+
+    def table_factory(table_name: str):
+        return lambda: session.Session().resource("dynamodb").Table(table_name)
+
+    messages_table = table_factory(args.table)
+    for room_retention in args.set_retention:
+        room_id, retention_days = room_retention.split("=")
+        set_room_retention(messages_table(), room_id, int(retention_days))
+    result = migrate_table(
+        messages_table,
+        table_factory(args.profiles_table) if args.profiles_table else lambda: None,
+        args.segments,
+        args.retention_days,
+        args.compress_min_chars,
+        args.writes_per_second,
+    )
+    print(
+        "{} moved to the global room, {} compacted, {} updated, {} unchanged".format(
+            result.moved,
+            result.compacted,
+            result.updated,
+            result.unchanged,
+        )
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
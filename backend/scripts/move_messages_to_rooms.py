@@ -0,0 +1,88 @@
+import os
+import sys
+from uuid import UUID
+from datetime import datetime
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+        "aws_lambda_shared",
+        "shared_runtime",
+        "python",
+    ),
+)
+
+from shared_runtime.messages import DEFAULT_ROOM_ID, message_key, ulid_from_timestamp
+
+# Moves the messages written before the rooms to the global room, with ids computed from their date and uuid, so the
+# script can be stopped and run again. Usage, from the backend folder:
+#   python scripts/move_messages_to_rooms.py --table <messages table>
+
+
+def is_pre_room_item(item: dict) -> bool:
+    return "#" not in item["PK"] and "TenantId" in item and "Text" in item
+
+
+def pre_room_message_id(item: dict) -> str:
+    timestamp_ms = int(datetime.fromisoformat(item["SK"]).timestamp() * 1000)
+    return ulid_from_timestamp(timestamp_ms, UUID(item["PK"]).int & ((1 << 80) - 1))
+
+
+def moved_item(item: dict) -> dict:
+    return {
+        **item,
+        **message_key(DEFAULT_ROOM_ID, pre_room_message_id(item)),
+    }
+
+
+def move_segment(table, segment: int, total_segments: int) -> int:
+    moved = 0
+    scan_kwargs = {"Segment": segment, "TotalSegments": total_segments}
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response["Items"]:
+            if not is_pre_room_item(item):
+                continue
+            try:
+                table.put_item(
+                    Item=moved_item(item),
+                    ConditionExpression="attribute_not_exists(PK)",
+                )
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                pass  # Moved by a run that stopped before deleting the old item
+            table.delete_item(Key={"PK": item["PK"], "SK": item["SK"]})
+            moved += 1
+        if "LastEvaluatedKey" not in response:
+            return moved
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def move_table(table_factory, total_segments: int = 4) -> int:
+    # The factory builds a table per segment, the boto3 resources are not thread safe
+    def run(segment: int) -> int:
+        return move_segment(table_factory(), segment, total_segments)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        return sum(executor.map(run, range(total_segments)))
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Move the messages to the global room")
+    parser.add_argument("--table", required=True, help="Name of the messages table")
+    parser.add_argument("--segments", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    from boto3 import session
+
+    moved = move_table(
+        lambda: session.Session().resource("dynamodb").Table(args.table),
+        args.segments,
+    )
+    print("{} moved to the global room".format(moved))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import os
+
+from constructs import Construct
+
+from aws_lambda_shared.aws_lambda_construct import LambdaPython, resolve_profile
+
+
+class LambdaFunctions(Construct):
+    @property
+    def sync_user_profile_fn(self):
+        return self._sync_user_profile.target
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        user_profiles_table_name: str,
+        user_profiles_table_arn: str,
+        stage_name: str = None,
+        performance_profiles: dict = None,
+        **kwargs
+    ):
+        super().__init__(scope, id, **kwargs)
+
+        current_path = os.path.dirname(os.path.realpath(__file__))
+
+        self._sync_user_profile = LambdaPython(
+            self,
+            "SyncUserProfile",
+            code_path=current_path + "/runtime/sync_user_profile",
+            env_vars={
+                "USER_PROFILES_TABLE_NAME": user_profiles_table_name,
+                "POWERTOOLS_SERVICE_NAME": "user_pool",
+            },
+            layers=["shared_runtime"],
+            profile=resolve_profile(
+                performance_profiles, stage_name, "SyncUserProfile"
+            ),
+        ).add_policy(["dynamodb:PutItem"], [user_profiles_table_arn])
@@ -0,0 +1,27 @@
+from os import environ
+
+from shared_runtime.clients import lazy_table
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
+
+user_profiles_table_name = environ["USER_PROFILES_TABLE_NAME"]
+
+user_profiles_table = lazy_table(user_profiles_table_name)
+
+
+# Cognito trigger (post confirmation and post authentication). Copies the user attributes the chat needs to the
+# user profiles table, so a changed preferred_username is picked up on the next sign in
+@metrics.log_metrics(capture_cold_start_metric=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context
+@instrument_handler
+def handler(event, context):
+    user_attributes = event["request"]["userAttributes"]
+    if user_attributes.get("preferred_username"):
+        user_profiles_table.put_item(
+            Item={
+                "TenantId": user_attributes["sub"],
+                "PreferredUsername": user_attributes["preferred_username"],
+            }
+        )
+    return event  # Cognito triggers must return the event
@@ -2,6 +2,7 @@ from constructs import Construct
 from aws_cdk import (
     aws_cognito as cognito,
     aws_certificatemanager as certificatemanager,
+    aws_lambda,
     Duration,
 )
 
@@ -24,6 +25,7 @@ class UserPool(Construct):
         scope: Construct,
         id: str,
         props: dict,
+        user_profile_sync_fn: aws_lambda.IFunction = None,
         **kwargs,
     ):
         super().__init__(scope, id, **kwargs)
@@ -71,6 +73,18 @@ class UserPool(Construct):
             # ),
             # # By default a new iam role is created for sending sms messages. But sending sms requires additional config
         )
+
+        # TRIGGERS
+
+        if user_profile_sync_fn is not None:
+            # Keep the user profiles table in sync, on sign up and on every sign in
+            self._user_pool.add_trigger(
+                cognito.UserPoolOperation.POST_CONFIRMATION, user_profile_sync_fn
+            )
+            self._user_pool.add_trigger(
+                cognito.UserPoolOperation.POST_AUTHENTICATION, user_profile_sync_fn
+            )
+
         # APP-CLIENT
 
         client_write_attributes = (
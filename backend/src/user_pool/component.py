@@ -2,6 +2,8 @@ from constructs import Construct
 from aws_cdk import Stack, Environment, CfnOutput
 
 from src.user_pool.cognito.infrastructure import UserPool as UserPool_
+from src.user_pool.dynamodb.infrastructure import Tables
+from src.user_pool.aws_lambda.infrastructure import LambdaFunctions
 
 
 class UserPool(Stack):
@@ -13,19 +15,42 @@ class UserPool(Stack):
     def user_pool_client_id(self):
         return self._user_pool.user_pool_client_id
 
+    @property
+    def user_profiles_table_name(self):
+        return self._dynamo_tables.user_profiles_table_name
+
+    @property
+    def user_profiles_table_arn(self):
+        return self._dynamo_tables.user_profiles_table_arn
+
     def __init__(
         self,
         scope: Construct,
         id: str,
         env: Environment,
         props: dict,
+        stage_name: str,
         user_pool_id_output_key: str,
         user_pool_client_id_output_key: str,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, env=env, **kwargs)
 
-        self._user_pool = UserPool_(self, "UserPool", props)
+        self._dynamo_tables = Tables(self, "Dynamo")
+        lambda_functions = LambdaFunctions(
+            self,
+            "LambdaFunctions",
+            self._dynamo_tables.user_profiles_table_name,
+            self._dynamo_tables.user_profiles_table_arn,
+            stage_name=stage_name,
+            performance_profiles=props.get("performance_profiles"),
+        )
+        self._user_pool = UserPool_(
+            self,
+            "UserPool",
+            props,
+            user_profile_sync_fn=lambda_functions.sync_user_profile_fn,
+        )
 
         pool_id_output = CfnOutput(
             self, "PoolIdOutput", value=self._user_pool.user_pool_id
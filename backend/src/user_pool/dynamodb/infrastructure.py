@@ -0,0 +1,31 @@
+from constructs import Construct
+from aws_cdk import RemovalPolicy, aws_dynamodb as db
+
+
+class Tables(Construct):
+    @property
+    def user_profiles_table_arn(self):
+        return self._user_profiles_table.table_arn
+
+    @property
+    def user_profiles_table_name(self):
+        return self._user_profiles_table.table_name
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        props: dict = None,
+        **kwargs,
+    ):
+        super().__init__(scope, id, **kwargs)
+
+        # Copy of the user attributes the chat reads on every message, so it does not have to call Cognito
+        self._user_profiles_table = db.Table(
+            self,
+            "UserProfilesTable",
+            partition_key=db.Attribute(name="TenantId", type=db.AttributeType.STRING),
+            removal_policy=RemovalPolicy.DESTROY,
+            billing_mode=db.BillingMode.PAY_PER_REQUEST,
+            table_class=db.TableClass.STANDARD,
+        )
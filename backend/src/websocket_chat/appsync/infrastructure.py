@@ -14,6 +14,22 @@ from aws_cdk import (
 
 # https://adrianhesketh.com/2021/02/22/setting-up-appsync-graphql-subscriptions-with-typescript-and-cdk/
 
+# Fields that can be resolved either by their Lambda function or by APPSYNC_JS pipeline resolvers that go straight to
+# DynamoDB (runtime/*.js), skipping the Lambda invoke and its cold starts. Chosen per field with the "resolvers"
+# setting of the stack, "lambda" by default:
+#   "resolvers": {"Query.messages": "js", "Mutation.sendMessage": "js"}
+RESOLVER_KINDS = ("lambda", "js")
+JS_RESOLVER_FIELDS = ("Query.messages", "Mutation.sendMessage")
+SUBSCRIPTION_FIELDS = (
+    "onSendMessage",
+    "onSendMessages",
+    "onRequestAiResponse",
+    "onDeleteAllMessages",
+    "onAiResponseChunk",
+)
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+
 
 class WebsocketsApi(Construct):
     @property
@@ -30,14 +46,36 @@ class WebsocketsApi(Construct):
         id: str,
         user_pool_arn: str,
         user_pool_client_id: str,
-        query_messages_fn: aws_lambda.Function,
-        send_message_fn: aws_lambda.Function,
-        request_ai_response_fn: aws_lambda.Function,
-        delete_all_messages_fn: aws_lambda.Function,
+        query_messages_fn: aws_lambda.IFunction,
+        messages_since_fn: aws_lambda.IFunction,
+        search_messages_fn: aws_lambda.IFunction,
+        send_message_fn: aws_lambda.IFunction,
+        send_messages_fn: aws_lambda.IFunction,
+        request_ai_response_fn: aws_lambda.IFunction,
+        ai_response_worker_fn: aws_lambda.Function,
+        delete_all_messages_fn: aws_lambda.IFunction,
+        messages_table_arn: str,
+        user_profiles_table_arn: str,
+        resolver_kinds: dict = None,
+        messages_cache: dict = None,
+        message_storage: dict = None,
         **kwargs
     ):
         super().__init__(scope, id, **kwargs)
 
+        resolver_kinds = resolver_kinds or {}
+        for field, kind in resolver_kinds.items():
+            assert kind in RESOLVER_KINDS, "Unknown resolver kind: {}".format(kind)
+            assert (
+                kind == "lambda" or field in JS_RESOLVER_FIELDS
+            ), "No JS resolver for {}".format(field)
+        message_storage = message_storage or {}
+        # The JS resolvers can't decompress the texts
+        assert not (
+            message_storage.get("compress_min_chars")
+            and resolver_kinds.get("Query.messages") == "js"
+        ), "Compressed messages need the Lambda resolver of Query.messages"
+
         self._graphql_enpoint_name = "ChatDemoApi"
 
         self._api = appsync.GraphqlApi(
@@ -54,31 +92,185 @@ class WebsocketsApi(Construct):
                         ),
                         default_action=appsync.UserPoolDefaultAction.ALLOW,
                     ),
-                )
+                ),
+                # The functions publish events to subscribers through @aws_iam mutations
+                additional_authorization_modes=[
+                    appsync.AuthorizationMode(
+                        authorization_type=appsync.AuthorizationType.IAM
+                    )
+                ],
             ),
             xray_enabled=True,
         )
 
-        query_messages_source = self._api.add_lambda_data_source(
-            "QueryMessagesSource",
-            query_messages_fn,
+        # Optional cache of the messages query, per room, caller and page: {"type": "SMALL", "ttl_seconds": 5}. New
+        # messages show up in a cached page after up to 'ttl_seconds', the subscriptions deliver them meanwhile
+        messages_caching_config = None
+        if messages_cache:
+            api_cache = appsync.CfnApiCache(
+                self,
+                "ApiCache",
+                api_id=self._api.api_id,
+                api_caching_behavior="PER_RESOLVER_CACHING",
+                type=messages_cache["type"],
+                ttl=messages_cache["ttl_seconds"],
+                transit_encryption_enabled=True,
+                at_rest_encryption_enabled=True,
+            )
+            messages_caching_config = appsync.CachingConfig(
+                ttl=Duration.seconds(messages_cache["ttl_seconds"]),
+                caching_keys=[
+                    "$context.identity.sub",
+                    "$context.arguments.roomId",
+                    "$context.arguments.limit",
+                    "$context.arguments.after",
+                ],
+            )
+
+        if "js" in resolver_kinds.values():
+            self._add_js_sources(messages_table_arn, user_profiles_table_arn)
+
+        if resolver_kinds.get("Query.messages", "lambda") == "js":
+            query_messages_resolver = self._add_js_resolver(
+                "QueryMessageResolver",
+                "Query",
+                "messages",
+                "query_messages.js",
+                [
+                    self._js_function(
+                        "GetRecent", self._messages_source, "get_recent.js"
+                    ),
+                    self._js_function(
+                        "GetClearedBefore",
+                        self._messages_source,
+                        "get_cleared_before.js",
+                    ),
+                    self._js_function(
+                        "QueryAiAudience", self._messages_source, "query_audience.js"
+                    ),
+                    self._js_function(
+                        "QueryTenantAudience",
+                        self._messages_source,
+                        "query_audience.js",
+                    ),
+                    self._js_function(
+                        "GetUsernames",
+                        self._user_profiles_source,
+                        "get_usernames.js",
+                        {
+                            "__USER_PROFILES_TABLE_NAME__": self._user_profiles_table.table_name
+                        },
+                    ),
+                ],
+                caching_config=messages_caching_config,
+            )
+        else:
+            query_messages_source = self._api.add_lambda_data_source(
+                "QueryMessagesSource",
+                query_messages_fn,
+            )
+
+            query_messages_resolver = query_messages_source.create_resolver(
+                "QueryMessageResolver",
+                type_name="Query",
+                field_name="messages",
+                caching_config=messages_caching_config,
+            )
+        if messages_cache:
+            query_messages_resolver.node.add_dependency(api_cache)
+
+        # Never cached: the deltas depend on the time of the call
+        messages_since_source = self._api.add_lambda_data_source(
+            "MessagesSinceSource",
+            messages_since_fn,
         )
 
-        query_messages_source.create_resolver(
-            "QueryMessageResolver",
+        messages_since_source.create_resolver(
+            "MessagesSinceResolver",
             type_name="Query",
-            field_name="messages",
+            field_name="messagesSince",
+        )
+
+        search_messages_source = self._api.add_lambda_data_source(
+            "SearchMessagesSource",
+            search_messages_fn,
         )
 
-        send_message_source = self._api.add_lambda_data_source(
-            "SendMessageSource",
-            send_message_fn,
+        search_messages_source.create_resolver(
+            "SearchMessagesResolver",
+            type_name="Query",
+            field_name="searchMessages",
         )
 
-        send_message_source.create_resolver(
-            "SendMessageResolver",
+        if resolver_kinds.get("Mutation.sendMessage", "lambda") == "js":
+            self._add_js_resolver(
+                "SendMessageResolver",
+                "Mutation",
+                "sendMessage",
+                "send_message.js",
+                [
+                    self._js_function(
+                        "GetUsername", self._user_profiles_source, "get_username.js"
+                    ),
+                    self._js_function(
+                        "GetIdempotentResponse",
+                        self._messages_source,
+                        "get_idempotent_response.js",
+                    ),
+                    self._js_function(
+                        "ClaimIdempotencyKey",
+                        self._messages_source,
+                        "claim_idempotency_key.js",
+                    ),
+                    self._js_function(
+                        "TakeRateTokenFromFullBucket",
+                        self._messages_source,
+                        "take_rate_token.js",
+                    ),
+                    self._js_function(
+                        "TakeRateToken", self._messages_source, "take_rate_token.js"
+                    ),
+                    self._js_function(
+                        "ReleaseIdempotencyKey",
+                        self._messages_source,
+                        "release_idempotency_key.js",
+                    ),
+                    self._js_function(
+                        "GetRoomRetention",
+                        self._messages_source,
+                        "get_room_retention.js",
+                        {
+                            "__DEFAULT_RETENTION_DAYS__": str(
+                                message_storage.get("retention_days", 0)
+                            )
+                        },
+                    ),
+                    self._js_function(
+                        "PutMessage", self._messages_source, "put_message.js"
+                    ),
+                ],
+            )
+        else:
+            send_message_source = self._api.add_lambda_data_source(
+                "SendMessageSource",
+                send_message_fn,
+            )
+
+            send_message_source.create_resolver(
+                "SendMessageResolver",
+                type_name="Mutation",
+                field_name="sendMessage",
+            )
+
+        send_messages_source = self._api.add_lambda_data_source(
+            "SendMessagesSource",
+            send_messages_fn,
+        )
+
+        send_messages_source.create_resolver(
+            "SendMessagesResolver",
             type_name="Mutation",
-            field_name="sendMessage",
+            field_name="sendMessages",
         )
 
         request_ai_response_source = self._api.add_lambda_data_source(
@@ -102,3 +294,121 @@ class WebsocketsApi(Construct):
             type_name="Mutation",
             field_name="deleteAllMessages",
         )
+
+        # Mutations that only relay their arguments to the subscribers
+
+        none_source = self._api.add_none_data_source("NoneSource")
+
+        none_source.create_resolver(
+            "PublishAiResponseChunkResolver",
+            type_name="Mutation",
+            field_name="publishAiResponseChunk",
+            request_mapping_template=appsync.MappingTemplate.from_string(
+                '{"version": "2018-05-29", "payload": $util.toJson($context.arguments.chunk)}'
+            ),
+            response_mapping_template=appsync.MappingTemplate.from_string(
+                "$util.toJson($context.result)"
+            ),
+        )
+
+        none_source.create_resolver(
+            "PublishAiResponseResolver",
+            type_name="Mutation",
+            field_name="publishAiResponse",
+            request_mapping_template=appsync.MappingTemplate.from_string(
+                '{"version": "2018-05-29", "payload": $util.toJson($context.arguments.message)}'
+            ),
+            response_mapping_template=appsync.MappingTemplate.from_string(
+                "$util.toJson($context.result)"
+            ),
+        )
+
+        # Server side filtering of the events, from the arguments of each subscription
+
+        for field_name in SUBSCRIPTION_FIELDS:
+            none_source.create_resolver(
+                field_name[0].upper() + field_name[1:] + "Resolver",
+                type_name="Subscription",
+                field_name=field_name,
+                code=appsync.Code.from_asset(
+                    os.path.join(current_path, "runtime", "subscription_filter.js")
+                ),
+                runtime=appsync.FunctionRuntime.JS_1_0_0,
+            )
+
+        ai_response_worker_fn.add_environment("GRAPHQL_URL", self._api.graphql_url)
+        self._api.grant_mutation(
+            ai_response_worker_fn, "publishAiResponseChunk", "publishAiResponse"
+        )
+
+    def _add_js_sources(self, messages_table_arn: str, user_profiles_table_arn: str):
+        self._messages_source = self._api.add_dynamo_db_data_source(
+            "MessagesTableSource",
+            dynamodb.Table.from_table_attributes(
+                self,
+                "MessagesTable",
+                table_arn=messages_table_arn,
+                global_indexes=["VisibilityIndex"],
+            ),
+        )
+        self._user_profiles_table = dynamodb.Table.from_table_arn(
+            self, "UserProfilesTable", user_profiles_table_arn
+        )
+        self._user_profiles_source = appsync.DynamoDbDataSource(
+            self,
+            "UserProfilesTableSource",
+            api=self._api,
+            table=self._user_profiles_table,
+            read_only_access=True,
+        )
+
+    def _js_function(
+        self,
+        name: str,
+        data_source: appsync.BaseDataSource,
+        file_name: str,
+        substitutions: dict = None,
+    ):
+        # The resolvers have no environment variables, so the values they need from the stack are substituted for
+        # the placeholders of their code
+        path = os.path.join(current_path, "runtime", file_name)
+        if substitutions:
+            with open(path) as file:
+                code = file.read()
+            for placeholder, value in substitutions.items():
+                code = code.replace(placeholder, value)
+            code = appsync.Code.from_inline(code)
+        else:
+            code = appsync.Code.from_asset(path)
+        return appsync.AppsyncFunction(
+            self,
+            name + "Function",
+            api=self._api,
+            data_source=data_source,
+            name=name,
+            code=code,
+            runtime=appsync.FunctionRuntime.JS_1_0_0,
+        )
+
+    def _add_js_resolver(
+        self,
+        id: str,
+        type_name: str,
+        field_name: str,
+        file_name: str,
+        pipeline: list,
+        caching_config: appsync.CachingConfig = None,
+    ):
+        return appsync.Resolver(
+            self,
+            id,
+            api=self._api,
+            type_name=type_name,
+            field_name=field_name,
+            pipeline_config=pipeline,
+            caching_config=caching_config,
+            code=appsync.Code.from_asset(
+                os.path.join(current_path, "runtime", file_name)
+            ),
+            runtime=appsync.FunctionRuntime.JS_1_0_0,
+        )
@@ -0,0 +1,43 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table. Stores the response of the first request with an idempotency key, like
+// claim_write in shared_runtime/idempotency.py: WrittenId is the W of the message item, for the retries to save it
+// with. A concurrent request with the same key fails the condition, and its client gets the stored message on the next
+// retry
+
+const TTL_SECONDS = 24 * 60 * 60;
+
+export function request(ctx) {
+  const { roomId, tenantId, messageId, username, writtenId, cursor, idempotencyKey, idempotentResponse } = ctx.stash;
+  if (!idempotencyKey || idempotentResponse) {
+    runtime.earlyReturn(null);
+  }
+  return {
+    operation: 'PutItem',
+    key: util.dynamodb.toMapValues({
+      PK: 'ROOM#' + roomId,
+      SK: 'IDEMPOTENCY#sendMessage#' + tenantId + '#' + idempotencyKey,
+    }),
+    attributeValues: util.dynamodb.toMapValues({
+      Response: {
+        id: messageId,
+        roomId: roomId,
+        text: ctx.args.message.text,
+        aiGenerated: false,
+        tenantId: tenantId,
+        username: username,
+        cursor: cursor,
+      },
+      WrittenId: writtenId,
+      ExpiresAt: util.time.nowEpochSeconds() + TTL_SECONDS,
+    }),
+    condition: { expression: 'attribute_not_exists(PK)' },
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  return null;
+}
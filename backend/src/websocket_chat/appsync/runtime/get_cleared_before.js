@@ -0,0 +1,21 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table. Reads the watermark of the last clear of the room into the stash
+
+export function request(ctx) {
+  if (ctx.stash.recentPage) {
+    runtime.earlyReturn(null);
+  }
+  return {
+    operation: 'GetItem',
+    key: util.dynamodb.toMapValues({ PK: 'ROOM#' + ctx.stash.roomId, SK: 'META' }),
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  ctx.stash.clearedBefore = ctx.result && ctx.result.ClearedBefore ? ctx.result.ClearedBefore : null;
+  return null;
+}
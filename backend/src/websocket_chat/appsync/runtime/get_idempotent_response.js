@@ -0,0 +1,30 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table. Reads the response stored under the idempotency key of the request into
+// the stash, with the W the first request wrote its message with, see shared_runtime/idempotency.py
+
+export function request(ctx) {
+  if (!ctx.stash.idempotencyKey) {
+    runtime.earlyReturn(null);
+  }
+  return {
+    operation: 'GetItem',
+    key: util.dynamodb.toMapValues({
+      PK: 'ROOM#' + ctx.stash.roomId,
+      SK: 'IDEMPOTENCY#sendMessage#' + ctx.stash.tenantId + '#' + ctx.stash.idempotencyKey,
+    }),
+    consistentRead: true,
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  ctx.stash.idempotentResponse = ctx.result ? ctx.result.Response : null;
+  // Claims stored before WrittenId have none
+  if (ctx.result && ctx.result.WrittenId) {
+    ctx.stash.writtenId = ctx.result.WrittenId;
+  }
+  return null;
+}
@@ -0,0 +1,50 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table. Serves the first page of the room from its RECENT item when it can, like
+// recent_page in shared_runtime/recent_messages.py. The page goes to ctx.stash.recentPage, and the next functions
+// skip their reads when it is set
+
+function indexKey(item) {
+  return { PK: item.PK, SK: item.SK, VisibleTo: item.VisibleTo };
+}
+
+export function request(ctx) {
+  if (!ctx.stash.firstPage) {
+    runtime.earlyReturn(null);
+  }
+  return {
+    operation: 'GetItem',
+    key: util.dynamodb.toMapValues({ PK: 'ROOM#' + ctx.stash.roomId, SK: 'RECENT' }),
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  const recent = ctx.result;
+  if (!recent) {
+    return null;
+  }
+  const { audiences, limit } = ctx.stash;
+  const clearedBefore = recent.ClearedBefore || '';
+  const complete = (recent.CompleteAfter || '') <= clearedBefore;
+  const visible = recent.Messages.filter(
+    (message) => audiences.indexOf(message.VisibleTo) !== -1 && message.SK > clearedBefore
+  );
+  if (visible.length < limit && !complete) {
+    return null;
+  }
+  const page = visible.slice(0, limit);
+  const nextStartKeys = {};
+  audiences.forEach((audience) => {
+    const consumed = page.filter((message) => message.VisibleTo === audience);
+    const remaining = visible.filter((message) => message.VisibleTo === audience).length > consumed.length;
+    if (complete && !remaining) {
+      return;
+    }
+    nextStartKeys[audience] = consumed.length ? indexKey(consumed[consumed.length - 1]) : null;
+  });
+  ctx.stash.recentPage = { items: page, nextStartKeys };
+  return null;
+}
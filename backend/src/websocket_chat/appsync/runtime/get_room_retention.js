@@ -0,0 +1,25 @@
+import { util } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table. Reads the retention of the room into the stash, like RoomRetention in
+// shared_runtime/message_items.py: the RetentionDays of its META item, or the default of the stack
+
+// Substituted at synth, from the "message_storage" setting of the stack
+const DEFAULT_RETENTION_DAYS = Number('__DEFAULT_RETENTION_DAYS__');
+
+export function request(ctx) {
+  return {
+    operation: 'GetItem',
+    key: util.dynamodb.toMapValues({ PK: 'ROOM#' + ctx.stash.roomId, SK: 'META' }),
+    projection: { expression: 'RetentionDays' },
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  const meta = ctx.result;
+  ctx.stash.retentionDays =
+    meta && meta.RetentionDays !== undefined && meta.RetentionDays !== null ? meta.RetentionDays : DEFAULT_RETENTION_DAYS;
+  return null;
+}
@@ -0,0 +1,28 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the user profiles table. Resolves the caller's username from the token claims, otherwise from
+// the profiles table, and fails when the caller has no profile as it can't call Cognito
+
+export function request(ctx) {
+  const preferredUsername = ctx.identity.claims.preferred_username;
+  if (preferredUsername) {
+    ctx.stash.username = preferredUsername;
+    runtime.earlyReturn(preferredUsername);
+  }
+  return {
+    operation: 'GetItem',
+    key: util.dynamodb.toMapValues({ TenantId: ctx.identity.claims.sub }),
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  // The triggers write the profile on every sign in, so it is only missing if they failed
+  if (!ctx.result || !ctx.result.PreferredUsername) {
+    util.error('No profile for the caller, sign in again to create it', 'ProfileNotFound');
+  }
+  ctx.stash.username = ctx.result.PreferredUsername;
+  return ctx.stash.username;
+}
@@ -0,0 +1,68 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the user profiles table. The compact message items don't carry the username of their author
+// (see shared_runtime/message_items.py), so the authors of the messages read by the previous functions are resolved
+// here with one BatchGetItem, like UsernameResolver.resolve_tenants. The usernames go to ctx.stash.usernames
+
+// Substituted at synth, BatchGetItem needs the name of the table
+const USER_PROFILES_TABLE_NAME = '__USER_PROFILES_TABLE_NAME__';
+const BATCH_GET_MAX_KEYS = 100;
+
+function readItems(ctx) {
+  if (ctx.stash.recentPage) {
+    return ctx.stash.recentPage.items;
+  }
+  const items = [];
+  Object.keys(ctx.stash.pages).forEach((audience) => {
+    ctx.stash.pages[audience].items.forEach((item) => items.push(item));
+  });
+  return items;
+}
+
+function authorOf(item) {
+  if (item.U) {
+    return item.U;
+  }
+  return item.VisibleTo.split('#TENANT#')[1];
+}
+
+export function request(ctx) {
+  // The caller's own messages get the username of the token when it carries one
+  const usernames = {};
+  const preferredUsername = ctx.identity.claims.preferred_username;
+  if (preferredUsername) {
+    usernames[ctx.identity.claims.sub] = preferredUsername;
+  }
+  const tenantIds = [];
+  readItems(ctx).forEach((item) => {
+    if (item.V === undefined || item.V === null) {
+      return; // The username is in the item
+    }
+    const tenantId = authorOf(item);
+    if (usernames[tenantId] === undefined && tenantIds.indexOf(tenantId) === -1) {
+      tenantIds.push(tenantId);
+    }
+  });
+  ctx.stash.usernames = usernames;
+  if (tenantIds.length === 0) {
+    runtime.earlyReturn(null);
+  }
+  // Beyond the limit of a batch the authors get the fallback username
+  const keys = tenantIds.slice(0, BATCH_GET_MAX_KEYS).map((tenantId) => util.dynamodb.toMapValues({ TenantId: tenantId }));
+  const tables = {};
+  tables[USER_PROFILES_TABLE_NAME] = { keys, projection: { expression: 'TenantId, PreferredUsername' } };
+  return { operation: 'BatchGetItem', tables };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  const profiles = ctx.result.data[USER_PROFILES_TABLE_NAME] || [];
+  profiles.forEach((profile) => {
+    if (profile) {
+      ctx.stash.usernames[profile.TenantId] = profile.PreferredUsername;
+    }
+  });
+  return null;
+}
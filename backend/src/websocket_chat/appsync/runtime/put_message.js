@@ -0,0 +1,62 @@
+import { util } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table. Saves a human message as a compact item of shared_runtime/message_items.py,
+// with the W of the first request with the idempotency key, so a retry saves the same item again
+
+const CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ';
+
+// Same as ulid_timestamp and expires_at in shared_runtime
+function ulidTimestamp(ulid) {
+  let timestampMs = 0;
+  ulid
+    .slice(0, 10)
+    .split('')
+    .forEach((char) => {
+      timestampMs = timestampMs * 32 + CROCKFORD_BASE32.indexOf(char);
+    });
+  return timestampMs;
+}
+
+function expiresAt(messageId, retentionDays) {
+  if (!retentionDays) {
+    return null;
+  }
+  return Math.floor(ulidTimestamp(messageId) / 1000) + retentionDays * 24 * 60 * 60;
+}
+
+function messageResponse(ctx) {
+  if (ctx.stash.idempotentResponse) {
+    return ctx.stash.idempotentResponse;
+  }
+  return {
+    id: ctx.stash.messageId,
+    roomId: ctx.stash.roomId,
+    text: ctx.args.message.text,
+    aiGenerated: false,
+    tenantId: ctx.stash.tenantId,
+    username: ctx.stash.username,
+    cursor: ctx.stash.cursor,
+  };
+}
+
+export function request(ctx) {
+  const { roomId, tenantId } = ctx.stash;
+  const message = messageResponse(ctx);
+  const attributes = { VisibleTo: 'ROOM#' + roomId + '#TENANT#' + tenantId, V: 2, X: message.text, W: ctx.stash.writtenId };
+  const messageExpiresAt = expiresAt(message.id, ctx.stash.retentionDays);
+  if (messageExpiresAt !== null) {
+    attributes.ExpiresAt = messageExpiresAt;
+  }
+  return {
+    operation: 'PutItem',
+    key: util.dynamodb.toMapValues({ PK: 'ROOM#' + roomId, SK: 'MSG#' + message.id }),
+    attributeValues: util.dynamodb.toMapValues(attributes),
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  return messageResponse(ctx);
+}
@@ -0,0 +1,53 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table, used once per audience of ctx.stash.queries. Reads one page of the
+// audience from the VisibilityIndex, newest first, into ctx.stash.pages
+
+export function request(ctx) {
+  const query = ctx.stash.queries[ctx.stash.next];
+  ctx.stash.next += 1;
+  if (!query || ctx.stash.recentPage) {
+    runtime.earlyReturn(null);
+  }
+  const clearedBefore = ctx.stash.clearedBefore;
+  const startSk = query.startKey ? query.startKey.SK : null;
+  // Messages up to the watermark are hidden, so a cursor behind it has nothing left to read
+  if (startSk && clearedBefore && startSk <= clearedBefore) {
+    runtime.earlyReturn(null);
+  }
+  // The resolvers can't pass an ExclusiveStartKey, so the cursor becomes a bound on the sort key. BETWEEN is
+  // inclusive: the message at the cursor is read again and dropped in the response
+  let expression = 'VisibleTo = :audience';
+  const values = { ':audience': query.audience };
+  if (startSk && clearedBefore) {
+    expression += ' AND SK BETWEEN :cleared_before AND :start';
+    values[':cleared_before'] = clearedBefore;
+    values[':start'] = startSk;
+  } else if (startSk) {
+    expression += ' AND SK < :start';
+    values[':start'] = startSk;
+  } else if (clearedBefore) {
+    expression += ' AND SK > :cleared_before';
+    values[':cleared_before'] = clearedBefore;
+  }
+  return {
+    operation: 'Query',
+    index: 'VisibilityIndex',
+    query: { expression, expressionValues: util.dynamodb.toMapValues(values) },
+    scanIndexForward: false,
+    limit: ctx.stash.limit + (startSk && clearedBefore ? 1 : 0),
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  const query = ctx.stash.queries[ctx.stash.next - 1];
+  const startSk = query.startKey ? query.startKey.SK : null;
+  ctx.stash.pages[query.audience] = {
+    items: ctx.result.items.filter((item) => item.SK !== startSk && item.SK !== ctx.stash.clearedBefore),
+    hasMore: !!ctx.result.nextToken,
+  };
+  return null;
+}
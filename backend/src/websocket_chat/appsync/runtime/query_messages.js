@@ -0,0 +1,180 @@
+import { util } from '@aws-appsync/utils';
+
+// Query.messages without a Lambda hop: get_recent.js (first page only) -> get_cleared_before.js -> query_audience.js
+// (AI messages) -> query_audience.js (the caller's messages) -> get_usernames.js, merged newest first here. Mirrors the query_messages function, and its cursors are
+// interchangeable with the ones of the function: {audience: key of the last message read}, as url-safe base64 JSON
+
+// Same rules as room_id_or_default and page_size in shared_runtime/messages.py
+const DEFAULT_ROOM_ID = 'global';
+const ROOM_ID_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-';
+const DEFAULT_PAGE_SIZE = 50;
+const MAX_PAGE_SIZE = 100;
+
+function roomIdOrDefault(roomId) {
+  if (roomId === undefined || roomId === null) {
+    return DEFAULT_ROOM_ID;
+  }
+  const chars = roomId.split('');
+  if (chars.length < 1 || chars.length > 64 || chars.some((char) => ROOM_ID_CHARS.indexOf(char) === -1)) {
+    util.error("Invalid room id, use 1 to 64 letters, digits, '_' or '-': " + roomId, 'ValueError');
+  }
+  return roomId;
+}
+
+function pageSize(limit) {
+  if (limit === undefined || limit === null) {
+    return DEFAULT_PAGE_SIZE;
+  }
+  return Math.max(1, Math.min(limit, MAX_PAGE_SIZE));
+}
+
+function encodeCursor(startKeys) {
+  if (Object.keys(startKeys).length === 0) {
+    return null;
+  }
+  return util.base64Encode(JSON.stringify(startKeys)).split('+').join('-').split('/').join('_');
+}
+
+function decodeCursor(cursor) {
+  if (!cursor) {
+    return null;
+  }
+  const startKeys = JSON.parse(util.base64Decode(cursor.split('-').join('+').split('_').join('/')));
+  if (!startKeys || typeof startKeys !== 'object') {
+    util.error('Invalid pagination cursor', 'ValueError');
+  }
+  return startKeys;
+}
+
+// Both versions of the message items, like read_message_item in shared_runtime/message_items.py. The resolvers can't
+// decompress, so the stack doesn't allow compressed texts when Query.messages is resolved here
+// Same as sync_cursor in shared_runtime/message_items.py: the ULID of the write, rewound by SYNC_SETTLE_MS
+const CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ';
+const SYNC_SETTLE_MS = 5000;
+
+function ulidTimestamp(ulid) {
+  let timestampMs = 0;
+  ulid
+    .slice(0, 10)
+    .split('')
+    .forEach((char) => {
+      timestampMs = timestampMs * 32 + CROCKFORD_BASE32.indexOf(char);
+    });
+  return timestampMs;
+}
+
+function syncCursor(writtenId) {
+  let timestampMs = Math.max(0, ulidTimestamp(writtenId) - SYNC_SETTLE_MS);
+  let encoded = '';
+  [0, 1, 2, 3, 4, 5, 6, 7, 8, 9].forEach(() => {
+    encoded = CROCKFORD_BASE32.charAt(timestampMs % 32) + encoded;
+    timestampMs = Math.floor(timestampMs / 32);
+  });
+  return encoded + '0000000000000000';
+}
+
+function readMessageItem(item, usernames) {
+  if (item.V === undefined || item.V === null) {
+    return {
+      text: item.Text,
+      aiGenerated: item.AiGenerated,
+      tenantId: item.TenantId,
+      username: item.Username,
+      cursor: null,
+    };
+  }
+  const aiGenerated = item.U !== undefined && item.U !== null;
+  const tenantId = aiGenerated ? item.U : item.VisibleTo.split('#TENANT#')[1];
+  return {
+    text: item.X || '',
+    aiGenerated,
+    tenantId,
+    username: usernames[tenantId] || '',
+    cursor: item.W ? syncCursor(item.W) : null,
+  };
+}
+
+function indexKey(item) {
+  return { PK: item.PK, SK: item.SK, VisibleTo: item.VisibleTo };
+}
+
+export function request(ctx) {
+  const roomId = roomIdOrDefault(ctx.args.roomId);
+  const audiences = ['ROOM#' + roomId + '#AI', 'ROOM#' + roomId + '#TENANT#' + ctx.identity.claims.sub];
+  const cursor = decodeCursor(ctx.args.after);
+  // Audiences come from the identity, never from the cursor. Once one is exhausted it is left out of the cursor
+  const queries = [];
+  audiences.forEach((audience) => {
+    if (cursor === null) {
+      queries.push({ audience, startKey: null });
+    } else if (Object.keys(cursor).indexOf(audience) !== -1) {
+      queries.push({ audience, startKey: cursor[audience] });
+    }
+  });
+  ctx.stash.roomId = roomId;
+  ctx.stash.audiences = audiences;
+  ctx.stash.firstPage = cursor === null;
+  ctx.stash.limit = pageSize(ctx.args.limit);
+  ctx.stash.queries = queries;
+  ctx.stash.next = 0;
+  ctx.stash.pages = {};
+  return {};
+}
+
+function mergeNewestFirst(limit, queries, pages) {
+  const read = [];
+  queries.forEach((query) => {
+    const page = pages[query.audience];
+    if (page) {
+      page.items.forEach((item) => read.push({ audience: query.audience, item }));
+    }
+  });
+  read.sort((a, b) => (a.item.SK < b.item.SK ? 1 : a.item.SK > b.item.SK ? -1 : 0));
+  const merged = read.slice(0, limit);
+
+  // Start keys of the next page, as in merge_newest_first. An audience skipped because of the watermark is dropped
+  const nextStartKeys = {};
+  queries.forEach((query) => {
+    const page = pages[query.audience];
+    if (!page) {
+      return;
+    }
+    const consumed = merged.filter((each) => each.audience === query.audience);
+    if (consumed.length === page.items.length) {
+      if (page.hasMore) {
+        nextStartKeys[query.audience] = page.items.length
+          ? indexKey(page.items[page.items.length - 1])
+          : query.startKey;
+      }
+    } else if (consumed.length) {
+      nextStartKeys[query.audience] = indexKey(consumed[consumed.length - 1].item);
+    } else {
+      nextStartKeys[query.audience] = query.startKey;
+    }
+  });
+
+  return { items: merged.map((each) => each.item), nextStartKeys };
+}
+
+export function response(ctx) {
+  const { roomId, limit, queries, pages, recentPage, usernames } = ctx.stash;
+  const { items, nextStartKeys } = recentPage || mergeNewestFirst(limit, queries, pages);
+  // Oldest first, as the chat displays them. Expired messages the TTL didn't delete yet are left out
+  const now = util.time.nowEpochSeconds();
+  const messages = items
+    .reverse()
+    .filter((item) => !item.ExpiresAt || item.ExpiresAt > now)
+    .map((item) => {
+      const message = readMessageItem(item, usernames || {});
+      return {
+        id: item.SK.slice('MSG#'.length),
+        roomId,
+        text: message.text,
+        aiGenerated: message.aiGenerated,
+        username: message.username,
+        tenantId: message.tenantId,
+        cursor: message.cursor,
+      };
+    });
+  return { items: messages, nextToken: encodeCursor(nextStartKeys) };
+}
@@ -0,0 +1,32 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table, after take_rate_token.js. Rejects a request over the rate limit, once it
+// released the idempotency key it claimed, like release in shared_runtime/idempotency.py, so the key can be retried
+
+function rejectRequest() {
+  util.error('Too many requests, retry in a few seconds', 'RateLimitExceeded');
+}
+
+export function request(ctx) {
+  const { roomId, tenantId, idempotencyKey, rateLimitExceeded } = ctx.stash;
+  if (!rateLimitExceeded) {
+    runtime.earlyReturn(null);
+  }
+  if (!idempotencyKey) {
+    rejectRequest();
+  }
+  return {
+    operation: 'DeleteItem',
+    key: util.dynamodb.toMapValues({
+      PK: 'ROOM#' + roomId,
+      SK: 'IDEMPOTENCY#sendMessage#' + tenantId + '#' + idempotencyKey,
+    }),
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    util.error(ctx.error.message, ctx.error.type);
+  }
+  rejectRequest();
+}
@@ -0,0 +1,76 @@
+import { util } from '@aws-appsync/utils';
+
+// Mutation.sendMessage without a Lambda hop: get_username.js -> get_idempotent_response.js -> claim_idempotency_key.js
+// -> take_rate_token.js (twice) -> release_idempotency_key.js -> get_room_retention.js -> put_message.js. Mirrors the
+// send_message function
+
+// Same rules as room_id_or_default in shared_runtime/messages.py and idempotency_key_or_none in
+// shared_runtime/idempotency.py
+const DEFAULT_ROOM_ID = 'global';
+const ID_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-';
+
+function isValidId(value) {
+  const chars = value.split('');
+  return chars.length >= 1 && chars.length <= 64 && !chars.some((char) => ID_CHARS.indexOf(char) === -1);
+}
+
+function roomIdOrDefault(roomId) {
+  if (roomId === undefined || roomId === null) {
+    return DEFAULT_ROOM_ID;
+  }
+  if (!isValidId(roomId)) {
+    util.error("Invalid room id, use 1 to 64 letters, digits, '_' or '-': " + roomId, 'ValueError');
+  }
+  return roomId;
+}
+
+function idempotencyKeyOrNull(idempotencyKey) {
+  if (idempotencyKey === undefined || idempotencyKey === null) {
+    return null;
+  }
+  if (!isValidId(idempotencyKey)) {
+    util.error("Invalid idempotency key, use 1 to 64 letters, digits, '_' or '-'", 'ValueError');
+  }
+  return idempotencyKey;
+}
+
+// Same as sync_cursor in shared_runtime/message_items.py: the ULID of the write, rewound by SYNC_SETTLE_MS
+const CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ';
+const SYNC_SETTLE_MS = 5000;
+
+function ulidTimestamp(ulid) {
+  let timestampMs = 0;
+  ulid
+    .slice(0, 10)
+    .split('')
+    .forEach((char) => {
+      timestampMs = timestampMs * 32 + CROCKFORD_BASE32.indexOf(char);
+    });
+  return timestampMs;
+}
+
+function syncCursor(writtenId) {
+  let timestampMs = Math.max(0, ulidTimestamp(writtenId) - SYNC_SETTLE_MS);
+  let encoded = '';
+  [0, 1, 2, 3, 4, 5, 6, 7, 8, 9].forEach(() => {
+    encoded = CROCKFORD_BASE32.charAt(timestampMs % 32) + encoded;
+    timestampMs = Math.floor(timestampMs / 32);
+  });
+  return encoded + '0000000000000000';
+}
+
+export function request(ctx) {
+  ctx.stash.roomId = roomIdOrDefault(ctx.args.message.roomId);
+  ctx.stash.idempotencyKey = idempotencyKeyOrNull(ctx.args.message.idempotencyKey);
+  ctx.stash.tenantId = ctx.identity.claims.sub;
+  // ULIDs, like new_message_id, so the sort key orders messages by creation time
+  ctx.stash.messageId = util.autoUlid();
+  // W of the item, see put_message.js
+  ctx.stash.writtenId = util.autoUlid();
+  ctx.stash.cursor = syncCursor(ctx.stash.writtenId);
+  return {};
+}
+
+export function response(ctx) {
+  return ctx.prev.result;
+}
@@ -0,0 +1,36 @@
+import { util, extensions } from '@aws-appsync/utils';
+
+// Resolver of every subscription field. Turns the arguments of the subscription into an enhanced filter, so AppSync
+// drops the events the client didn't ask for before sending them, instead of pushing every event of every room
+
+// Argument -> [field of the published payload, operator]
+const FILTERS = {
+  roomId: ['roomId', 'eq'],
+  tenantId: ['tenantId', 'eq'],
+  statuses: ['status', 'in'],
+  aiGenerated: ['aiGenerated', 'eq'],
+};
+
+export function request(ctx) {
+  // A tenant's own messages are only theirs to receive
+  const ownMessages = ['onSendMessage', 'onSendMessages'].indexOf(ctx.info.fieldName) !== -1;
+  if (ownMessages && ctx.args.tenantId !== ctx.identity.sub) {
+    util.unauthorized();
+  }
+  return { payload: null };
+}
+
+export function response(ctx) {
+  const filter = {};
+  Object.keys(FILTERS).forEach((argument) => {
+    const value = ctx.args[argument];
+    if (value !== undefined && value !== null) {
+      const [field, operator] = FILTERS[argument];
+      filter[field] = { [operator]: value };
+    }
+  });
+  if (Object.keys(filter).length) {
+    extensions.setSubscriptionFilter(util.transform.toSubscriptionFilter(filter));
+  }
+  return null;
+}
@@ -0,0 +1,64 @@
+import { util, runtime } from '@aws-appsync/utils';
+
+// Pipeline function on the messages table, used twice in a row like the two writes of RateLimiter.take. The retries of
+// a claimed idempotency key take no token, and release_idempotency_key.js rejects a request over the limit
+
+// Same limits as the SendMessage function, see aws_lambda/infrastructure.py
+const BUCKET_NAME = 'SendMessage';
+const PER_MINUTE = 30;
+const BURST = 10;
+
+export function request(ctx) {
+  if (ctx.stash.rateTokenTaken || ctx.stash.idempotentResponse) {
+    runtime.earlyReturn(null);
+  }
+  const interval = Math.floor(60000 / PER_MINUTE);
+  const now = util.time.nowEpochMilliSeconds();
+  const expiresAt = Math.floor((now + BURST * interval) / 1000) + 1;
+  const key = util.dynamodb.toMapValues({
+    PK: 'RATE#' + BUCKET_NAME + '#' + ctx.identity.claims.sub,
+    SK: 'RATE',
+  });
+  if (!ctx.stash.rateBucketNotFull) {
+    return {
+      operation: 'UpdateItem',
+      key: key,
+      update: {
+        expression: 'SET Tat = :tat, ExpiresAt = :expires_at',
+        expressionValues: util.dynamodb.toMapValues({ ':tat': now + interval, ':expires_at': expiresAt }),
+      },
+      condition: {
+        expression: 'attribute_not_exists(Tat) OR Tat < :now',
+        expressionValues: util.dynamodb.toMapValues({ ':now': now }),
+      },
+    };
+  }
+  return {
+    operation: 'UpdateItem',
+    key: key,
+    update: {
+      expression: 'ADD Tat :increment SET ExpiresAt = :expires_at',
+      expressionValues: util.dynamodb.toMapValues({ ':increment': interval, ':expires_at': expiresAt }),
+    },
+    condition: {
+      expression: 'Tat <= :limit',
+      expressionValues: util.dynamodb.toMapValues({ ':limit': now + (BURST - 1) * interval }),
+    },
+  };
+}
+
+export function response(ctx) {
+  if (ctx.error) {
+    if (ctx.error.type !== 'DynamoDB:ConditionalCheckFailedException') {
+      util.error(ctx.error.message, ctx.error.type);
+    }
+    if (ctx.stash.rateBucketNotFull) {
+      ctx.stash.rateLimitExceeded = true;
+      return null;
+    }
+    ctx.stash.rateBucketNotFull = true;
+    return null;
+  }
+  ctx.stash.rateTokenTaken = true;
+  return null;
+}
@@ -1,27 +1,90 @@
 import os
 
 from constructs import Construct
-from aws_cdk import aws_iam as iam, Duration
+from aws_cdk import (
+    aws_iam as iam,
+    aws_sqs as sqs,
+    aws_dynamodb as dynamodb,
+    aws_lambda,
+    aws_lambda_event_sources as event_sources,
+    Duration,
+)
 
-from aws_lambda_shared.aws_lambda_construct import LambdaPython
+from aws_lambda_shared.aws_lambda_construct import LambdaPython, resolve_profile
+
+
+def completion_cache_env_vars(completion_cache: dict = None) -> dict:
+    # The cache of the model's answers is opt-in, e.g.:
+    #   "completion_cache": {"ttl_seconds": 3600, "max_size": 256, "history_messages": 2}
+    # See ai_response_worker/completion_cache.py
+    if not completion_cache:
+        return {}
+    return {
+        "COMPLETION_CACHE_TTL_SECONDS": str(completion_cache["ttl_seconds"]),
+        "COMPLETION_CACHE_MAX_SIZE": str(completion_cache.get("max_size", 256)),
+        "COMPLETION_CACHE_HISTORY_MESSAGES": str(
+            completion_cache.get("history_messages", 2)
+        ),
+    }
+
+
+def completion_routing_env_vars(completion_routing: dict = None) -> dict:
+    # e.g. "completion_routing": {"hedge_percentile": 95, "backup_model": "gpt-3.5-turbo-16k", "backup_api_base": ""}
+    completion_routing = completion_routing or {}
+    return {
+        "COMPLETION_HEDGE_PERCENTILE": str(
+            completion_routing.get("hedge_percentile", 95)
+        ),
+        "COMPLETION_BACKUP_MODEL": completion_routing.get("backup_model", ""),
+        "COMPLETION_BACKUP_API_BASE": completion_routing.get("backup_api_base", ""),
+    }
+
+
+def message_storage_env_vars(message_storage: dict = None) -> dict:
+    # e.g. "message_storage": {"retention_days": 90, "compress_min_chars": 1000}, both off by default
+    message_storage = message_storage or {}
+    return {
+        "DEFAULT_RETENTION_DAYS": str(message_storage.get("retention_days", 0)),
+        "COMPRESS_MESSAGES_MIN_CHARS": str(
+            message_storage.get("compress_min_chars", 0)
+        ),
+    }
 
 
 class LambdaFunctions(Construct):
+    # The resolvers get the invoke target of each function (its "live" alias when its profile publishes versions)
+
     @property
     def query_messages_fn(self):
-        return self._query_messages.fn
+        return self._query_messages.target
+
+    @property
+    def messages_since_fn(self):
+        return self._messages_since.target
+
+    @property
+    def search_messages_fn(self):
+        return self._search_messages.target
 
     @property
     def send_message_fn(self):
-        return self._send_message.fn
+        return self._send_message.target
+
+    @property
+    def send_messages_fn(self):
+        return self._send_messages.target
 
     @property
     def request_ai_response_fn(self):
-        return self._request_ai_response.fn
+        return self._request_ai_response.target
+
+    @property
+    def ai_response_worker_fn(self):
+        return self._ai_response_worker.fn
 
     @property
     def delete_all_messages_fn(self):
-        return self._delete_all_messages.fn
+        return self._delete_all_messages.target
 
     def __init__(
         self,
@@ -33,31 +96,114 @@ class LambdaFunctions(Construct):
         user_pool_client_id: str,
         messages_table_name: str,
         messages_table_arn: str,
+        messages_table_stream_arn: str,
+        user_profiles_table_name: str,
+        user_profiles_table_arn: str,
+        ai_response_queue: sqs.IQueue,
+        ai_response_max_receive_count: int,
+        purge_queue: sqs.IQueue,
+        stage_name: str = None,
+        performance_profiles: dict = None,
+        completion_cache: dict = None,
+        completion_routing: dict = None,
+        message_storage: dict = None,
         **kwargs
     ):
         super().__init__(scope, id, **kwargs)
 
         current_path = os.path.dirname(os.path.realpath(__file__))
 
-        self._query_messages = LambdaPython(
-            self,
-            "QueryMessages",
-            code_path=current_path + "/runtime/query_messages",
-            env_vars={"MESSAGES_TABLE_NAME": messages_table_name},
-        ).add_policy(["dynamodb:Scan"], [messages_table_arn])
+        def profile(function_id: str) -> dict:
+            return resolve_profile(performance_profiles, stage_name, function_id)
+
+        self._query_messages = (
+            LambdaPython(
+                self,
+                "QueryMessages",
+                code_path=current_path + "/runtime/query_messages",
+                layers=["shared_runtime"],
+                profile=profile("QueryMessages"),
+                env_vars={
+                    "MESSAGES_TABLE_NAME": messages_table_name,
+                    "USER_PROFILES_TABLE_NAME": user_profiles_table_name,
+                },
+            )
+            .add_policy(["dynamodb:GetItem"], [messages_table_arn])
+            .add_policy(["dynamodb:Query"], [messages_table_arn + "/index/*"])
+            # The usernames of the authors of the messages
+            .add_policy(["dynamodb:BatchGetItem"], [user_profiles_table_arn])
+        )
+
+        self._messages_since = (
+            LambdaPython(
+                self,
+                "MessagesSince",
+                code_path=current_path + "/runtime/messages_since",
+                layers=["shared_runtime"],
+                profile=profile("MessagesSince"),
+                env_vars={
+                    "MESSAGES_TABLE_NAME": messages_table_name,
+                    "USER_PROFILES_TABLE_NAME": user_profiles_table_name,
+                },
+            )
+            .add_policy(["dynamodb:GetItem"], [messages_table_arn])
+            # The SyncIndex
+            .add_policy(["dynamodb:Query"], [messages_table_arn + "/index/*"])
+            .add_policy(["dynamodb:BatchGetItem"], [user_profiles_table_arn])
+        )
 
         self._send_message = (
             LambdaPython(
                 self,
                 "SendMessage",
                 code_path=current_path + "/runtime/send_message",
+                layers=["shared_runtime"],
+                profile=profile("SendMessage"),
                 env_vars={
                     "MESSAGES_TABLE_NAME": messages_table_name,
                     "USER_POOL_ARN": user_pool_arn,
+                    "USER_PROFILES_TABLE_NAME": user_profiles_table_name,
+                    # Same limits as send_message.js
+                    "TENANT_MESSAGES_PER_MINUTE": "30",
+                    "TENANT_MESSAGES_BURST": "10",
+                    **message_storage_env_vars(message_storage),
                 },
             )
-            .add_policy(["dynamodb:PutItem"], [messages_table_arn])
+            .add_policy(
+                ["dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:UpdateItem"],
+                [messages_table_arn],
+            )
             .add_policy(["cognito-idp:AdminGetUser"], [user_pool_arn])
+            .add_policy(
+                ["dynamodb:GetItem", "dynamodb:PutItem"], [user_profiles_table_arn]
+            )
+        )
+
+        self._send_messages = (
+            LambdaPython(
+                self,
+                "SendMessages",
+                code_path=current_path + "/runtime/send_messages",
+                layers=["shared_runtime"],
+                profile=profile("SendMessages"),
+                env_vars={
+                    "MESSAGES_TABLE_NAME": messages_table_name,
+                    "USER_POOL_ARN": user_pool_arn,
+                    "USER_PROFILES_TABLE_NAME": user_profiles_table_name,
+                    "MAX_BATCH_MESSAGES": "100",
+                    "TENANT_BATCH_MESSAGES_PER_MINUTE": "600",
+                    "TENANT_BATCH_MESSAGES_BURST": "100",
+                    **message_storage_env_vars(message_storage),
+                },
+            )
+            .add_policy(
+                ["dynamodb:BatchWriteItem", "dynamodb:GetItem", "dynamodb:UpdateItem"],
+                [messages_table_arn],
+            )
+            .add_policy(["cognito-idp:AdminGetUser"], [user_pool_arn])
+            .add_policy(
+                ["dynamodb:GetItem", "dynamodb:PutItem"], [user_profiles_table_arn]
+            )
         )
 
         self._request_ai_response = (
@@ -65,24 +211,209 @@ class LambdaFunctions(Construct):
                 self,
                 "RequestAIResponse",
                 code_path=current_path + "/runtime/request_ai_response",
-                layers=["openai"],
+                layers=["shared_runtime"],
+                profile=profile("RequestAIResponse"),
                 env_vars={
                     "MESSAGES_TABLE_NAME": messages_table_name,
-                    "OPENAI_TOKEN_SECRET_NAME": openai_token_secret_name,
                     "USER_POOL_ARN": user_pool_arn,
+                    "USER_PROFILES_TABLE_NAME": user_profiles_table_name,
+                    "AI_RESPONSE_QUEUE_URL": ai_response_queue.queue_url,
+                    "TENANT_AI_REQUESTS_PER_MINUTE": "6",
+                    "TENANT_AI_REQUESTS_BURST": "3",
+                    "OPENAI_TOKENS_PER_MINUTE": "60000",
+                    "OPENAI_TOKENS_PER_REQUEST": "800",
                 },
-                timeout=Duration.seconds(27),
             )
-            .add_policy(["dynamodb:Scan", "dynamodb:PutItem"], [messages_table_arn])
-            .add_policy(["secretsmanager:GetSecretValue"], [openai_token_secret_arn])
+            .add_policy(
+                [
+                    "dynamodb:GetItem",
+                    "dynamodb:PutItem",
+                    "dynamodb:UpdateItem",
+                    "dynamodb:DeleteItem",
+                ],
+                [messages_table_arn],
+            )
+            .add_policy(["sqs:SendMessage"], [ai_response_queue.queue_arn])
             .add_policy(["cognito-idp:AdminGetUser"], [user_pool_arn])
+            .add_policy(
+                ["dynamodb:GetItem", "dynamodb:PutItem"], [user_profiles_table_arn]
+            )
+        )
+
+        self._ai_response_worker = (
+            LambdaPython(
+                self,
+                "AiResponseWorker",
+                code_path=current_path + "/runtime/ai_response_worker",
+                layers=["openai", "shared_runtime"],
+                env_vars={
+                    "MESSAGES_TABLE_NAME": messages_table_name,
+                    "OPENAI_TOKEN_SECRET_NAME": openai_token_secret_name,
+                    "HISTORY_MAX_MESSAGES": "20",
+                    "HISTORY_MAX_TOKENS": "600",
+                    "HISTORY_MAX_TOKENS_PER_MESSAGE": "100",
+                    "AI_RESPONSE_STREAMING": "true",
+                    "AI_RESPONSE_CHUNK_INTERVAL_SECONDS": "0.1",
+                    "MAX_RECEIVE_COUNT": str(ai_response_max_receive_count),
+                    **completion_cache_env_vars(completion_cache),
+                    **completion_routing_env_vars(completion_routing),
+                    **message_storage_env_vars(message_storage),
+                },
+                timeout=Duration.seconds(60),
+                profile=profile("AiResponseWorker"),
+            )
+            .add_policy(
+                [
+                    "dynamodb:GetItem",
+                    "dynamodb:PutItem",
+                    "dynamodb:UpdateItem",
+                    "dynamodb:DeleteItem",
+                ],
+                [messages_table_arn],
+            )
+            .add_policy(["dynamodb:Query"], [messages_table_arn + "/index/*"])
+            .add_policy(["secretsmanager:GetSecretValue"], [openai_token_secret_arn])
+        )
+        self._ai_response_worker.target.add_event_source(
+            # At most this many requests are sent to OpenAI at a time, the others wait in the queue
+            event_sources.SqsEventSource(
+                ai_response_queue,
+                batch_size=1,
+                report_batch_item_failures=True,
+                max_concurrency=10,
+            )
         )
 
-        self._delete_all_messages = LambdaPython(
+        self._recent_messages = LambdaPython(
             self,
-            "DeleteAllMessages",
-            code_path=current_path + "/runtime/delete_all_messages",
+            "RecentMessages",
+            code_path=current_path + "/runtime/recent_messages",
+            layers=["shared_runtime"],
             env_vars={
                 "MESSAGES_TABLE_NAME": messages_table_name,
+                "RECENT_MAX_MESSAGES": "100",
             },
-        ).add_policy(["dynamodb:Scan", "dynamodb:BatchWriteItem"], [messages_table_arn])
+            profile=profile("RecentMessages"),
+        ).add_policy(
+            ["dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:Query"],
+            [messages_table_arn],
+        )
+        # Only the records of the messages and of the META items, the function's own writes to the RECENT items are
+        # filtered out
+        self._recent_messages.target.add_event_source(
+            event_sources.DynamoEventSource(
+                dynamodb.Table.from_table_attributes(
+                    self,
+                    "MessagesTable",
+                    table_arn=messages_table_arn,
+                    table_stream_arn=messages_table_stream_arn,
+                ),
+                starting_position=aws_lambda.StartingPosition.LATEST,
+                batch_size=100,
+                bisect_batch_on_error=True,
+                retry_attempts=10,
+                filters=[
+                    aws_lambda.FilterCriteria.filter(
+                        {
+                            "dynamodb": {
+                                "Keys": {
+                                    "SK": {
+                                        "S": aws_lambda.FilterRule.begins_with("MSG#")
+                                    }
+                                }
+                            }
+                        }
+                    ),
+                    aws_lambda.FilterCriteria.filter(
+                        {"dynamodb": {"Keys": {"SK": {"S": ["META"]}}}}
+                    ),
+                ],
+            )
+        )
+
+        self._search_messages = (
+            LambdaPython(
+                self,
+                "SearchMessages",
+                code_path=current_path + "/runtime/search_messages",
+                layers=["shared_runtime"],
+                profile=profile("SearchMessages"),
+                env_vars={
+                    "MESSAGES_TABLE_NAME": messages_table_name,
+                    "USER_PROFILES_TABLE_NAME": user_profiles_table_name,
+                },
+            )
+            # The posting lists, the META item of the room
+            .add_policy(["dynamodb:GetItem", "dynamodb:Query"], [messages_table_arn])
+            # The messages found, and the usernames of their authors
+            .add_policy(
+                ["dynamodb:BatchGetItem"], [messages_table_arn, user_profiles_table_arn]
+            )
+        )
+
+        self._search_indexer = LambdaPython(
+            self,
+            "SearchIndexer",
+            code_path=current_path + "/runtime/search_indexer",
+            layers=["shared_runtime"],
+            env_vars={"MESSAGES_TABLE_NAME": messages_table_name},
+            profile=profile("SearchIndexer"),
+        ).add_policy(["dynamodb:BatchWriteItem"], [messages_table_arn])
+        # Only the records of the messages, the function's own writes to the postings are filtered out
+        self._search_indexer.target.add_event_source(
+            event_sources.DynamoEventSource(
+                dynamodb.Table.from_table_attributes(
+                    self,
+                    "IndexedMessagesTable",
+                    table_arn=messages_table_arn,
+                    table_stream_arn=messages_table_stream_arn,
+                ),
+                starting_position=aws_lambda.StartingPosition.LATEST,
+                batch_size=100,
+                bisect_batch_on_error=True,
+                retry_attempts=10,
+                filters=[
+                    aws_lambda.FilterCriteria.filter(
+                        {
+                            "dynamodb": {
+                                "Keys": {
+                                    "SK": {
+                                        "S": aws_lambda.FilterRule.begins_with("MSG#")
+                                    }
+                                }
+                            }
+                        }
+                    ),
+                ],
+            )
+        )
+
+        self._delete_all_messages = (
+            LambdaPython(
+                self,
+                "DeleteAllMessages",
+                code_path=current_path + "/runtime/delete_all_messages",
+                layers=["shared_runtime"],
+                env_vars={
+                    "MESSAGES_TABLE_NAME": messages_table_name,
+                    "PURGE_MAX_WORKERS": "16",
+                    "PURGE_QUEUE_URL": purge_queue.queue_url,
+                },
+                timeout=Duration.seconds(27),
+                profile=profile("DeleteAllMessages"),
+            )
+            .add_policy(
+                ["dynamodb:Query", "dynamodb:BatchWriteItem", "dynamodb:UpdateItem"],
+                [messages_table_arn],
+            )
+            .add_policy(["sqs:SendMessage"], [purge_queue.queue_arn])
+        )
+        self._delete_all_messages.target.add_event_source(
+            # The rooms left to purge, one at a time
+            event_sources.SqsEventSource(
+                purge_queue,
+                batch_size=1,
+                report_batch_item_failures=True,
+                max_concurrency=2,
+            )
+        )
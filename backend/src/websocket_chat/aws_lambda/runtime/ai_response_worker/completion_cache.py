@@ -0,0 +1,90 @@
+import re
+import json
+from time import time
+from hashlib import sha256
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+from shared_runtime.ttl_cache import TTLCache
+
+# Reuses the answers of the model for prompts seen before, keyed by the hash of the normalized prompt and newest turns:
+# an LRU of the container first, then PK = "COMPLETION#<hash>" in the messages table, shared by all the containers
+
+COMPLETION_PK_PREFIX = "COMPLETION#"
+COMPLETION_SK = "COMPLETION"
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(content: str) -> str:
+    return WHITESPACE.sub(" ", content).strip().casefold()
+
+
+def completion_key(chat_inputs: list, history_messages: int, params: dict) -> str:
+    # chat_inputs as built by build_chat_inputs: the system prompt, the history oldest first and the user prompt
+    system, history, user = chat_inputs[0], chat_inputs[1:-1], chat_inputs[-1]
+    tail = history[len(history) - history_messages :] if history_messages else []
+    normalized = [
+        (chat_input["role"], normalize(chat_input["content"]))
+        for chat_input in [system, *tail, user]
+    ]
+    # The parameters of the completion are part of the key, so changing the model doesn't serve the old answers
+    return sha256(json.dumps([params, normalized], sort_keys=True).encode()).hexdigest()
+
+
+class CompletionCache:
+    def __init__(
+        self,
+        table,
+        metrics,
+        ttl_seconds: int,
+        max_size: int = 256,
+        history_messages: int = 2,
+        clock=time,
+    ):
+        self._table = table
+        self._metrics = metrics
+        self._ttl_seconds = ttl_seconds
+        self._history_messages = history_messages
+        self._clock = clock
+        self._local = TTLCache(max_size, ttl_seconds)
+
+    def key(self, chat_inputs: list, params: dict) -> str:
+        return completion_key(chat_inputs, self._history_messages, params)
+
+    def get(self, key: str):
+        text = self._local.get(key)
+        if text is not None:
+            self._record("CompletionCacheHits")
+            return text
+        item = self._table.get_item(
+            Key=self._item_key(key),
+            ProjectionExpression="#text, ExpiresAt",
+            ExpressionAttributeNames={"#text": "Text"},
+        ).get("Item")
+        remaining_seconds = float(item["ExpiresAt"]) - self._clock() if item else 0
+        if remaining_seconds > 0:
+            self._record("CompletionCacheHits")
+            self._record("CompletionCacheTableHits")
+            self._local.put(key, item["Text"], remaining_seconds)
+            return item["Text"]
+        self._record("CompletionCacheMisses")
+        return None
+
+    def put(self, key: str, text: str):
+        if not text:
+            return  # Not an answer worth reusing
+        self._local.put(key, text)
+        self._table.put_item(
+            Item={
+                **self._item_key(key),
+                "Text": text,
+                "ExpiresAt": int(self._clock()) + self._ttl_seconds,
+            }
+        )
+
+    def _record(self, name: str):
+        self._metrics.add_metric(name=name, unit=MetricUnit.Count, value=1)
+
+    @staticmethod
+    def _item_key(key: str) -> dict:
+        return {"PK": COMPLETION_PK_PREFIX + key, "SK": COMPLETION_SK}
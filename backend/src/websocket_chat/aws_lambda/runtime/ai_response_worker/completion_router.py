@@ -0,0 +1,207 @@
+from time import monotonic
+from bisect import insort
+from logging import getLogger
+from threading import Lock
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+logger = getLogger(__name__)
+
+# Sends each completion to the upstreams in order of preference: hedged past a percentile of their recent latencies,
+# failed over on the 'failures' errors, and skipped while their circuit is open. The first answer wins
+
+Upstream = namedtuple("Upstream", ["name", "model", "api_base"])
+
+
+class AllCircuitsOpen(Exception):
+    pass
+
+
+class LatencyWindow:
+    # The latencies of the last 'size' successful requests of an upstream, to hedge at a percentile of them
+    def __init__(self, size: int = 100):
+        self._lock = Lock()
+        self._recent = deque(maxlen=size)
+        self._sorted = []
+
+    def add(self, seconds: float):
+        with self._lock:
+            if len(self._recent) == self._recent.maxlen:
+                self._sorted.remove(self._recent[0])
+            self._recent.append(seconds)
+            insort(self._sorted, seconds)
+
+    def percentile(self, percentile: float, min_samples: int):
+        # None until 'min_samples' latencies are known
+        with self._lock:
+            if len(self._sorted) < max(1, min_samples):
+                return None
+            index = round(percentile / 100 * (len(self._sorted) - 1))
+            return self._sorted[index]
+
+
+class CircuitBreaker:
+    def __init__(
+        self, failure_threshold: int, cooldown_seconds: float, clock=monotonic
+    ):
+        self._lock = Lock()
+        self._failure_threshold = failure_threshold
+        self._cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._probed_at = None
+
+    def allows(self) -> bool:
+        # After the cooldown a single request probes the upstream, until it succeeds or fails. A probe that never
+        # reports, e.g. cancelled before it started, is replaced after another cooldown
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = self._clock()
+            if now - self._opened_at < self._cooldown_seconds:
+                return False
+            if (
+                self._probed_at is not None
+                and now - self._probed_at < self._cooldown_seconds
+            ):
+                return False
+            self._probed_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probed_at = None
+
+    def record_failure(self) -> bool:
+        # Whether the failure opened the circuit. A failed retry after the cooldown opens it for another one
+        with self._lock:
+            self._failures += 1
+            if self._failures < self._failure_threshold:
+                return False
+            self._opened_at = self._clock()
+            self._probed_at = None
+            return True
+
+
+class CompletionRouter:
+    def __init__(
+        self,
+        upstreams: list,
+        metrics,
+        failures: tuple = (Exception,),
+        hedge_percentile: float = 95,
+        hedge_min_samples: int = 20,
+        default_hedge_delay_seconds: float = 2.0,
+        max_requests: int = 2,
+        failure_threshold: int = 5,
+        cooldown_seconds: float = 30,
+        latency_window: int = 100,
+        clock=monotonic,
+    ):
+        self._upstreams = upstreams
+        self._metrics = metrics
+        self._failures = failures
+        # 0 disables the hedging
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._default_hedge_delay_seconds = default_hedge_delay_seconds
+        self._max_requests = max_requests
+        self._clock = clock
+        self._latencies = {u.name: LatencyWindow(latency_window) for u in upstreams}
+        self._breakers = {
+            u.name: CircuitBreaker(failure_threshold, cooldown_seconds, clock)
+            for u in upstreams
+        }
+        # The losers may still be running when the next completion starts
+        self._executor = ThreadPoolExecutor(max_workers=2 * max_requests)
+
+    def hedge_delay(self, upstream: Upstream) -> float:
+        latency = self._latencies[upstream.name].percentile(
+            self._hedge_percentile, self._hedge_min_samples
+        )
+        return self._default_hedge_delay_seconds if latency is None else latency
+
+    def complete(self, call):
+        # The first answer of call(upstream). When streaming, call returns once the response started
+        upstreams = [u for u in self._upstreams if self._breakers[u.name].allows()]
+        if not upstreams:
+            self._record("AiCircuitOpen")
+            raise AllCircuitsOpen("Every completion upstream failed recently")
+        pending = {}  # future -> "first", "hedge" or "failover"
+        errors = []
+
+        def send(reason: str):
+            sent = len(errors) + len(pending)
+            upstream = upstreams[min(sent, len(upstreams) - 1)]
+            pending[self._executor.submit(self._attempt, call, upstream)] = reason
+            if reason != "first":
+                self._record("AiHedgedRequests" if reason == "hedge" else "AiFailovers")
+
+        send("first")
+        hedge_at = (
+            self._clock() + self.hedge_delay(upstreams[0])
+            if self._hedge_percentile
+            else None
+        )
+        try:
+            while pending:
+                can_send = len(errors) + len(pending) < self._max_requests
+                timeout = (
+                    max(0.0, hedge_at - self._clock())
+                    if can_send and hedge_at is not None
+                    else None
+                )
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    send("hedge")
+                    continue
+                for future in done:
+                    reason = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except self._failures as e:
+                        errors.append(e)
+                        continue
+                    if reason == "hedge":
+                        self._record("AiHedgeWins")
+                    return result
+                if len(errors) + len(pending) < self._max_requests:
+                    logger.warning(
+                        "Completion failed, failing over: {}".format(errors[-1])
+                    )
+                    send("failover")
+            raise errors[-1]
+        finally:
+            for future in pending:
+                future.cancel()
+                future.add_done_callback(close_stream)
+
+    def _attempt(self, call, upstream: Upstream):
+        started_at = self._clock()
+        try:
+            result = call(upstream)
+        except self._failures:
+            if self._breakers[upstream.name].record_failure():
+                logger.warning("Opening the circuit of {}".format(upstream.name))
+            raise
+        self._latencies[upstream.name].add(self._clock() - started_at)
+        self._breakers[upstream.name].record_success()
+        return result
+
+    def _record(self, name: str):
+        self._metrics.add_metric(name=name, unit=MetricUnit.Count, value=1)
+
+
+def close_stream(future):
+    # The streams of the losers, so their connections are not read anymore
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), "close", None)
+    if close:
+        close()
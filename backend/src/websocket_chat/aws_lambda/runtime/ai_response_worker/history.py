@@ -0,0 +1,73 @@
+from shared_runtime.messages import (
+    VISIBILITY_INDEX,
+    ai_audience,
+    audience_condition,
+    get_cleared_before,
+)
+from shared_runtime.message_items import read_message_item, is_expired
+
+# Chat history sent to the model as context. Only the newest AI messages of the room are read (one Query with a
+# fixed Limit), and they are trimmed to a token budget, so the prompt size and the read cost stay constant however
+# long the debate gets
+
+CHARS_PER_TOKEN = 4  # Rough average for English text with the OpenAI tokenizers
+TOKENS_PER_MESSAGE = 4  # Overhead the chat format adds to every message
+
+
+def estimate_tokens(text: str) -> int:
+    return TOKENS_PER_MESSAGE + (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max(0, max_tokens - TOKENS_PER_MESSAGE) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[: max(0, max_chars - 3)].rstrip() + "..."
+
+
+def query_recent_ai_messages(table, room_id: str, max_messages: int) -> list:
+    # Newest first, since the last time the room was cleared and without the expired ones. In the format of
+    # read_message_item
+    cleared_before = get_cleared_before(table, room_id)
+    response = table.query(
+        IndexName=VISIBILITY_INDEX,
+        KeyConditionExpression=audience_condition(ai_audience(room_id), cleared_before),
+        # Both versions of the message items
+        ProjectionExpression="SK, VisibleTo, V, X, Z, U, #text, AiGenerated, TenantId, "
+        "ExpiresAt",
+        ExpressionAttributeNames={"#text": "Text"},
+        ScanIndexForward=False,
+        Limit=max_messages,
+    )
+    return [
+        read_message_item(item) for item in response["Items"] if not is_expired(item)
+    ]
+
+
+def build_chat_history(
+    items: list, tenant_id: str, max_tokens: int, max_tokens_per_message: int
+) -> list:
+    # items: AI messages newest first. The caller's own AI messages are the assistant turns, the AI messages of the
+    # other debaters are the user turns. Returns the turns oldest first
+    chat_history = []
+    used_tokens = 0
+    for item in items:
+        content = truncate_to_tokens(item["text"], max_tokens_per_message)
+        tokens = estimate_tokens(content)
+        if used_tokens + tokens > max_tokens:
+            break
+        used_tokens += tokens
+        role = "assistant" if item["tenantId"] == tenant_id else "user"
+        chat_history.append({"role": role, "content": content})
+    omitted = len(items) - len(chat_history)
+    if omitted:
+        chat_history.append(
+            {
+                "role": "system",
+                "content": "({} older arguments of the debate are omitted)".format(
+                    omitted
+                ),
+            }
+        )
+    chat_history.reverse()
+    return chat_history
@@ -0,0 +1,366 @@
+from os import environ
+
+from aws_lambda_powertools.utilities.batch import (
+    BatchProcessor,
+    EventType,
+    process_partial_response,
+)
+
+from shared_runtime.messages import message_key, new_message_id
+from shared_runtime.message_items import (
+    compact_message_item,
+    read_message_item,
+    sync_cursor,
+    RoomRetention,
+)
+from shared_runtime.idempotency import idempotency_item_key, store_response, release
+from shared_runtime.secret_cache import get_secret_from_env, refresh_secret_from_env
+from shared_runtime.appsync import AppSyncClient
+from shared_runtime.clients import LazyProxy, lazy_table, get_requests_session
+from shared_runtime.deadlines import deadline
+from shared_runtime.env import env_bool, env_float, env_int
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import (
+    dependency_call,
+    instrument_handler,
+    usage,
+)
+
+from history import query_recent_ai_messages, build_chat_history, estimate_tokens
+from streaming import ChunkPublisher, stream_completion
+from completion_cache import CompletionCache
+from completion_router import CompletionRouter, Upstream
+
+messages_table_name = environ["MESSAGES_TABLE_NAME"]
+history_max_messages = env_int("HISTORY_MAX_MESSAGES", 20)
+history_max_tokens = env_int("HISTORY_MAX_TOKENS", 600)
+history_max_tokens_per_message = env_int("HISTORY_MAX_TOKENS_PER_MESSAGE", 100)
+streaming = env_bool("AI_RESPONSE_STREAMING")
+stream_chunk_interval_seconds = env_float("AI_RESPONSE_CHUNK_INTERVAL_SECONDS", 0.1)
+# Per attempt. When streaming, the read timeout is the longest wait for the next token
+openai_connect_timeout_seconds = env_float("OPENAI_CONNECT_TIMEOUT_SECONDS", 2)
+openai_read_timeout_seconds = env_float("OPENAI_READ_TIMEOUT_SECONDS", 20)
+# The completions are only retried by completion_router, and SQS delivers a failed request again up to
+# 'max_receive_count' times: at most COMPLETION_MAX_REQUESTS x MAX_RECEIVE_COUNT calls to OpenAI per request
+max_receive_count = env_int("MAX_RECEIVE_COUNT", 3)
+# 0 disables the cache of the answers
+completion_cache_ttl_seconds = env_int("COMPLETION_CACHE_TTL_SECONDS", 0)
+# 0 never compresses the texts
+compress_min_chars = env_int("COMPRESS_MESSAGES_MIN_CHARS", 0)
+# Another model, at the same or another OpenAI compatible endpoint that accepts the same token
+completion_backup_model = environ.get("COMPLETION_BACKUP_MODEL", "")
+completion_backup_api_base = environ.get("COMPLETION_BACKUP_API_BASE", "")
+
+messages_table = lazy_table(messages_table_name)
+room_retention = RoomRetention(messages_table, env_int("DEFAULT_RETENTION_DAYS", 0))
+completion_cache = (
+    CompletionCache(
+        messages_table,
+        metrics,
+        completion_cache_ttl_seconds,
+        max_size=env_int("COMPLETION_CACHE_MAX_SIZE", 256),
+        history_messages=env_int("COMPLETION_CACHE_HISTORY_MESSAGES", 2),
+    )
+    if completion_cache_ttl_seconds > 0
+    else None
+)
+appsync_client = AppSyncClient(environ["GRAPHQL_URL"])
+completion_router = LazyProxy(
+    lambda: CompletionRouter(
+        completion_upstreams(),
+        metrics,
+        retryable_openai_errors(),
+        hedge_percentile=env_float("COMPLETION_HEDGE_PERCENTILE", 95),
+        hedge_min_samples=env_int("COMPLETION_HEDGE_MIN_SAMPLES", 20),
+        default_hedge_delay_seconds=env_float("COMPLETION_HEDGE_DELAY_SECONDS", 2),
+        max_requests=env_int("COMPLETION_MAX_REQUESTS", 2),
+        failure_threshold=env_int("COMPLETION_CIRCUIT_FAILURES", 5),
+        cooldown_seconds=env_float("COMPLETION_CIRCUIT_COOLDOWN_SECONDS", 30),
+    )
+)
+processor = BatchProcessor(event_type=EventType.SQS)
+
+
+# The openai package is imported on first use instead of at init: it is the heaviest import of the function, and
+# deliveries of requests that were already answered never need it
+def retryable_openai_errors() -> tuple:
+    from openai.error import (
+        APIConnectionError,
+        APIError,
+        RateLimitError,
+        ServiceUnavailableError,
+        Timeout,
+        TryAgain,
+    )
+
+    return (
+        APIConnectionError,
+        APIError,
+        RateLimitError,
+        ServiceUnavailableError,
+        Timeout,
+        TryAgain,
+    )
+
+
+PUBLISH_AI_RESPONSE = """
+mutation PublishAiResponse($message: MessageInput!) {
+  publishAiResponse(message: $message) {
+    id
+    roomId
+    text
+    aiGenerated
+    tenantId
+    username
+    status
+    cursor
+  }
+}
+"""
+
+
+COMPLETION_PARAMS = {
+    "model": "gpt-3.5-turbo",
+    "max_tokens": 25,
+    "n": 1,
+    "stop": [".", "?", "!", "\n"],
+    "temperature": 0.5,
+}
+
+
+def completion_upstreams() -> list:
+    # The default endpoint is openai.api_base, set from OPENAI_API_BASE
+    upstreams = [Upstream("primary", COMPLETION_PARAMS["model"], None)]
+    if completion_backup_model or completion_backup_api_base:
+        upstreams.append(
+            Upstream(
+                "backup",
+                completion_backup_model or COMPLETION_PARAMS["model"],
+                completion_backup_api_base or None,
+            )
+        )
+    return upstreams
+
+
+def create_chat_completion(
+    chat_inputs: list, api_key: str, stream: bool, upstream: Upstream
+):
+    import openai
+    from openai import ChatCompletion
+
+    # The keep-alive connections of the container, instead of a session per thread that openai closes every few
+    # minutes
+    openai.requestssession = get_requests_session()
+    # When streaming, the time to the first token
+    with dependency_call("OpenAI"):
+        return ChatCompletion.create(
+            messages=chat_inputs,
+            api_key=api_key,
+            stream=stream,
+            request_timeout=deadline.timeouts(
+                openai_connect_timeout_seconds, openai_read_timeout_seconds
+            ),
+            api_base=upstream.api_base,
+            **{**COMPLETION_PARAMS, "model": upstream.model},
+        )
+
+
+def build_chat_inputs(table, request: dict) -> list:
+    ## Prompt
+    preferred_username = request["username"]
+    ai_prompt = [
+        {
+            "role": "system",
+            "content": """You are {}, the orator/statesman from the time of the greeks, and you are debating against other greek orator(s).
+            You will be provided the chat history of the debate between yourself and the others. With that, you will also receive one user message/prompt,
+            that you have to turn into a convincing argument in the style of {}, to be added to the conversation.
+            The argument must be expressed in one short sentence ending with a point.
+            The argument must be in favor of whatever the user has prompted you to support.""".format(
+                preferred_username, preferred_username, preferred_username
+            ),
+        }
+    ]
+    ## Chat history
+    recent_messages = query_recent_ai_messages(
+        table, request["roomId"], history_max_messages
+    )
+    chat_history = build_chat_history(
+        recent_messages,
+        request["tenantId"],
+        history_max_tokens,
+        history_max_tokens_per_message,
+    )
+    ## User message
+    user_message = [
+        {
+            "role": "user",
+            "content": "User prompt: " + request["text"],
+        }
+    ]
+    chat_inputs = []
+    chat_inputs.extend(ai_prompt)
+    chat_inputs.extend(chat_history)
+    chat_inputs.extend(user_message)
+    return chat_inputs
+
+
+def get_ai_response(chat_inputs: list, request: dict) -> str:
+    from openai.error import AuthenticationError
+
+    def complete(secret: str):
+        # Hedged and failed over between the upstreams, see completion_router.py
+        return completion_router.complete(
+            lambda upstream: create_chat_completion(
+                chat_inputs, secret, streaming, upstream
+            )
+        )
+
+    secret = get_secret_from_env("OPENAI_TOKEN_SECRET_NAME")
+    try:
+        ai_response = complete(secret)
+    except AuthenticationError:
+        # The token may have been rotated since it was cached
+        logger.warning("OpenAI rejected the cached token, refreshing it")
+        secret = refresh_secret_from_env("OPENAI_TOKEN_SECRET_NAME")
+        ai_response = complete(secret)
+    if not streaming:
+        usage.add_tokens(
+            ai_response["usage"]["prompt_tokens"],
+            ai_response["usage"]["completion_tokens"],
+        )
+        return ai_response["choices"][0]["message"]["content"]
+    # Push the tokens to the onAiResponseChunk subscribers as they arrive
+    text = stream_completion(
+        ai_response,
+        ChunkPublisher(
+            appsync_client,
+            request["messageId"],
+            request["roomId"],
+            request["tenantId"],
+            request["username"],
+            stream_chunk_interval_seconds,
+        ),
+    )
+    # The streamed completions don't report their usage
+    usage.add_tokens(
+        sum(estimate_tokens(chat_input["content"]) for chat_input in chat_inputs),
+        estimate_tokens(text),
+    )
+    return text
+
+
+def response_message(request: dict, text: str, status: str, cursor: str = None) -> dict:
+    return {
+        "id": request["messageId"],
+        "roomId": request["roomId"],
+        "text": text,
+        "aiGenerated": True,
+        "tenantId": request["tenantId"],
+        "username": request["username"],
+        "status": status,
+        "cursor": cursor,
+    }
+
+
+def publish(request: dict, text: str, status: str, cursor: str = None):
+    appsync_client.execute(
+        PUBLISH_AI_RESPONSE,
+        {"message": response_message(request, text, status, cursor)},
+    )
+
+
+def request_item_key(request: dict):
+    # The idempotency item of the requestAiResponse call that queued the request, if the client sent a key
+    if not request.get("idempotencyKey"):
+        return None
+    return idempotency_item_key(
+        request["roomId"],
+        "requestAiResponse",
+        request["tenantId"],
+        request["idempotencyKey"],
+    )
+
+
+def deliver(request: dict, text: str, cursor: str):
+    if request_item_key(request):
+        # Retries of the request get the answer from now on
+        store_response(
+            messages_table,
+            request_item_key(request),
+            response_message(request, text, "COMPLETE", cursor),
+        )
+    publish(request, text, "COMPLETE", cursor)
+
+
+def deliver_stored(request: dict, item: dict):
+    # Delivers again an answer that is already written: the delivery that wrote it may have failed before delivering
+    # it. Both steps are idempotent, and the clients drop the messages they already have by id
+    answer = read_message_item(item)
+    deliver(request, answer["text"], answer["cursor"])
+
+
+@tracer.capture_method
+def record_handler(record):
+    request = record.json_body
+    key = message_key(request["roomId"], request["messageId"])
+    # SQS delivers at least once, don't pay for a second completion
+    answer_item = messages_table.get_item(Key=key).get("Item")
+    if answer_item:
+        logger.info("The request was already answered")
+        deliver_stored(request, answer_item)
+        return
+    # Get a completion from the cache, or from OpenAI
+    chat_inputs = build_chat_inputs(messages_table, request)
+    cache_key = (
+        completion_cache.key(chat_inputs, COMPLETION_PARAMS)
+        if completion_cache
+        else None
+    )
+    try:
+        ai_response = completion_cache.get(cache_key) if completion_cache else None
+        if ai_response is None:
+            ai_response = get_ai_response(chat_inputs, request)
+            if completion_cache:
+                completion_cache.put(cache_key, ai_response)
+    except Exception as e:
+        logger.exception("Error calling OpenAI: {}".format(str(e)))
+        if int(record.attributes.approximate_receive_count) >= max_receive_count:
+            # Last delivery before the dead-letter queue, stop the clients from waiting. A retry of the request
+            # with the same key queues it again
+            publish(request, "", "FAILED")
+            if request_item_key(request):
+                release(messages_table, request_item_key(request))
+        raise
+    # Save the response to DynamoDB and publish it to the clients
+    written_id = new_message_id()
+    message = compact_message_item(
+        request["roomId"],
+        request["messageId"],
+        request["tenantId"],
+        ai_response,
+        True,
+        room_retention.expires_at(request["roomId"], request["messageId"]),
+        compress_min_chars,
+        written_id,
+    )
+    try:
+        messages_table.put_item(
+            Item=message, ConditionExpression="attribute_not_exists(PK)"
+        )
+    except messages_table.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info("The request was answered by a concurrent delivery")
+        deliver_stored(
+            request, messages_table.get_item(Key=key, ConsistentRead=True)["Item"]
+        )
+        return
+    deliver(request, ai_response, sync_cursor(written_id))
+
+
+@metrics.log_metrics(capture_cold_start_metric=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context
+@instrument_handler
+def handler(event, context):
+    return process_partial_response(
+        event=event, record_handler=record_handler, processor=processor, context=context
+    )
@@ -0,0 +1,96 @@
+from time import monotonic
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
+
+logger = getLogger(__name__)
+
+PUBLISH_AI_RESPONSE_CHUNK = """
+mutation PublishAiResponseChunk($chunk: AiResponseChunkInput!) {
+  publishAiResponseChunk(chunk: $chunk) {
+    messageId
+    roomId
+    tenantId
+    username
+    seq
+    text
+    done
+  }
+}
+"""
+
+# Streams a completion to the onAiResponseChunk subscribers while it is generated. Tokens are coalesced so at most
+# one mutation is sent every 'min_interval_seconds', and the mutations are sent from a single background thread, in
+# order, so reading the completion stream never waits on AppSync. Chunks are best effort: the final message written
+# by requestAiResponse is the source of truth
+
+
+class ChunkPublisher:
+    def __init__(
+        self,
+        appsync_client,
+        message_id: str,
+        room_id: str,
+        tenant_id: str,
+        username: str,
+        min_interval_seconds: float = 0.1,
+        clock=monotonic,
+    ):
+        self._appsync_client = appsync_client
+        self._message_id = message_id
+        self._room_id = room_id
+        self._tenant_id = tenant_id
+        self._username = username
+        self._min_interval_seconds = min_interval_seconds
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        self._seq = 0
+        self._last_published_at = None
+        self.text = ""
+
+    def add(self, delta: str):
+        if not delta:
+            return
+        self.text += delta
+        self._pending.append(delta)
+        now = self._clock()
+        if (
+            self._last_published_at is None
+            or now - self._last_published_at >= self._min_interval_seconds
+        ):
+            self._publish(done=False)
+            self._last_published_at = now
+
+    def close(self):
+        self._publish(done=True)
+        self._executor.shutdown(wait=True)
+        return self.text
+
+    def _publish(self, done: bool):
+        chunk = {
+            "messageId": self._message_id,
+            "roomId": self._room_id,
+            "seq": self._seq,
+            "text": "".join(self._pending),
+            "done": done,
+        }
+        # Every subscriber gets every chunk, so who asked is only sent once
+        if self._seq == 0:
+            chunk["tenantId"] = self._tenant_id
+            chunk["username"] = self._username
+        self._pending = []
+        self._seq += 1
+        self._executor.submit(self._send, chunk)
+
+    def _send(self, chunk: dict):
+        try:
+            self._appsync_client.execute(PUBLISH_AI_RESPONSE_CHUNK, {"chunk": chunk})
+        except Exception:
+            logger.exception("Error publishing an AI response chunk")
+
+
+def stream_completion(completion_chunks, publisher: ChunkPublisher) -> str:
+    # completion_chunks: the iterator returned by ChatCompletion.create(stream=True)
+    for chunk in completion_chunks:
+        publisher.add(chunk["choices"][0]["delta"].get("content", ""))
+    return publisher.close()
@@ -1,27 +1,79 @@
 from os import environ
 
-from boto3 import resource, client
-
-from aws_lambda_powertools import Logger, Metrics, Tracer
-from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.metrics import MetricUnit
 
-metrics = Metrics(service="websocket_chat", namespace="serverless_demo")
-tracer = Tracer(service="websocket_chat")
-logger = Logger(service="websocket_chat")
+from shared_runtime.messages import room_id_or_default, room_pk, clear_room
+from shared_runtime.clients import get_client, lazy_client, lazy_table
+from shared_runtime.queues import SqsQueue
+from shared_runtime.env import env_int
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
+
+from purge import purge_partition
 
 messages_table_name = environ["MESSAGES_TABLE_NAME"]
+purge_max_workers = env_int("PURGE_MAX_WORKERS", 16)
+
+messages_table = lazy_table(messages_table_name)
+db_low_level_client = lazy_client("dynamodb")
+# The rooms too large to purge within the 30 seconds of an AppSync call, purged by this function from the queue, one
+# invocation after the other
+purge_queue = SqsQueue(environ["PURGE_QUEUE_URL"], lambda: get_client("sqs"))
+
 
-db_client = resource("dynamodb")
+def purge_room(room_id: str):
+    # Only the room's partition is read and deleted, the other rooms are not touched
+    result = purge_partition(
+        db_low_level_client,
+        messages_table_name,
+        room_pk(room_id),
+        max_workers=purge_max_workers,
+    )
+    logger.info(
+        "Deleted {} items of room {} in {:.2f}s ({:.0f} items/s)".format(
+            result.deleted, room_id, result.seconds, result.items_per_second
+        )
+    )
+    metrics.add_metric(name="PurgedItems", unit=MetricUnit.Count, value=result.deleted)
+    metrics.add_metric(
+        name="PurgeThroughput",
+        unit=MetricUnit.CountPerSecond,
+        value=result.items_per_second,
+    )
+    if not result.complete:
+        logger.info("Room {} not purged yet, queued".format(room_id))
+        purge_queue.send({"roomId": room_id})
+
+
+def record_handler(record):
+    purge_room(record.json_body["roomId"])
 
 
 @metrics.log_metrics(capture_cold_start_metric=True)
 @tracer.capture_lambda_handler
 @logger.inject_lambda_context
+@instrument_handler
 def handler(event, context):
-    table = db_client.Table(messages_table_name)
-    response = table.scan()
-    with table.batch_writer() as batch:
-        for each in response["Items"]:
-            batch.delete_item(Key={"PK": each["PK"], "SK": each["SK"]})
-    return True
+    if "Records" in event:
+        # Imported here, the batch utility loads boto3, which the mutations don't need
+        from aws_lambda_powertools.utilities.batch import (
+            BatchProcessor,
+            EventType,
+            process_partial_response,
+        )
+
+        return process_partial_response(
+            event=event,
+            record_handler=record_handler,
+            processor=BatchProcessor(event_type=EventType.SQS),
+            context=context,
+        )
+    arguments = event.get("arguments") or {}
+    room_id = room_id_or_default(arguments.get("roomId"))
+    if arguments.get("mode") == "CLEAR":
+        # O(1) whatever the size of the room: move the watermark, the old messages are never read again
+        cleared_before = clear_room(messages_table, room_id)
+        logger.info("Room {} cleared up to {}".format(room_id, cleared_before))
+        return {"roomId": room_id, "mode": "CLEAR"}
+    purge_room(room_id)
+    return {"roomId": room_id, "mode": "PURGE"}
@@ -0,0 +1,88 @@
+from time import monotonic
+from collections import namedtuple
+from threading import BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_runtime.messages import MESSAGE_SK_PREFIX
+from shared_runtime.batch_writes import chunks, client_batch_delete
+from shared_runtime.deadlines import deadline
+
+# Deletes the messages of a room in batches over a thread pool, with the thread safe low-level client. It stops reading
+# pages when less than 'reserve_seconds' are left, and purging the room again resumes it
+
+PurgeResult = namedtuple(
+    "PurgeResult", ["deleted", "seconds", "items_per_second", "complete"]
+)
+
+
+def query_keys(client, table_name: str, pk: str, sk_prefix: str):
+    # Yields the keys of one partition whose SK starts with 'sk_prefix', page by page
+    query_kwargs = {
+        "TableName": table_name,
+        "KeyConditionExpression": "PK = :pk AND begins_with(SK, :sk_prefix)",
+        "ExpressionAttributeValues": {":pk": {"S": pk}, ":sk_prefix": {"S": sk_prefix}},
+        "ProjectionExpression": "PK, SK",
+    }
+    while True:
+        response = client.query(**query_kwargs)
+        if response["Items"]:
+            yield response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def purge(
+    client,
+    table_name: str,
+    pages,
+    max_workers: int = 16,
+    reserve_seconds: float = 5,
+) -> PurgeResult:
+    # pages: iterable of key pages
+    started_at = monotonic()
+    in_flight = BoundedSemaphore(2 * max_workers)
+    deleted = 0
+    complete = True
+
+    def delete_batch(batch: list) -> int:
+        try:
+            return client_batch_delete(client, table_name, batch)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for page in pages:
+            for batch in chunks(page):
+                in_flight.acquire()
+                futures.append(executor.submit(delete_batch, batch))
+            deleted += sum(future.result() for future in futures if future.done())
+            futures = [future for future in futures if not future.done()]
+            if deadline.remaining_seconds() < reserve_seconds:
+                complete = False
+                break
+        deleted += sum(future.result() for future in futures)
+    seconds = monotonic() - started_at
+    return PurgeResult(
+        deleted, seconds, deleted / seconds if seconds else 0.0, complete
+    )
+
+
+def purge_partition(
+    client,
+    table_name: str,
+    pk: str,
+    max_workers: int = 16,
+    sk_prefix: str = MESSAGE_SK_PREFIX,
+    reserve_seconds: float = 5,
+) -> PurgeResult:
+    # Only the messages by default: the META item keeps the settings of the room (its retention and clear watermark)
+    # and the idempotency items the answers to the retries. The stream updates the RECENT item as the messages go
+    return purge(
+        client,
+        table_name,
+        query_keys(client, table_name, pk, sk_prefix),
+        max_workers,
+        reserve_seconds,
+    )
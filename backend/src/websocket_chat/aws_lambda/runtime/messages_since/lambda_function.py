@@ -0,0 +1,97 @@
+import re
+from os import environ
+from time import time
+from heapq import merge
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_runtime.messages import (
+    room_id_or_default,
+    ai_audience,
+    tenant_audience,
+    get_cleared_before,
+    ulid_from_timestamp,
+    page_size,
+)
+from shared_runtime.message_items import (
+    SYNC_INDEX,
+    SYNC_SETTLE_MS,
+    graphql_messages,
+    sync_cursor,
+)
+from shared_runtime.usernames import UsernameResolver
+from shared_runtime.clients import lazy_table, thread_table
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
+
+SYNC_CURSOR_PATTERN = re.compile(r"^[0-9A-HJKMNP-TV-Z]{26}$")
+
+messages_table_name = environ["MESSAGES_TABLE_NAME"]
+user_profiles_table_name = environ["USER_PROFILES_TABLE_NAME"]
+
+messages_table = lazy_table(messages_table_name)
+username_resolver = UsernameResolver(None, lazy_table(user_profiles_table_name))
+
+executor = ThreadPoolExecutor(max_workers=2)
+
+
+def sync_cursor_or_error(cursor: str) -> str:
+    if not SYNC_CURSOR_PATTERN.match(cursor):
+        raise ValueError("Invalid sync cursor")
+    return cursor
+
+
+def query_since(audience: str, since: str, limit: int):
+    # Oldest first. One extra item tells whether there are more
+    from boto3.dynamodb.conditions import Key
+
+    response = thread_table(messages_table_name).query(
+        IndexName=SYNC_INDEX,
+        KeyConditionExpression=Key("VisibleTo").eq(audience) & Key("W").gt(since),
+        Limit=limit + 1,
+    )
+    return response["Items"], "LastEvaluatedKey" in response
+
+
+# Catch up of a client that reconnects: the messages written after its cursor, read from the SyncIndex instead of
+# reloading the room. The cursor comes from the messages the client received, or from the previous delta. While
+# hasMore is true the client asks again right away with the new cursor
+@metrics.log_metrics(capture_cold_start_metric=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context
+@instrument_handler
+def handler(event, context):
+    arguments = event["arguments"]
+    room_id = room_id_or_default(arguments.get("roomId"))
+    since = sync_cursor_or_error(arguments["cursor"])
+    limit = page_size(arguments.get("limit"))
+    audiences = [
+        ai_audience(room_id),
+        tenant_audience(room_id, event["identity"]["claims"]["sub"]),
+    ]
+    futures = [
+        executor.submit(query_since, audience, since, limit) for audience in audiences
+    ]
+    cleared_before = get_cleared_before(messages_table, room_id)
+    pages = [future.result() for future in futures]
+    written = list(merge(*(items for items, _ in pages), key=lambda item: item["W"]))
+    has_more = len(written) > limit or any(more for _, more in pages)
+    written = written[:limit]
+    # The writes before this one have all landed
+    settled = ulid_from_timestamp(int(time() * 1000) - SYNC_SETTLE_MS)
+    if has_more:
+        # Every message up to the last one returned was read. When it is not settled yet, the next page starts from
+        # its sync cursor, like the cursor of a message, unless that doesn't move past 'since': more than a page was
+        # written within SYNC_SETTLE_MS, and the subscriptions deliver what still lands
+        last_written = written[-1]["W"]
+        rewound = sync_cursor(last_written)
+        cursor = rewound if last_written > settled and rewound > since else last_written
+    else:
+        # Up to now, less what may still be landing
+        cursor = max(since, settled)
+    # Messages up to the watermark of the last clear are hidden
+    visible = [item for item in written if item["SK"] > (cleared_before or "")]
+    return {
+        "items": graphql_messages(visible, room_id, username_resolver),
+        "cursor": cursor,
+        "hasMore": has_more,
+    }
@@ -1,38 +1,103 @@
 from os import environ
+from concurrent.futures import ThreadPoolExecutor
 
-from boto3 import resource, client
+from shared_runtime.messages import (
+    VISIBILITY_INDEX,
+    room_id_or_default,
+    ai_audience,
+    tenant_audience,
+    audience_condition,
+    get_cleared_before,
+    merge_newest_first,
+    encode_cursor,
+    decode_cursor,
+    page_size,
+)
+from shared_runtime.message_items import graphql_messages
+from shared_runtime.recent_messages import get_recent, recent_page
+from shared_runtime.usernames import UsernameResolver
+from shared_runtime.clients import lazy_table, thread_table
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
 
-from aws_lambda_powertools import Logger, Metrics, Tracer
-from aws_lambda_powertools.logging import correlation_paths
-from aws_lambda_powertools.metrics import MetricUnit
+messages_table_name = environ["MESSAGES_TABLE_NAME"]
+user_profiles_table_name = environ["USER_PROFILES_TABLE_NAME"]
 
-metrics = Metrics(service="websocket_chat", namespace="serverless_demo")
-tracer = Tracer(service="websocket_chat")
-logger = Logger(service="websocket_chat")
+messages_table = lazy_table(messages_table_name)
+# Only resolves the authors of the messages, from the profiles table, so it never needs the user pool
+username_resolver = UsernameResolver(None, lazy_table(user_profiles_table_name))
+
+executor = ThreadPoolExecutor(max_workers=2)
+
+
+def query_audience(audience: str, cleared_before, exclusive_start_key, limit: int):
+    query_kwargs = {
+        "IndexName": VISIBILITY_INDEX,
+        "KeyConditionExpression": audience_condition(audience, cleared_before),
+        "ScanIndexForward": False,
+        "Limit": limit,
+    }
+    if exclusive_start_key:
+        query_kwargs["ExclusiveStartKey"] = exclusive_start_key
+    response = thread_table(messages_table_name).query(**query_kwargs)
+    return response["Items"], response.get("LastEvaluatedKey")
 
-messages_table_name = environ["MESSAGES_TABLE_NAME"]
 
-db_client = resource("dynamodb")
+def query_page(room_id: str, audiences: list, cursor, limit: int):
+    # Both audiences are separate partitions of the VisibilityIndex, so they are queried in parallel (newest first)
+    # and merged by time
+    if cursor is None:
+        start_keys = {audience: None for audience in audiences}
+    else:  # Audiences come from the identity, never from the cursor
+        start_keys = {
+            audience: cursor[audience] for audience in audiences if audience in cursor
+        }
+    # Messages up to the watermark of the last clear are hidden
+    cleared_before = get_cleared_before(messages_table, room_id)
+    if cleared_before:
+        start_keys = {
+            audience: start_key
+            for audience, start_key in start_keys.items()
+            if start_key is None or start_key["SK"] > cleared_before
+        }
+    futures = {
+        audience: executor.submit(
+            query_audience, audience, cleared_before, start_key, limit
+        )
+        for audience, start_key in start_keys.items()
+    }
+    pages = {audience: future.result() for audience, future in futures.items()}
+    return merge_newest_first(pages, start_keys, limit)
 
 
 @metrics.log_metrics(capture_cold_start_metric=True)
 @tracer.capture_lambda_handler
 @logger.inject_lambda_context
+@instrument_handler
 def handler(event, context):
-    table = db_client.Table(messages_table_name)
-    response = table.scan()
-    graphql_response = []
-    for item in response["Items"]:
-        if (
-            item["AiGenerated"]
-            or item["TenantId"] == event["identity"]["claims"]["sub"]
-        ):
-            graphql_response.append(
-                {
-                    "text": item["Text"],
-                    "aiGenerated": item["AiGenerated"],
-                    "username": item["Username"],
-                    "tenantId": item["TenantId"],
-                }
-            )
-    return graphql_response
+    arguments = event.get("arguments") or {}
+    room_id = room_id_or_default(arguments.get("roomId"))
+    limit = page_size(arguments.get("limit"))
+    # The caller sees the AI messages of the room plus their own messages
+    audiences = [
+        ai_audience(room_id),
+        tenant_audience(room_id, event["identity"]["claims"]["sub"]),
+    ]
+    cursor = decode_cursor(arguments.get("after"))
+    page = None
+    if cursor is None:
+        # The first page is usually served from the RECENT item of the room with a single read, whatever the number
+        # of clients opening the chat at once
+        page = recent_page(get_recent(messages_table, room_id), audiences, limit)
+    if page is not None:
+        items, next_start_keys = page
+    else:
+        items, next_start_keys = query_page(room_id, audiences, cursor, limit)
+    # Oldest first, as the chat displays them
+    graphql_response = graphql_messages(
+        list(reversed(items)), room_id, username_resolver
+    )
+    return {
+        "items": graphql_response,
+        "nextToken": encode_cursor(next_start_keys),
+    }
@@ -0,0 +1,40 @@
+from os import environ
+
+from shared_runtime.recent_messages import (
+    RecentVersionConflict,
+    room_changes,
+    update_recent,
+)
+from shared_runtime.retry import retry_with_backoff
+from shared_runtime.clients import lazy_table
+from shared_runtime.env import env_int
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
+
+messages_table_name = environ["MESSAGES_TABLE_NAME"]
+recent_max_messages = env_int("RECENT_MAX_MESSAGES", 100)
+recent_max_bytes = env_int("RECENT_MAX_BYTES", 300_000)
+
+messages_table = lazy_table(messages_table_name)
+
+
+# Keeps the RECENT item of each room up to date from the messages table stream
+@metrics.log_metrics(capture_cold_start_metric=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context
+@instrument_handler
+def handler(event, context):
+    for room_id, changes in room_changes(event["Records"]).items():
+        # One read and one write per room and batch
+        retry_with_backoff(
+            lambda: update_recent(
+                messages_table,
+                room_id,
+                changes,
+                recent_max_messages,
+                recent_max_bytes,
+            ),
+            (RecentVersionConflict,),
+            attempts=5,
+        )
+        logger.info("Applied {} changes to room {}".format(len(changes), room_id))
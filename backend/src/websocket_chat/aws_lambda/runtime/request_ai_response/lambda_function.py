@@ -1,127 +1,106 @@
 from os import environ
-from json import loads
-from uuid import uuid4
-from datetime import datetime, timezone
 
-from boto3 import resource, client, session
-from botocore.exceptions import ClientError
+from shared_runtime.messages import new_message_id, room_id_or_default
+from shared_runtime.idempotency import (
+    idempotency_key_or_none,
+    idempotency_item_key,
+    claim,
+    release,
+)
+from shared_runtime.rate_limits import RateLimiter
+from shared_runtime.usernames import UsernameResolver
+from shared_runtime.queues import SqsQueue
+from shared_runtime.clients import get_client, lazy_table
+from shared_runtime.env import env_int
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
 
-from aws_lambda_powertools import Logger, Metrics, Tracer
-from aws_lambda_powertools.logging import correlation_paths
-from aws_lambda_powertools.metrics import MetricUnit
-from openai import ChatCompletion
-
-metrics = Metrics(service="websocket_chat", namespace="serverless_demo")
-tracer = Tracer(service="websocket_chat")
-logger = Logger(service="websocket_chat")
-
-region_name = environ["AWS_REGION"]
 user_pool_arn = environ["USER_POOL_ARN"]
 user_pool_id = user_pool_arn.split("/")[1]
+user_profiles_table_name = environ["USER_PROFILES_TABLE_NAME"]
 messages_table_name = environ["MESSAGES_TABLE_NAME"]
-openai_token_secret_name = environ[
-    "OPENAI_TOKEN_SECRET_NAME"
-]  # Same as the key for the key-value pair in Secrets Manager
+ai_response_queue_url = environ["AI_RESPONSE_QUEUE_URL"]
+
+messages_table = lazy_table(messages_table_name)
+username_resolver = UsernameResolver(user_pool_id, lazy_table(user_profiles_table_name))
+ai_response_queue = SqsQueue(ai_response_queue_url, lambda: get_client("sqs"))
+# A tenant can't request more than its share of answers, and all of them together can't queue more tokens than the
+# OpenAI quota of the account. The rejected requests fail fast instead of waiting in the queue
+tenant_rate_limiter = RateLimiter(
+    messages_table,
+    "RequestAiResponse",
+    env_int("TENANT_AI_REQUESTS_PER_MINUTE", 6),
+    env_int("TENANT_AI_REQUESTS_BURST", 3),
+    metrics,
+)
+openai_tokens_per_minute = env_int("OPENAI_TOKENS_PER_MINUTE", 60000)
+openai_token_limiter = RateLimiter(
+    messages_table,
+    "OpenAITokens",
+    openai_tokens_per_minute,
+    openai_tokens_per_minute,
+    metrics,
+)
+# The system prompt, the chat history (up to HISTORY_MAX_TOKENS) and the answer, on top of the user prompt
+openai_tokens_per_request = env_int("OPENAI_TOKENS_PER_REQUEST", 800)
 
-db_client = resource("dynamodb")
-cognito_client = client("cognito-idp")
 
+def estimated_tokens(text: str) -> int:
+    # ~4 characters per token, like estimate_tokens in the ai_response_worker function
+    return openai_tokens_per_request + len(text) // 4
 
+
+# Only queues the request. The ai_response_worker function calls the model and publishes the answer through the
+# publishAiResponse mutation, which the onRequestAiResponse subscribers also receive
 @metrics.log_metrics(capture_cold_start_metric=True)
 @tracer.capture_lambda_handler
 @logger.inject_lambda_context
+@instrument_handler
 def handler(event, context):
-    table = db_client.Table(messages_table_name)
-    # Get the Cognito user prefered_username attribute from the sub id
-    user = cognito_client.admin_get_user(
-        UserPoolId=user_pool_id, Username=event["identity"]["claims"]["sub"]
+    room_id = room_id_or_default(event["arguments"]["message"].get("roomId"))
+    idempotency_key = idempotency_key_or_none(
+        event["arguments"]["message"].get("idempotencyKey")
     )
-    preferred_username = None
-    for attribute in user["UserAttributes"]:
-        if attribute["Name"] == "preferred_username":
-            preferred_username = attribute["Value"]
-            break
-    # Get the OpenAI token from Secrets Manager
-    session_ = session.Session()
-    client = session_.client(service_name="secretsmanager", region_name=region_name)
-    try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=openai_token_secret_name
-        )
-    except ClientError as e:
-        logger.exception(
-            "Error retrieving secret from secrets manager: {}".format(str(e))
-        )
-        raise e
-    secret = loads(get_secret_value_response["SecretString"])
-    secret = secret[openai_token_secret_name]
-    # Prepare the AI inputs
-    ## Prompt
-    ai_prompt = [
-        {
-            "role": "system",
-            "content": """You are {}, the orator/statesman from the time of the greeks, and you are debating against other greek orator(s).
-            You will be provided the chat history of the debate between yourself and the others. With that, you will also receive one user message/prompt,
-            that you have to turn into a convincing argument in the style of {}, to be added to the conversation.
-            The argument must be expressed in one short sentence ending with a point.
-            The argument must be in favor of whatever the user has prompted you to support.""".format(
-                preferred_username, preferred_username, preferred_username
-            ),
-        }
-    ]
-    ## Chat history
-    response = table.scan()
-    chat_history = []
-    logger.info(response)
-    for item in response["Items"]:
-        if (
-            item["AiGenerated"]
-            and item["TenantId"] == event["identity"]["claims"]["sub"]
-        ):
-            chat_history.append({"role": "assistant", "content": item["Text"]})
-        elif item["AiGenerated"]:
-            chat_history.append({"role": "user", "content": item["Text"]})
-    ## User message
-    user_message = [
-        {
-            "role": "user",
-            "content": "User prompt: " + event["arguments"]["message"]["text"],
-        }
-    ]
-    # Get a completion from OpenAI
-    chat_inputs = []
-    chat_inputs.extend(ai_prompt)
-    chat_inputs.extend(chat_history)
-    chat_inputs.extend(user_message)
-    openai.api_key = secret
-    try:
-        ai_response = ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=chat_inputs,
-            max_tokens=25,
-            n=1,
-            stop=[".", "?", "!", "\n"],
-            temperature=0.5,
-        )
-    except Exception as e:
-        logger.exception("Error calling OpenAI: {}".format(str(e)))
-        raise
-    # Save the response to DynamoDB and return it to the client
-    message_id = str(uuid4())
-    creation_date = datetime.now(timezone.utc).isoformat(timespec="seconds")
-    ai_response = ai_response["choices"][0]["message"]["content"]
-    message = {
-        "PK": message_id,
-        "SK": creation_date,
-        "Text": ai_response,
-        "AiGenerated": True,
-        "Username": preferred_username,
-        "TenantId": event["identity"]["claims"]["sub"],
-    }
-    response = table.put_item(Item=message)
-    return {
-        "text": ai_response,
+    tenant_id = event["identity"]["claims"]["sub"]
+    # Get the Cognito user prefered_username attribute from the sub id
+    preferred_username = username_resolver.resolve(event["identity"])
+    response = {
+        "id": new_message_id(),
+        "roomId": room_id,
+        "text": "",
         "aiGenerated": True,
-        "tenantId": event["identity"]["claims"]["sub"],
+        "tenantId": tenant_id,
         "username": preferred_username,
+        "status": "PENDING",
     }
+    item_key = None
+    if idempotency_key:
+        # A retry gets the pending message back, or the answer once the worker stored it, and doesn't call the
+        # model again
+        item_key = idempotency_item_key(
+            room_id, "requestAiResponse", tenant_id, idempotency_key
+        )
+        response, claimed = claim(messages_table, item_key, response)
+        if not claimed:
+            return response
+    request = {
+        "messageId": response["id"],
+        "roomId": room_id,
+        "tenantId": tenant_id,
+        "username": preferred_username,
+        "text": event["arguments"]["message"]["text"],
+    }
+    if item_key:
+        request["idempotencyKey"] = idempotency_key
+    try:
+        # Raise RateLimitExceeded, which the client gets as the error of the mutation. Only the new requests take
+        # tokens, the retries of a claimed one got its response above. The tenant's bucket is checked first, so a
+        # tenant over its limit doesn't use up the budget of the others
+        tenant_rate_limiter.take(tenant_id)
+        openai_token_limiter.take("global", estimated_tokens(request["text"]))
+        ai_response_queue.send(request)
+    except Exception:
+        if item_key:
+            release(messages_table, item_key)
+        raise
+    return response
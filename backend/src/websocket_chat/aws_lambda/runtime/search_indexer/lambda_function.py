@@ -0,0 +1,33 @@
+from os import environ
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+from shared_runtime.search import posting_changes
+from shared_runtime.batch_writes import batch_put, batch_delete
+from shared_runtime.clients import lazy_table
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
+
+messages_table_name = environ["MESSAGES_TABLE_NAME"]
+
+messages_table = lazy_table(messages_table_name)
+
+
+# Keeps the inverted index of searchMessages up to date from the messages table stream
+@metrics.log_metrics(capture_cold_start_metric=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context
+@instrument_handler
+def handler(event, context):
+    puts, deletes = posting_changes(event["Records"])
+    batch_put(messages_table, puts)
+    batch_delete(messages_table, deletes)
+    metrics.add_metric(name="PostingsWritten", unit=MetricUnit.Count, value=len(puts))
+    metrics.add_metric(
+        name="PostingsDeleted", unit=MetricUnit.Count, value=len(deletes)
+    )
+    logger.info(
+        "Indexed {} records: {} postings written, {} deleted".format(
+            len(event["Records"]), len(puts), len(deletes)
+        )
+    )
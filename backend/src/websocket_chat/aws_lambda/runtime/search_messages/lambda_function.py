@@ -0,0 +1,86 @@
+from os import environ
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_runtime.messages import (
+    room_id_or_default,
+    ai_audience,
+    tenant_audience,
+    get_cleared_before,
+    encode_cursor,
+    decode_cursor,
+    page_size,
+)
+from shared_runtime.message_items import graphql_messages
+from shared_runtime.search import (
+    MAX_CANDIDATES_PER_LIST,
+    query_terms,
+    posting_pk,
+    rank,
+    get_messages,
+)
+from shared_runtime.usernames import UsernameResolver
+from shared_runtime.clients import lazy_table, thread_table
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
+
+messages_table_name = environ["MESSAGES_TABLE_NAME"]
+user_profiles_table_name = environ["USER_PROFILES_TABLE_NAME"]
+
+messages_table = lazy_table(messages_table_name)
+username_resolver = UsernameResolver(None, lazy_table(user_profiles_table_name))
+
+# Up to 2 audiences x 5 terms posting lists
+executor = ThreadPoolExecutor(max_workers=10)
+
+
+def query_postings(audience: str, term: str):
+    from boto3.dynamodb.conditions import Key
+
+    response = thread_table(messages_table_name).query(
+        KeyConditionExpression=Key("PK").eq(posting_pk(audience, term)),
+        ScanIndexForward=False,
+        Limit=MAX_CANDIDATES_PER_LIST,
+    )
+    return term, response["Items"]
+
+
+def offset_or_error(cursor) -> int:
+    if cursor is None:
+        return 0
+    if not isinstance(cursor, dict) or not isinstance(cursor.get("offset"), int):
+        raise ValueError("Invalid pagination cursor")
+    return max(0, cursor["offset"])
+
+
+# Keyword search over the messages the caller can read, from the inverted index of shared_runtime/search.py. The
+# whole ranking is computed for every page, the cursor is the offset of the next page in it
+@metrics.log_metrics(capture_cold_start_metric=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context
+@instrument_handler
+def handler(event, context):
+    arguments = event["arguments"]
+    room_id = room_id_or_default(arguments.get("roomId"))
+    terms = query_terms(arguments["query"])
+    limit = page_size(arguments.get("limit"))
+    offset = offset_or_error(decode_cursor(arguments.get("after")))
+    # The caller sees the AI messages of the room plus their own messages
+    audiences = [
+        ai_audience(room_id),
+        tenant_audience(room_id, event["identity"]["claims"]["sub"]),
+    ]
+    futures = [
+        executor.submit(query_postings, audience, term)
+        for audience in audiences
+        for term in terms
+    ]
+    cleared_before = get_cleared_before(messages_table, room_id)
+    ranked = rank([future.result() for future in futures], cleared_before)
+    page = ranked[offset : offset + limit]
+    items = get_messages(messages_table, room_id, page)
+    return {
+        "items": graphql_messages(items, room_id, username_resolver),
+        "nextToken": encode_cursor(
+            {"offset": offset + limit} if offset + limit < len(ranked) else None
+        ),
+    }
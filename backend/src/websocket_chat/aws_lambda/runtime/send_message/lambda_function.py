@@ -1,55 +1,96 @@
 from os import environ
-from uuid import uuid4
-from copy import deepcopy
-from datetime import datetime, timezone
 
-from boto3 import resource, client
-
-from aws_lambda_powertools import Logger, Metrics, Tracer
-from aws_lambda_powertools.logging import correlation_paths
-from aws_lambda_powertools.metrics import MetricUnit
-
-metrics = Metrics(service="websocket_chat", namespace="serverless_demo")
-tracer = Tracer(service="websocket_chat")
-logger = Logger(service="websocket_chat")
+from shared_runtime.messages import new_message_id, room_id_or_default
+from shared_runtime.message_items import (
+    compact_message_item,
+    sync_cursor,
+    RoomRetention,
+)
+from shared_runtime.idempotency import (
+    idempotency_key_or_none,
+    idempotency_item_key,
+    claim_write,
+    release,
+)
+from shared_runtime.rate_limits import RateLimiter
+from shared_runtime.usernames import UsernameResolver
+from shared_runtime.clients import lazy_table
+from shared_runtime.env import env_int
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
 
 user_pool_arn = environ["USER_POOL_ARN"]
 user_pool_id = user_pool_arn.split("/")[1]
 messages_table_name = environ["MESSAGES_TABLE_NAME"]
+user_profiles_table_name = environ["USER_PROFILES_TABLE_NAME"]
 
-db_client = resource("dynamodb")
-cognito_client = client("cognito-idp")
+# 0 never compresses the texts
+compress_min_chars = env_int("COMPRESS_MESSAGES_MIN_CHARS", 0)
+
+messages_table = lazy_table(messages_table_name)
+room_retention = RoomRetention(messages_table, env_int("DEFAULT_RETENTION_DAYS", 0))
+username_resolver = UsernameResolver(user_pool_id, lazy_table(user_profiles_table_name))
+tenant_rate_limiter = RateLimiter(
+    messages_table,
+    "SendMessage",
+    env_int("TENANT_MESSAGES_PER_MINUTE", 30),
+    env_int("TENANT_MESSAGES_BURST", 10),
+    metrics,
+)
 
 
 @metrics.log_metrics(capture_cold_start_metric=True)
 @tracer.capture_lambda_handler
 @logger.inject_lambda_context
+@instrument_handler
 def handler(event, context):
-    table = db_client.Table(messages_table_name)
-    # Get the Cognito user prefered_username attribute from the sub id
-    user = cognito_client.admin_get_user(
-        UserPoolId=user_pool_id, Username=event["identity"]["claims"]["sub"]
+    room_id = room_id_or_default(event["arguments"]["message"].get("roomId"))
+    idempotency_key = idempotency_key_or_none(
+        event["arguments"]["message"].get("idempotencyKey")
     )
-    preferred_username = None
-    for attribute in user["UserAttributes"]:
-        if attribute["Name"] == "preferred_username":
-            preferred_username = attribute["Value"]
-            break
-    # Save the message to the database
-    message_id = str(uuid4())
-    creation_date = datetime.now(timezone.utc).isoformat(timespec="seconds")
-    message = {
-        "PK": message_id,
-        "SK": creation_date,
-        "Text": event["arguments"]["message"]["text"],
-        "AiGenerated": False,
-        "Username": preferred_username,
-        "TenantId": event["identity"]["claims"]["sub"],
-    }
-    response = table.put_item(Item=message)
-    return {
+    tenant_id = event["identity"]["claims"]["sub"]
+    # Get the Cognito user prefered_username attribute from the sub id
+    preferred_username = username_resolver.resolve(event["identity"])
+    written_id = new_message_id()
+    response = {
+        "id": new_message_id(),
+        "roomId": room_id,
         "text": event["arguments"]["message"]["text"],
         "aiGenerated": False,
-        "tenantId": event["identity"]["claims"]["sub"],
+        "tenantId": tenant_id,
         "username": preferred_username,
+        "cursor": sync_cursor(written_id),
     }
+    item_key = None
+    new_message = True
+    if idempotency_key:
+        # A retry gets the message of the first request back, and the W it was written with
+        item_key = idempotency_item_key(
+            room_id, "sendMessage", tenant_id, idempotency_key
+        )
+        response, written_id, new_message = claim_write(
+            messages_table, item_key, response, written_id
+        )
+    if new_message:
+        # Raises RateLimitExceeded, which the client gets as the error of the mutation. Only the new messages take
+        # tokens, the retries of a claimed key don't
+        try:
+            tenant_rate_limiter.take(tenant_id)
+        except Exception:
+            if item_key:
+                release(messages_table, item_key)
+            raise
+    # Save the message to the database. Writing the same message again is harmless, so a retry also saves the
+    # message of a first request that failed after claiming the key
+    message = compact_message_item(
+        room_id,
+        response["id"],
+        tenant_id,
+        response["text"],
+        False,
+        room_retention.expires_at(room_id, response["id"]),
+        compress_min_chars,
+        written_id,
+    )
+    messages_table.put_item(Item=message)
+    return response
@@ -0,0 +1,102 @@
+from os import environ
+
+from aws_lambda_powertools.metrics import MetricUnit
+
+from shared_runtime.messages import new_message_id, room_id_or_default
+from shared_runtime.message_items import (
+    compact_message_item,
+    expires_at,
+    sync_cursor,
+    RoomRetention,
+)
+from shared_runtime.batch_writes import batch_put
+from shared_runtime.rate_limits import RateLimiter
+from shared_runtime.usernames import UsernameResolver
+from shared_runtime.clients import lazy_table
+from shared_runtime.env import env_int
+from shared_runtime.observability import logger, metrics, tracer
+from shared_runtime.instrumentation import instrument_handler
+
+user_pool_arn = environ["USER_POOL_ARN"]
+user_pool_id = user_pool_arn.split("/")[1]
+messages_table_name = environ["MESSAGES_TABLE_NAME"]
+user_profiles_table_name = environ["USER_PROFILES_TABLE_NAME"]
+max_batch_messages = env_int("MAX_BATCH_MESSAGES", 100)
+# 0 never compresses the texts
+compress_min_chars = env_int("COMPRESS_MESSAGES_MIN_CHARS", 0)
+
+messages_table = lazy_table(messages_table_name)
+username_resolver = UsernameResolver(user_pool_id, lazy_table(user_profiles_table_name))
+room_retention = RoomRetention(messages_table, env_int("DEFAULT_RETENTION_DAYS", 0))
+# Each message of a batch takes a token, from a bucket of its own so bulk imports don't use up the one of sendMessage
+tenant_rate_limiter = RateLimiter(
+    messages_table,
+    "SendMessages",
+    env_int("TENANT_BATCH_MESSAGES_PER_MINUTE", 600),
+    env_int("TENANT_BATCH_MESSAGES_BURST", 100),
+    metrics,
+)
+
+
+def batch_room_id(messages: list) -> str:
+    # The batch is published as one event, which the subscribers filter by room
+    room_ids = {room_id_or_default(message.get("roomId")) for message in messages}
+    if len(room_ids) != 1:
+        raise ValueError("The messages of a batch must be in the same room")
+    return room_ids.pop()
+
+
+# Bulk version of sendMessage, for bots, imports and replays: the username is resolved once and the messages are
+# written with BatchWriteItem, instead of one invocation and one PutItem per message. AppSync publishes the returned
+# batch to the onSendMessages subscribers
+@metrics.log_metrics(capture_cold_start_metric=True)
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context
+@instrument_handler
+def handler(event, context):
+    messages = event["arguments"]["messages"]
+    if not 1 <= len(messages) <= max_batch_messages:
+        raise ValueError("Send 1 to {} messages at a time".format(max_batch_messages))
+    if any(message.get("idempotencyKey") for message in messages):
+        # A claim per message would cost as much as sending them one by one
+        raise ValueError("Idempotency keys are only supported by sendMessage")
+    room_id = batch_room_id(messages)
+    tenant_id = event["identity"]["claims"]["sub"]
+    # Raises RateLimitExceeded, which the client gets as the error of the mutation
+    tenant_rate_limiter.take(tenant_id, len(messages))
+    preferred_username = username_resolver.resolve(event["identity"])
+    retention_days = room_retention.days(room_id)
+    # Distinct written ids, a delta can end in the middle of the batch
+    written_ids = [new_message_id() for _ in messages]
+    responses = [
+        {
+            "id": new_message_id(),  # In the order of the batch
+            "roomId": room_id,
+            "text": message["text"],
+            "aiGenerated": False,
+            "tenantId": tenant_id,
+            "username": preferred_username,
+            "cursor": sync_cursor(written_id),
+        }
+        for message, written_id in zip(messages, written_ids)
+    ]
+    batch_put(
+        messages_table,
+        [
+            compact_message_item(
+                room_id,
+                response["id"],
+                tenant_id,
+                response["text"],
+                False,
+                expires_at(response["id"], retention_days),
+                compress_min_chars,
+                written_id,
+            )
+            for response, written_id in zip(responses, written_ids)
+        ],
+    )
+    metrics.add_metric(
+        name="BatchMessages", unit=MetricUnit.Count, value=len(responses)
+    )
+    return {"roomId": room_id, "tenantId": tenant_id, "items": responses}
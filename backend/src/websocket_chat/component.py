@@ -2,6 +2,7 @@ from constructs import Construct
 from aws_cdk import Stack, Environment, CfnOutput
 
 from src.websocket_chat.dynamodb.infrastructure import Tables
+from src.websocket_chat.sqs.infrastructure import Queues
 from src.websocket_chat.aws_lambda.infrastructure import LambdaFunctions
 from src.websocket_chat.appsync.infrastructure import WebsocketsApi
 
@@ -13,9 +14,11 @@ class WebsocketChat(Stack):
         id: str,
         env: Environment,
         props: dict,
-        stage_name: dict,
+        stage_name: str,
         user_pool_arn: str,
         user_pool_client_id: str,
+        user_profiles_table_name: str,
+        user_profiles_table_arn: str,
         graphql_url_output_key: str,
         graphql_endpoint_name_output_key: str,
         **kwargs,
@@ -23,6 +26,7 @@ class WebsocketChat(Stack):
         super().__init__(scope, id, env=env, **kwargs)
 
         dynamo_tables = Tables(self, "Dynamo")
+        queues = Queues(self, "Queues")
         lambda_functions = LambdaFunctions(
             self,
             "LambdaFunctions",
@@ -32,6 +36,17 @@ class WebsocketChat(Stack):
             user_pool_client_id,
             dynamo_tables.messages_table_name,
             dynamo_tables.messages_table_arn,
+            dynamo_tables.messages_table_stream_arn,
+            user_profiles_table_name,
+            user_profiles_table_arn,
+            queues.ai_response_queue,
+            queues.ai_response_max_receive_count,
+            queues.purge_queue,
+            stage_name=stage_name,
+            performance_profiles=props.get("performance_profiles"),
+            completion_cache=props.get("completion_cache"),
+            completion_routing=props.get("completion_routing"),
+            message_storage=props.get("message_storage"),
         )
         appsync_api = WebsocketsApi(
             self,
@@ -39,9 +54,18 @@ class WebsocketChat(Stack):
             user_pool_arn,
             user_pool_client_id,
             lambda_functions.query_messages_fn,
+            lambda_functions.messages_since_fn,
+            lambda_functions.search_messages_fn,
             lambda_functions.send_message_fn,
+            lambda_functions.send_messages_fn,
             lambda_functions.request_ai_response_fn,
+            lambda_functions.ai_response_worker_fn,
             lambda_functions.delete_all_messages_fn,
+            dynamo_tables.messages_table_arn,
+            user_profiles_table_arn,
+            resolver_kinds=props.get("resolvers"),
+            messages_cache=props.get("messages_cache"),
+            message_storage=props.get("message_storage"),
         )
 
         graphql_url_output = CfnOutput(
@@ -11,6 +11,10 @@ class Tables(Construct):
     def messages_table_name(self):
         return self._messages_table.table_name
 
+    @property
+    def messages_table_stream_arn(self):
+        return self._messages_table.table_stream_arn
+
     def __init__(
         self,
         scope: Construct,
@@ -20,6 +24,8 @@ class Tables(Construct):
     ):
         super().__init__(scope, id, **kwargs)
 
+        # Messages are partitioned by room and sorted by time: PK = "ROOM#<room id>", SK = "MSG#<ulid>".
+        # See shared_runtime/messages.py
         self._messages_table = db.Table(
             self,
             "ChatMessagesTable",
@@ -28,4 +34,25 @@ class Tables(Construct):
             removal_policy=RemovalPolicy.DESTROY,
             billing_mode=db.BillingMode.PAY_PER_REQUEST,
             table_class=db.TableClass.STANDARD,
+            # Keeps the RECENT item of each room and the search index up to date, see the recent_messages and
+            # search_indexer functions. The indexer needs the old images to delete the postings of deleted messages
+            stream=db.StreamViewType.NEW_AND_OLD_IMAGES,
+            # Expires the idempotency, rate limit and completion items, and the messages of the rooms with a
+            # retention with their search postings (shared_runtime/message_items.py and search.py)
+            time_to_live_attribute="ExpiresAt",
+        )
+        # Sparse index with one partition per audience (the room's AI messages, or one tenant's messages), so a
+        # reader only pays for the messages it is allowed to see
+        self._messages_table.add_global_secondary_index(
+            index_name="VisibilityIndex",
+            partition_key=db.Attribute(name="VisibleTo", type=db.AttributeType.STRING),
+            sort_key=db.Attribute(name="SK", type=db.AttributeType.STRING),
+            projection_type=db.ProjectionType.ALL,
+        )
+        # Sparse index of the messages by write time, per audience, for messagesSince. Only the items with a W are in it
+        self._messages_table.add_global_secondary_index(
+            index_name="SyncIndex",
+            partition_key=db.Attribute(name="VisibleTo", type=db.AttributeType.STRING),
+            sort_key=db.Attribute(name="W", type=db.AttributeType.STRING),
+            projection_type=db.ProjectionType.ALL,
         )
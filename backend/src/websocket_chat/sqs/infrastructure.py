@@ -0,0 +1,63 @@
+from constructs import Construct
+from aws_cdk import Duration, aws_sqs as sqs
+
+
+class Queues(Construct):
+    @property
+    def ai_response_queue(self):
+        return self._ai_response_queue
+
+    @property
+    def ai_response_max_receive_count(self):
+        return self._max_receive_count
+
+    @property
+    def purge_queue(self):
+        return self._purge_queue
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        max_receive_count: int = 3,
+        props: dict = None,
+        **kwargs,
+    ):
+        super().__init__(scope, id, **kwargs)
+
+        self._max_receive_count = max_receive_count
+
+        # Requests for AI responses, consumed by the ai_response_worker function. Requests that fail
+        # 'max_receive_count' times are kept in the dead-letter queue for inspection
+        self._ai_response_dead_letter_queue = sqs.Queue(
+            self,
+            "AiResponseDeadLetterQueue",
+            retention_period=Duration.days(14),
+        )
+        self._ai_response_queue = sqs.Queue(
+            self,
+            "AiResponseQueue",
+            visibility_timeout=Duration.minutes(6),  # 6x the worker timeout, as recommended for Lambda consumers
+            retention_period=Duration.hours(1),  # Nobody waits for an answer longer than that
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=max_receive_count,
+                queue=self._ai_response_dead_letter_queue,
+            ),
+        )
+
+        # Rooms left to purge by the delete_all_messages function, each message one more invocation of it
+        self._purge_dead_letter_queue = sqs.Queue(
+            self,
+            "PurgeDeadLetterQueue",
+            retention_period=Duration.days(14),
+        )
+        self._purge_queue = sqs.Queue(
+            self,
+            "PurgeQueue",
+            visibility_timeout=Duration.minutes(3),  # 6x the function timeout
+            retention_period=Duration.days(1),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=max_receive_count,
+                queue=self._purge_dead_letter_queue,
+            ),
+        )
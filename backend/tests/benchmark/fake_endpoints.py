@@ -0,0 +1,120 @@
+import json
+from time import sleep
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-ins for the OpenAI completions (POST /v1/chat/completions) and the AppSync publishes (POST /graphql),
+# which moto does not cover
+
+
+class FakeEndpoints:
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        completion_text: str = "Athens will stand because its citizens are free.",
+        token_interval_seconds: float = 0.0,
+        error_status: int = None,
+    ):
+        self.latency_seconds = latency_seconds
+        self.completion_text = completion_text
+        self.token_interval_seconds = token_interval_seconds
+        self.error_status = error_status
+        self.request_counts = {"completions": 0, "graphql": 0}
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return "http://{}:{}".format(host, port)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self.request_counts[endpoint] += 1
+
+    def _handler_class(self):
+        endpoints = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path.endswith("/chat/completions"):
+                    endpoints._count("completions")
+                    sleep(endpoints.latency_seconds)
+                    if endpoints.error_status:
+                        self._send_json(
+                            {"error": {"message": "Injected", "type": "server_error"}},
+                            endpoints.error_status,
+                        )
+                    elif body.get("stream"):
+                        self._stream_completion()
+                    else:
+                        self._send_json(endpoints._completion())
+                elif self.path.endswith("/graphql"):
+                    endpoints._count("graphql")
+                    self._send_json({"data": {}})
+                else:
+                    self.send_error(404)
+
+            def _send_json(self, payload: dict, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream_completion(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for token in endpoints.completion_text.split(" "):
+                    sleep(endpoints.token_interval_seconds)
+                    chunk = endpoints._completion_chunk({"content": token + " "})
+                    self.wfile.write("data: {}\n\n".format(json.dumps(chunk)).encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+    def _completion(self) -> dict:
+        return {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-3.5-turbo",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.completion_text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def _completion_chunk(self, delta: dict) -> dict:
+        return {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "gpt-3.5-turbo",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
@@ -0,0 +1,663 @@
+import os
+import sys
+import warnings
+import tracemalloc
+import importlib.util
+from io import StringIO
+from time import perf_counter, thread_time, time
+from threading import Lock, get_ident
+from contextlib import redirect_stdout
+
+from fake_endpoints import FakeEndpoints
+
+# Offline benchmark of the chat functions against moto and fake OpenAI/AppSync endpoints. Reports per scenario the
+# latency percentiles, the capacity units and items read per call, the peak memory and the CPU time outside AWS calls
+
+BACKEND_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+)
+SHARED_RUNTIME_DIR = os.path.join(
+    BACKEND_DIR, "aws_lambda_shared", "shared_runtime", "python"
+)
+FUNCTIONS_DIR = os.path.join(
+    BACKEND_DIR, "src", "websocket_chat", "aws_lambda", "runtime"
+)
+
+MESSAGES_TABLE_NAME = "BenchmarkMessages"
+USER_PROFILES_TABLE_NAME = "BenchmarkUserProfiles"
+OPENAI_SECRET_NAME = "BenchmarkOpenAIToken"
+ROOM_ID = "global"
+TENANT_COUNT = 100
+SEND_MESSAGES_BATCH_SIZE = 100
+
+DYNAMODB_READS = {"GetItem", "BatchGetItem", "Query", "Scan"}
+DYNAMODB_WRITES = {"PutItem", "UpdateItem", "DeleteItem", "BatchWriteItem"}
+
+
+def percentile(values: list, p: float) -> float:
+    # Nearest rank
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def tenant_id(index: int) -> str:
+    return "tenant-%03d" % (index % TENANT_COUNT)
+
+
+class ApiMeter:
+    # Counts and times the AWS calls of every client. For DynamoDB it also asks for the consumed capacity of each call
+    # and adds it up, along with the items each read returned or scanned
+    def __init__(self):
+        self._lock = Lock()
+        self._original_make_api_call = None
+        self.reset()
+
+    def reset(self):
+        self.read_capacity_units = 0.0
+        self.write_capacity_units = 0.0
+        self.items_read = 0
+        self.api_calls = 0
+        self.api_seconds = 0.0
+        self._api_cpu_seconds = {}
+
+    def api_cpu_seconds(self, thread_ident: int) -> float:
+        # CPU time the thread spent inside AWS calls
+        return self._api_cpu_seconds.get(thread_ident, 0.0)
+
+    def __enter__(self):
+        from botocore.client import BaseClient
+
+        meter = self
+        original_make_api_call = BaseClient._make_api_call
+        self._original_make_api_call = original_make_api_call
+
+        def make_api_call(client, operation_name, api_params):
+            metered = client.meta.service_model.service_name == "dynamodb" and (
+                operation_name in DYNAMODB_READS | DYNAMODB_WRITES
+            )
+            if metered:
+                api_params = {"ReturnConsumedCapacity": "TOTAL", **api_params}
+            started_at, cpu_started_at = perf_counter(), thread_time()
+            try:
+                response = original_make_api_call(client, operation_name, api_params)
+            finally:
+                meter._record_call(
+                    perf_counter() - started_at, thread_time() - cpu_started_at
+                )
+            if metered:
+                meter._record(operation_name, response)
+            return response
+
+        BaseClient._make_api_call = make_api_call
+        return self
+
+    def __exit__(self, *exc_info):
+        from botocore.client import BaseClient
+
+        BaseClient._make_api_call = self._original_make_api_call
+
+    def _record_call(self, seconds: float, cpu_seconds: float):
+        with self._lock:
+            self.api_calls += 1
+            self.api_seconds += seconds
+            self._api_cpu_seconds[get_ident()] = (
+                self._api_cpu_seconds.get(get_ident(), 0.0) + cpu_seconds
+            )
+
+    def _record(self, operation_name: str, response: dict):
+        consumed_capacity = response.get("ConsumedCapacity") or []
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        capacity_units = sum(c.get("CapacityUnits", 0.0) for c in consumed_capacity)
+        if operation_name in ("Query", "Scan"):
+            items_read = response.get("ScannedCount", response.get("Count", 0))
+        elif operation_name == "GetItem":
+            items_read = 1 if "Item" in response else 0
+        elif operation_name == "BatchGetItem":
+            items_read = sum(
+                len(items) for items in response.get("Responses", {}).values()
+            )
+        else:
+            items_read = 0
+        with self._lock:
+            if operation_name in DYNAMODB_READS:
+                self.read_capacity_units += capacity_units
+            else:
+                self.write_capacity_units += capacity_units
+            self.items_read += items_read
+
+
+class LambdaContext:
+    function_name = "benchmark"
+    function_version = "$LATEST"
+    memory_limit_in_mb = 128
+    invoked_function_arn = "arn:aws:lambda:eu-west-1:123456789012:function:benchmark"
+    aws_request_id = "benchmark"
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 30_000
+
+
+def load_handler(function_dir: str, module_name: str):
+    # Each function is a 'lambda_function' module in its own folder, next to the modules it imports by name
+    sys.path.insert(0, function_dir)
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(function_dir, "lambda_function.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def identity(index: int) -> dict:
+    # No preferred_username claim, so usernames are resolved through the profiles table like with access tokens
+    return {"claims": {"sub": tenant_id(index)}}
+
+
+class BenchmarkEnvironment:
+    def __init__(self, openai_latency_seconds: float = 0.0, streaming: bool = False):
+        self._openai_latency_seconds = openai_latency_seconds
+        self._streaming = streaming
+        self.handlers = {}
+
+    def __enter__(self):
+        os.environ.update(
+            {
+                "AWS_ACCESS_KEY_ID": "testing",
+                "AWS_SECRET_ACCESS_KEY": "testing",
+                "AWS_SESSION_TOKEN": "testing",
+                "AWS_REGION": "eu-west-1",
+                "AWS_DEFAULT_REGION": "eu-west-1",
+                "POWERTOOLS_TRACE_DISABLED": "true",
+                "POWERTOOLS_LOG_LEVEL": "WARNING",
+                "LOG_LEVEL": "WARNING",
+            }
+        )
+        sys.path.insert(0, SHARED_RUNTIME_DIR)
+        self._endpoints = FakeEndpoints(self._openai_latency_seconds).__enter__()
+        from moto import mock_aws
+
+        self._mock = mock_aws()
+        self._mock.start()
+        import boto3
+
+        self.dynamodb = boto3.client("dynamodb")
+        user_pool_arn = self._create_user_pool(boto3.client("cognito-idp"))
+        boto3.client("secretsmanager").create_secret(
+            Name=OPENAI_SECRET_NAME, SecretString="sk-benchmark"
+        )
+        queue_url = boto3.client("sqs").create_queue(QueueName="BenchmarkAiResponses")[
+            "QueueUrl"
+        ]
+        purge_queue_url = boto3.client("sqs").create_queue(QueueName="BenchmarkPurges")[
+            "QueueUrl"
+        ]
+        os.environ.update(
+            {
+                "MESSAGES_TABLE_NAME": MESSAGES_TABLE_NAME,
+                "USER_PROFILES_TABLE_NAME": USER_PROFILES_TABLE_NAME,
+                "USER_POOL_ARN": user_pool_arn,
+                "AI_RESPONSE_QUEUE_URL": queue_url,
+                "PURGE_QUEUE_URL": purge_queue_url,
+                "OPENAI_TOKEN_SECRET_NAME": OPENAI_SECRET_NAME,
+                "OPENAI_API_BASE": self._endpoints.url + "/v1",
+                "GRAPHQL_URL": self._endpoints.url + "/graphql",
+                "AI_RESPONSE_STREAMING": "true" if self._streaming else "false",
+                "AI_RESPONSE_CHUNK_INTERVAL_SECONDS": "0",
+                "MAX_RECEIVE_COUNT": "1",
+                # The rate limiters still write their buckets, but never reject a call of the benchmark
+                "TENANT_MESSAGES_PER_MINUTE": "1000000",
+                "TENANT_MESSAGES_BURST": "1000000",
+                "TENANT_BATCH_MESSAGES_PER_MINUTE": "1000000",
+                "TENANT_BATCH_MESSAGES_BURST": "1000000",
+                "TENANT_AI_REQUESTS_PER_MINUTE": "1000000",
+                "TENANT_AI_REQUESTS_BURST": "1000000",
+                "OPENAI_TOKENS_PER_MINUTE": "1000000000",
+            }
+        )
+        self.meter = ApiMeter().__enter__()
+        for name in [
+            "query_messages",
+            "messages_since",
+            "search_messages",
+            "send_message",
+            "send_messages",
+            "request_ai_response",
+            "ai_response_worker",
+            "delete_all_messages",
+        ]:
+            self.handlers[name] = load_handler(
+                os.path.join(FUNCTIONS_DIR, name), "benchmark_" + name
+            ).handler
+        return self
+
+    def __exit__(self, *exc_info):
+        self.meter.__exit__(*exc_info)
+        self._mock.stop()
+        self._endpoints.__exit__(*exc_info)
+
+    def _create_user_pool(self, cognito) -> str:
+        user_pool = cognito.create_user_pool(PoolName="BenchmarkUserPool")["UserPool"]
+        for index in range(TENANT_COUNT):
+            cognito.admin_create_user(
+                UserPoolId=user_pool["Id"],
+                Username=tenant_id(index),
+                UserAttributes=[
+                    {"Name": "preferred_username", "Value": "Orator %d" % index}
+                ],
+            )
+        return user_pool["Arn"]
+
+    def reset_tables(self, table_size: int):
+        from shared_runtime.messages import VISIBILITY_INDEX, ulid_from_timestamp
+        from shared_runtime.message_items import SYNC_INDEX, compact_message_item
+
+        for table_name in (MESSAGES_TABLE_NAME, USER_PROFILES_TABLE_NAME):
+            if table_name in self.dynamodb.list_tables()["TableNames"]:
+                self.dynamodb.delete_table(TableName=table_name)
+        self.dynamodb.create_table(
+            TableName=MESSAGES_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+                {"AttributeName": "VisibleTo", "AttributeType": "S"},
+                {"AttributeName": "W", "AttributeType": "S"},
+            ],
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": VISIBILITY_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "VisibleTo", "KeyType": "HASH"},
+                        {"AttributeName": "SK", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                },
+                {
+                    "IndexName": SYNC_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "VisibleTo", "KeyType": "HASH"},
+                        {"AttributeName": "W", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                },
+            ],
+        )
+        self.dynamodb.create_table(
+            TableName=USER_PROFILES_TABLE_NAME,
+            BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[{"AttributeName": "TenantId", "AttributeType": "S"}],
+            KeySchema=[{"AttributeName": "TenantId", "KeyType": "HASH"}],
+        )
+        from boto3.dynamodb.types import TypeSerializer
+
+        serializer = TypeSerializer()
+        # Half the messages are AI answers, visible to everybody, the rest are spread over the tenants
+        started_at_ms = 1_700_000_000_000
+        # Written when they were sent, long before the messages of the scenarios
+        items = (
+            compact_message_item(
+                ROOM_ID,
+                ulid_from_timestamp(started_at_ms + index, index),
+                tenant_id(index // 2),
+                "Message %d of the benchmark, long enough to look like a chat line"
+                % index,
+                index % 2 == 0,
+                written_id=ulid_from_timestamp(started_at_ms + index, index),
+            )
+            for index in range(table_size)
+        )
+        self._batch_put(
+            MESSAGES_TABLE_NAME,
+            ({k: serializer.serialize(v) for k, v in item.items()} for item in items),
+        )
+        self._batch_put(
+            USER_PROFILES_TABLE_NAME,
+            (
+                {
+                    "TenantId": {"S": tenant_id(index)},
+                    "PreferredUsername": {"S": "Orator %d" % index},
+                }
+                for index in range(TENANT_COUNT)
+            ),
+        )
+
+    def _batch_put(self, table_name: str, items):
+        batch = []
+        for item in items:
+            batch.append({"PutRequest": {"Item": item}})
+            if len(batch) == 25:
+                self.dynamodb.batch_write_item(RequestItems={table_name: batch})
+                batch = []
+        if batch:
+            self.dynamodb.batch_write_item(RequestItems={table_name: batch})
+
+
+def measure(
+    environment, scenario: str, call, iterations: int, allocation_iterations: int
+) -> dict:
+    # call(iteration) invokes the handler once and returns the number of errors it ran into
+    context = LambdaContext()
+    meter = environment.meter
+    latencies = []
+    samples = []
+    errors = 0
+    meter.reset()
+    thread_ident = get_ident()
+    # Powertools prints the metrics and logs to stdout
+    with redirect_stdout(StringIO()):
+        for iteration in range(iterations):
+            api_calls, api_seconds = meter.api_calls, meter.api_seconds
+            api_cpu_seconds = meter.api_cpu_seconds(thread_ident)
+            started_at, cpu_started_at = perf_counter(), thread_time()
+            errors += call(iteration, context)
+            latencies.append((perf_counter() - started_at) * 1000)
+            cpu_seconds = thread_time() - cpu_started_at
+            samples.append(
+                {
+                    "wall_ms": latencies[-1],
+                    "compute_ms": (
+                        cpu_seconds
+                        - (meter.api_cpu_seconds(thread_ident) - api_cpu_seconds)
+                    )
+                    * 1000,
+                    "api_calls": meter.api_calls - api_calls,
+                    "api_ms": (meter.api_seconds - api_seconds) * 1000,
+                }
+            )
+        read_capacity_units = meter.read_capacity_units
+        write_capacity_units = meter.write_capacity_units
+        items_read = meter.items_read
+        peaks = []
+        for iteration in range(iterations, iterations + allocation_iterations):
+            tracemalloc.start()
+            try:
+                call(iteration, context)
+                peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            finally:
+                tracemalloc.stop()
+    return {
+        "scenario": scenario,
+        "calls": iterations,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "rcu_per_call": read_capacity_units / iterations,
+        "wcu_per_call": write_capacity_units / iterations,
+        "items_read_per_call": items_read / iterations,
+        "api_calls_per_call": sum(s["api_calls"] for s in samples) / iterations,
+        "compute_ms_p50": percentile([s["compute_ms"] for s in samples], 50),
+        "peak_kib_p50": percentile(peaks, 50) if peaks else None,
+        "peak_kib_p95": percentile(peaks, 95) if peaks else None,
+        "samples": samples,
+    }
+
+
+def scenarios(environment, table_size: int):
+    # (name, call, repeatable). Scenarios that are not repeatable run once, without the allocation pass
+    handlers = environment.handlers
+    from shared_runtime.messages import new_message_id, ulid_from_timestamp
+    from shared_runtime.queues import LocalQueue
+
+    def query_messages(iteration, context):
+        handlers["query_messages"](
+            {"identity": identity(iteration), "arguments": {"roomId": ROOM_ID}}, context
+        )
+        return 0
+
+    next_tokens = {}
+
+    def query_next_page(iteration, context):
+        tenant = iteration % TENANT_COUNT
+        if tenant not in next_tokens:
+            next_tokens[tenant] = handlers["query_messages"](
+                {"identity": identity(tenant), "arguments": {"roomId": ROOM_ID}},
+                context,
+            )["nextToken"]
+        page = handlers["query_messages"](
+            {
+                "identity": identity(tenant),
+                "arguments": {"roomId": ROOM_ID, "after": next_tokens[tenant]},
+            },
+            context,
+        )
+        return 0 if page["items"] or not next_tokens[tenant] else 1
+
+    def send_message(iteration, context):
+        handlers["send_message"](
+            {
+                "identity": identity(iteration),
+                "arguments": {"message": {"roomId": ROOM_ID, "text": "Hear me out"}},
+            },
+            context,
+        )
+        return 0
+
+    def send_messages(iteration, context):
+        batch = handlers["send_messages"](
+            {
+                "identity": identity(iteration),
+                "arguments": {
+                    "messages": [
+                        {"roomId": ROOM_ID, "text": "Point %d of my speech" % index}
+                        for index in range(SEND_MESSAGES_BATCH_SIZE)
+                    ]
+                },
+            },
+            context,
+        )
+        return 0 if len(batch["items"]) == SEND_MESSAGES_BATCH_SIZE else 1
+
+    def messages_since(iteration, context):
+        # A client back after a minute offline, which missed the messages of the send scenarios
+        delta = handlers["messages_since"](
+            {
+                "identity": identity(iteration),
+                "arguments": {
+                    "roomId": ROOM_ID,
+                    "cursor": ulid_from_timestamp(int(time() * 1000) - 60_000),
+                },
+            },
+            context,
+        )
+        return 0 if delta["items"] else 1
+
+    def search_messages(iteration, context):
+        page = handlers["search_messages"](
+            {
+                "identity": identity(iteration),
+                "arguments": {"roomId": ROOM_ID, "query": "benchmark chat line"},
+            },
+            context,
+        )
+        return 0 if page["items"] else 1
+
+    def build_search_index():
+        # What the search_indexer function maintains from the table stream, which moto does not deliver
+        from boto3.dynamodb.types import TypeSerializer
+        from shared_runtime.clients import get_table
+        from shared_runtime.batch_writes import batch_put
+        from shared_runtime.search import posting_changes
+
+        serializer = TypeSerializer()
+        table = get_table(MESSAGES_TABLE_NAME)
+        scan_kwargs = {}
+        while True:
+            response = table.scan(**scan_kwargs)
+            records = [
+                {
+                    "eventName": "INSERT",
+                    "dynamodb": {
+                        "Keys": {"PK": {"S": item["PK"]}, "SK": {"S": item["SK"]}},
+                        "NewImage": {
+                            k: serializer.serialize(v) for k, v in item.items()
+                        },
+                    },
+                }
+                for item in response["Items"]
+            ]
+            batch_put(table, posting_changes(records)[0])
+            if "LastEvaluatedKey" not in response:
+                return
+            scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def request_ai_response(iteration, context):
+        handlers["request_ai_response"](
+            {
+                "identity": identity(iteration),
+                "arguments": {"message": {"roomId": ROOM_ID, "text": "Defend Athens"}},
+            },
+            context,
+        )
+        return 0
+
+    def ai_response_worker(iteration, context):
+        queue = LocalQueue(handlers["ai_response_worker"], max_receive_count=1)
+        queue.send(
+            {
+                "messageId": new_message_id(),
+                "roomId": ROOM_ID,
+                "tenantId": tenant_id(iteration),
+                "username": "Orator %d" % (iteration % TENANT_COUNT),
+                "text": "Defend Athens",
+            }
+        )
+        queue.drain(context)
+        return len(queue.dead_letters)
+
+    def clear(iteration, context):
+        handlers["delete_all_messages"](
+            {
+                "identity": identity(iteration),
+                "arguments": {"roomId": ROOM_ID, "mode": "CLEAR"},
+            },
+            context,
+        )
+        return 0
+
+    def purge(iteration, context):
+        handlers["delete_all_messages"](
+            {
+                "identity": identity(iteration),
+                "arguments": {"roomId": ROOM_ID, "mode": "PURGE"},
+            },
+            context,
+        )
+        remaining = environment.dynamodb.query(
+            TableName=MESSAGES_TABLE_NAME,
+            # The settings, RECENT and idempotency items of the room are kept
+            KeyConditionExpression="PK = :pk AND begins_with(SK, :msg)",
+            ExpressionAttributeValues={
+                ":pk": {"S": "ROOM#" + ROOM_ID},
+                ":msg": {"S": "MSG#"},
+            },
+            Select="COUNT",
+        )["Count"]
+        return 1 if remaining else 0
+
+    def build_recent_messages():
+        # What the recent_messages function maintains from the table stream, which moto does not deliver
+        from shared_runtime.clients import get_table
+        from shared_runtime.recent_messages import update_recent
+
+        update_recent(get_table(MESSAGES_TABLE_NAME), ROOM_ID, [])
+
+    # (scenario, call, repeatable, setup run before it). Destructive scenarios go last
+    return [
+        ("query_messages", query_messages, True, None),
+        ("query_messages_next_page", query_next_page, True, None),
+        ("query_messages_recent", query_messages, True, build_recent_messages),
+        ("send_message", send_message, True, None),
+        ("send_messages", send_messages, True, None),
+        ("messages_since", messages_since, True, None),
+        ("search_messages", search_messages, True, build_search_index),
+        ("request_ai_response", request_ai_response, True, None),
+        ("ai_response_worker", ai_response_worker, True, None),
+        ("delete_all_messages_clear", clear, True, None),
+        ("delete_all_messages_purge", purge, False, None),
+    ]
+
+
+def run_benchmark(
+    table_sizes: list,
+    iterations: int = 50,
+    allocation_iterations: int = 5,
+    openai_latency_seconds: float = 0.0,
+    streaming: bool = False,
+    only: list = None,
+    progress=None,
+) -> list:
+    results = []
+    with warnings.catch_warnings():
+        # Powertools warns about invocations without metrics
+        warnings.simplefilter("ignore")
+        with BenchmarkEnvironment(openai_latency_seconds, streaming) as environment:
+            for table_size in table_sizes:
+                if progress:
+                    progress("Seeding {} messages".format(table_size))
+                environment.reset_tables(table_size)
+                for scenario, call, repeatable, setup in scenarios(
+                    environment, table_size
+                ):
+                    if only and scenario not in only:
+                        continue
+                    if setup:
+                        setup()
+                    if progress:
+                        progress(
+                            "Running {} ({} messages)".format(scenario, table_size)
+                        )
+                    result = measure(
+                        environment,
+                        scenario,
+                        call,
+                        iterations if repeatable else 1,
+                        allocation_iterations if repeatable else 0,
+                    )
+                    results.append({"table_size": table_size, **result})
+    return results
+
+
+REPORT_COLUMNS = [
+    ("table_size", "messages", "{:d}"),
+    ("scenario", "scenario", "{}"),
+    ("calls", "calls", "{:d}"),
+    ("errors", "errors", "{:d}"),
+    ("p50_ms", "p50 ms", "{:.1f}"),
+    ("p95_ms", "p95 ms", "{:.1f}"),
+    ("p99_ms", "p99 ms", "{:.1f}"),
+    ("rcu_per_call", "RCU/call", "{:.1f}"),
+    ("wcu_per_call", "WCU/call", "{:.1f}"),
+    ("items_read_per_call", "items read/call", "{:.0f}"),
+    ("api_calls_per_call", "AWS calls/call", "{:.1f}"),
+    ("compute_ms_p50", "compute ms p50", "{:.1f}"),
+    ("peak_kib_p50", "peak KiB p50", "{:.0f}"),
+    ("peak_kib_p95", "peak KiB p95", "{:.0f}"),
+]
+
+
+def format_report(results: list) -> str:
+    rows = [[title for _, title, _ in REPORT_COLUMNS]]
+    for result in results:
+        rows.append(
+            [
+                "-" if result[key] is None else fmt.format(result[key])
+                for key, _, fmt in REPORT_COLUMNS
+            ]
+        )
+    widths = [
+        max(len(row[column]) for row in rows) for column in range(len(REPORT_COLUMNS))
+    ]
+    return "\n".join(
+        "  ".join(
+            cell.rjust(width) if column != 1 else cell.ljust(width)
+            for column, (cell, width) in enumerate(zip(row, widths))
+        )
+        for row in rows
+    )
@@ -0,0 +1,151 @@
+import sys
+import json
+import math
+from argparse import ArgumentParser
+
+from harness import run_benchmark, percentile
+
+# Suggests the cheapest memory size of each function that meets a p95 latency target, scaling the CPU time of the
+# benchmark with the CPU share of each size. Usage, from the backend folder:
+#   python tests/benchmark/memory_sweep.py --target-p95-ms 300 --architecture arm64
+
+SCENARIO_FUNCTIONS = {
+    "query_messages": "QueryMessages",
+    "query_messages_next_page": "QueryMessages",
+    "query_messages_recent": "QueryMessages",
+    "send_message": "SendMessage",
+    "send_messages": "SendMessages",
+    "messages_since": "MessagesSince",
+    "search_messages": "SearchMessages",
+    "request_ai_response": "RequestAIResponse",
+    "ai_response_worker": "AiResponseWorker",
+    "delete_all_messages_clear": "DeleteAllMessages",
+    "delete_all_messages_purge": "DeleteAllMessages",
+}
+MEMORY_SIZES = [128, 256, 512, 768, 1024, 1536, 1769, 2048, 3008]
+FULL_VCPU_MB = 1769
+# us-east-1, per GB-second and per request
+PRICE_PER_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+PRICE_PER_REQUEST = 0.0000002
+
+
+def modeled_duration_ms(
+    sample: dict, memory_size: int, aws_call_ms: float, cpu_slowdown: float
+) -> float:
+    compute_ms = (
+        sample["compute_ms"] * cpu_slowdown * max(1, FULL_VCPU_MB / memory_size)
+    )
+    waiting_ms = max(0, sample["wall_ms"] - sample["compute_ms"] - sample["api_ms"])
+    return compute_ms + sample["api_calls"] * aws_call_ms + waiting_ms
+
+
+def cost_per_million(duration_ms: float, memory_size: int, architecture: str) -> float:
+    # Lambda bills the duration rounded up to the millisecond
+    gb_seconds = memory_size / 1024 * math.ceil(duration_ms) / 1000
+    return (gb_seconds * PRICE_PER_GB_SECOND[architecture] + PRICE_PER_REQUEST) * 10**6
+
+
+def sweep(
+    samples: list,
+    architecture: str,
+    aws_call_ms: float,
+    cpu_slowdown: float,
+    memory_sizes: list = MEMORY_SIZES,
+) -> list:
+    rows = []
+    for memory_size in memory_sizes:
+        durations = [
+            modeled_duration_ms(sample, memory_size, aws_call_ms, cpu_slowdown)
+            for sample in samples
+        ]
+        rows.append(
+            {
+                "memory_size": memory_size,
+                "p95_ms": percentile(durations, 95),
+                "cost_per_million": sum(
+                    cost_per_million(duration, memory_size, architecture)
+                    for duration in durations
+                )
+                / len(durations),
+            }
+        )
+    return rows
+
+
+def suggest(rows: list, target_p95_ms: float) -> dict:
+    # The cheapest size that meets the target, or the fastest one flagged when none does
+    meeting = [row for row in rows if row["p95_ms"] <= target_p95_ms]
+    if meeting:
+        return {**min(meeting, key=lambda row: row["cost_per_million"]), "meets": True}
+    return {**min(rows, key=lambda row: row["p95_ms"]), "meets": False}
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Offline memory size sweep of the functions")
+    parser.add_argument("--target-p95-ms", type=float, required=True)
+    parser.add_argument(
+        "--architecture", choices=sorted(PRICE_PER_GB_SECOND), default="arm64"
+    )
+    parser.add_argument("--aws-call-ms", type=float, default=8.0)
+    parser.add_argument("--cpu-slowdown", type=float, default=1.0)
+    parser.add_argument(
+        "--size", type=int, default=1000, help="Table size, in messages"
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--openai-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--only",
+        default=",".join(
+            scenario
+            for scenario in SCENARIO_FUNCTIONS
+            if scenario != "delete_all_messages_purge"
+        ),
+        help="Comma separated scenarios to run",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        [args.size],
+        iterations=args.iterations,
+        allocation_iterations=0,
+        openai_latency_seconds=args.openai_latency_ms / 1000,
+        only=args.only.split(","),
+        progress=lambda message: print(message, file=sys.stderr),
+    )
+    samples = {}
+    for result in results:
+        samples.setdefault(SCENARIO_FUNCTIONS[result["scenario"]], []).extend(
+            result["samples"]
+        )
+
+    functions = {}
+    for function_id, function_samples in samples.items():
+        rows = sweep(
+            function_samples, args.architecture, args.aws_call_ms, args.cpu_slowdown
+        )
+        suggestion = suggest(rows, args.target_p95_ms)
+        print(function_id)
+        for row in rows:
+            print(
+                "  {:>5d} MB  p95 {:>8.1f} ms  ${:>8.2f} per 1M{}".format(
+                    row["memory_size"],
+                    row["p95_ms"],
+                    row["cost_per_million"],
+                    "  <-" if row["memory_size"] == suggestion["memory_size"] else "",
+                )
+            )
+        if not suggestion["meets"]:
+            print("  No size meets {:.0f} ms".format(args.target_p95_ms))
+        functions[function_id] = {"memory_size": suggestion["memory_size"]}
+
+    print("Suggested performance_profiles:")
+    print(
+        json.dumps(
+            {"defaults": {"architecture": args.architecture}, "functions": functions},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import sys
+import json
+from argparse import ArgumentParser
+
+from harness import run_benchmark, format_report
+
+# Usage, from the backend folder:
+#   python tests/benchmark/run.py --sizes 1000,10000,100000 --iterations 50 --openai-latency-ms 300
+# moto queries an index by going through the whole table, so compare the items read per call across sizes
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Offline benchmark of the chat functions")
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="Comma separated table sizes, in messages",
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--allocation-iterations",
+        type=int,
+        default=5,
+        help="Extra calls per scenario traced with tracemalloc",
+    )
+    parser.add_argument("--openai-latency-ms", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="Stream the AI responses")
+    parser.add_argument("--only", help="Comma separated scenarios to run")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        [int(size) for size in args.sizes.split(",")],
+        iterations=args.iterations,
+        allocation_iterations=args.allocation_iterations,
+        openai_latency_seconds=args.openai_latency_ms / 1000,
+        streaming=args.stream,
+        only=args.only.split(",") if args.only else None,
+        progress=lambda message: print(message, file=sys.stderr),
+    )
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                [
+                    {key: value for key, value in result.items() if key != "samples"}
+                    for result in results
+                ],
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# Make the shared runtime layer importable the same way the Lambda runtime does (the layer's "python" folder is on sys.path)
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+        "aws_lambda_shared",
+        "shared_runtime",
+        "python",
+    ),
+)
+
+
+class StubMetrics:
+    # Stand-in for the Powertools Metrics: the values added to each metric, and their sums
+    def __init__(self):
+        self.values = {}
+
+    def add_metric(self, name, unit, value):
+        self.values.setdefault(name, []).append(value)
+
+    @property
+    def counts(self) -> dict:
+        return {name: sum(values) for name, values in self.values.items()}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubContext:
+    # Stand-in for the Lambda context
+    memory_limit_in_mb = "512"
+
+    def __init__(self, remaining_ms: int = 30000):
+        self._remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self._remaining_ms
+
+
+@pytest.fixture
+def stub_metrics():
+    return StubMetrics()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def lambda_context():
+    # StubContext(remaining_ms)
+    return StubContext
+
+
+@pytest.fixture
+def table():
+    # The messages table, with the indexes of the deployed one
+    with mock_aws():
+        yield boto3.resource("dynamodb", region_name="us-east-1").create_table(
+            TableName="Messages",
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": attribute, "AttributeType": "S"}
+                for attribute in ("PK", "SK", "VisibleTo", "W")
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": index_name,
+                    "KeySchema": [
+                        {"AttributeName": "VisibleTo", "KeyType": "HASH"},
+                        {"AttributeName": sort_key, "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+                for index_name, sort_key in (
+                    ("VisibilityIndex", "SK"),
+                    ("SyncIndex", "W"),
+                )
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+@pytest.fixture
+def profiles_table(table):
+    # In the same mocked account as the messages table
+    return boto3.resource("dynamodb", region_name="us-east-1").create_table(
+        TableName="Profiles",
+        KeySchema=[{"AttributeName": "TenantId", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "TenantId", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
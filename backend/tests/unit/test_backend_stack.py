@@ -1,15 +1,331 @@
-import aws_cdk as core
-import aws_cdk.assertions as assertions
+import os
+import re
+import sys
+import json
 
-from backend.backend_stack import BackendStack
+import pytest
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in backend/backend_stack.py
-def test_sqs_queue_created():
-    app = core.App()
-    stack = BackendStack(app, "backend")
-    template = assertions.Template.from_stack(stack)
+core = pytest.importorskip("aws_cdk")
+assertions = pytest.importorskip("aws_cdk.assertions")
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+BACKEND_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+)
+sys.path.insert(0, BACKEND_DIR)
+
+# The third party layers are built locally and not committed (see .gitignore)
+LAYER_ZIPS = [
+    "aws_lambda_shared/layers/python_jose/python_jose.zip",
+    "aws_lambda_shared/layers/openai/openai.zip",
+]
+pytestmark = pytest.mark.skipif(
+    not all(os.path.exists(os.path.join(BACKEND_DIR, path)) for path in LAYER_ZIPS),
+    reason="The Lambda layers have not been built",
+)
+
+
+@pytest.fixture(scope="module")
+def templates():
+    from src.user_pool.component import UserPool
+    from src.websocket_chat.component import WebsocketChat
+
+    cwd = os.getcwd()
+    # Asset paths are relative to the backend folder, as when running 'cdk synth'
+    os.chdir(BACKEND_DIR)
+    try:
+        with open("src/config.json.example", "r") as f:
+            props = json.load(f)
+        app = core.App()
+        env = core.Environment(
+            account=props["aws_dev_account_id"], region=props["aws_deploy_region"]
+        )
+        user_pool = UserPool(
+            app,
+            "UserPool",
+            env=env,
+            props=props["user_pool_stack"],
+            stage_name="prod",
+            user_pool_id_output_key="UserPoolId",
+            user_pool_client_id_output_key="UserPoolClientId",
+        )
+        websocket_chat = WebsocketChat(
+            app,
+            "WebsocketChat",
+            env=env,
+            props=props["websocket_chat_stack"],
+            stage_name="prod",
+            user_pool_arn=user_pool.user_pool_arn,
+            user_pool_client_id=user_pool.user_pool_client_id,
+            user_profiles_table_name=user_pool.user_profiles_table_name,
+            user_profiles_table_arn=user_pool.user_profiles_table_arn,
+            graphql_url_output_key="GraphQLUrl",
+            graphql_endpoint_name_output_key="GraphQLEndpointName",
+        )
+        yield {
+            "user_pool": assertions.Template.from_stack(user_pool),
+            "websocket_chat": assertions.Template.from_stack(websocket_chat),
+        }
+    finally:
+        os.chdir(cwd)
+
+
+def test_messages_table_has_the_visibility_and_sync_indexes(templates):
+    templates["websocket_chat"].has_resource_properties(
+        "AWS::DynamoDB::Table",
+        {
+            "GlobalSecondaryIndexes": assertions.Match.array_with(
+                [
+                    assertions.Match.object_like({"IndexName": "VisibilityIndex"}),
+                    assertions.Match.object_like(
+                        {
+                            "IndexName": "SyncIndex",
+                            "KeySchema": [
+                                {"AttributeName": "VisibleTo", "KeyType": "HASH"},
+                                {"AttributeName": "W", "KeyType": "RANGE"},
+                            ],
+                        }
+                    ),
+                ]
+            )
+        },
+    )
+
+
+def test_ai_requests_are_queued_with_a_dead_letter_queue(templates):
+    template = templates["websocket_chat"]
+    # And the queue of the rooms left to purge, with its own dead-letter queue
+    template.resource_count_is("AWS::SQS::Queue", 4)
+    template.has_resource_properties(
+        "AWS::SQS::Queue",
+        {"RedrivePolicy": assertions.Match.object_like({"maxReceiveCount": 3})},
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 1,
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+            "ScalingConfig": {"MaximumConcurrency": 10},
+        },
+    )
+
+
+def test_user_pool_syncs_profiles(templates):
+    template = templates["user_pool"]
+    template.resource_count_is("AWS::DynamoDB::Table", 1)
+    template.has_resource_properties(
+        "AWS::Cognito::UserPool",
+        {
+            "LambdaConfig": assertions.Match.object_like(
+                {
+                    "PostConfirmation": assertions.Match.any_value(),
+                    "PostAuthentication": assertions.Match.any_value(),
+                }
+            )
+        },
+    )
+
+
+def test_performance_profiles_are_applied(templates):
+    # config.json.example: arm64 by default, per function sizes, and provisioned concurrency in prod
+    template = templates["websocket_chat"]
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "FunctionName": "QueryMessages",
+            "MemorySize": 512,
+            "Architectures": ["arm64"],
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "FunctionName": "AiResponseWorker",
+            "MemorySize": 256,
+            "ReservedConcurrentExecutions": 20,
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::Alias",
+        {
+            "Name": "live",
+            "ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": 2},
+        },
+    )
+    template.resource_count_is("AWS::Lambda::Alias", 1)
+
+
+def test_completion_cache_is_enabled_by_the_config(templates):
+    # config.json.example: the completion cache is opt-in
+    templates["websocket_chat"].has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "FunctionName": "AiResponseWorker",
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {"COMPLETION_CACHE_TTL_SECONDS": "3600"}
+                )
+            },
+        },
+    )
+
+
+def test_completions_fail_over_to_the_configured_backup_model(templates):
+    templates["websocket_chat"].has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "FunctionName": "AiResponseWorker",
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {
+                        "COMPLETION_HEDGE_PERCENTILE": "95",
+                        "COMPLETION_BACKUP_MODEL": "gpt-3.5-turbo-16k",
+                    }
+                )
+            },
+        },
+    )
+
+
+def test_messages_expire_after_the_configured_retention(templates):
+    # config.json.example: 90 days, for the functions and the JS resolvers that write messages
+    template = templates["websocket_chat"]
+    for function_name in ("SendMessage", "AiResponseWorker"):
+        template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {
+                "FunctionName": function_name,
+                "Environment": {
+                    "Variables": assertions.Match.object_like(
+                        {"DEFAULT_RETENTION_DAYS": "90"}
+                    )
+                },
+            },
+        )
+    template.has_resource_properties(
+        "AWS::AppSync::FunctionConfiguration",
+        {
+            "Name": "GetRoomRetention",
+            "Code": assertions.Match.string_like_regexp("Number\\('90'\\)"),
+        },
+    )
+
+
+def test_messaging_fields_resolve_straight_to_dynamodb(templates):
+    # config.json.example: JS pipeline resolvers for Query.messages and Mutation.sendMessage
+    template = templates["websocket_chat"]
+    for field_name in ("messages", "sendMessage"):
+        template.has_resource_properties(
+            "AWS::AppSync::Resolver",
+            {
+                "FieldName": field_name,
+                "Kind": "PIPELINE",
+                "Runtime": {"Name": "APPSYNC_JS", "RuntimeVersion": "1.0.0"},
+            },
+        )
+    template.resource_count_is("AWS::AppSync::FunctionConfiguration", 13)
+    # Plus the data sources of the Lambda resolvers of Mutation.sendMessages, Query.messagesSince and
+    # Query.searchMessages
+    template.resource_count_is("AWS::AppSync::DataSource", 8)
+
+
+def test_resolve_profile_prefers_the_most_specific_setting():
+    from aws_lambda_shared.aws_lambda_construct import resolve_profile
+
+    profiles = {
+        "defaults": {"memory_size": 256, "architecture": "arm64"},
+        "functions": {"Fn": {"memory_size": 512}},
+        "stages": {"prod": {"functions": {"Fn": {"provisioned_concurrency": 2}}}},
+    }
+    assert resolve_profile(profiles, "prod", "Fn") == {
+        "memory_size": 512,
+        "architecture": "arm64",
+        "provisioned_concurrency": 2,
+    }
+    assert resolve_profile(profiles, "dev", "Other") == profiles["defaults"]
+    assert resolve_profile(None, "dev", "Fn") == {}
+
+
+def test_subscriptions_are_filtered_on_the_server(templates):
+    for field_name in (
+        "onSendMessage",
+        "onRequestAiResponse",
+        "onDeleteAllMessages",
+        "onAiResponseChunk",
+    ):
+        templates["websocket_chat"].has_resource_properties(
+            "AWS::AppSync::Resolver",
+            {
+                "TypeName": "Subscription",
+                "FieldName": field_name,
+                "Runtime": {"Name": "APPSYNC_JS", "RuntimeVersion": "1.0.0"},
+            },
+        )
+
+
+def test_subscription_arguments_are_filters_of_the_events(templates):
+    # Every argument of the subscriptions in the schema is turned into a filter by subscription_filter.js
+    (schema,) = (
+        templates["websocket_chat"]
+        .find_resources("AWS::AppSync::GraphQLSchema")
+        .values()
+    )
+    arguments = {
+        field_name: set(re.findall(r"(\w+):", field_arguments))
+        for field_name, field_arguments in re.findall(
+            r"^\s+(on\w+)\(([^)]*)\)", schema["Properties"]["Definition"], re.M
+        )
+    }
+    with open(
+        os.path.join(
+            BACKEND_DIR, "src/websocket_chat/appsync/runtime/subscription_filter.js"
+        )
+    ) as file:
+        filters = set(re.findall(r"^\s+(\w+): \['", file.read(), re.M))
+    assert set().union(*arguments.values()) <= filters
+    assert "aiGenerated" in arguments["onSendMessage"]
+    assert "aiGenerated" in arguments["onRequestAiResponse"]
+
+
+def test_idempotency_items_expire(templates):
+    templates["websocket_chat"].has_resource_properties(
+        "AWS::DynamoDB::Table",
+        {
+            "TimeToLiveSpecification": {
+                "AttributeName": "ExpiresAt",
+                "Enabled": True,
+            }
+        },
+    )
+
+
+def test_recent_messages_follow_the_table_stream(templates):
+    template = templates["websocket_chat"]
+    template.has_resource_properties(
+        "AWS::DynamoDB::Table",
+        {"StreamSpecification": {"StreamViewType": "NEW_AND_OLD_IMAGES"}},
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BisectBatchOnFunctionError": True,
+            "FilterCriteria": {"Filters": assertions.Match.any_value()},
+        },
+    )
+    # config.json.example: the first pages are also cached by AppSync
+    template.resource_count_is("AWS::AppSync::ApiCache", 1)
+    template.has_resource_properties(
+        "AWS::AppSync::Resolver",
+        {
+            "FieldName": "messages",
+            "CachingConfig": assertions.Match.object_like({"Ttl": 5}),
+        },
+    )
+
+
+def test_search_index_follows_the_table_stream(templates):
+    template = templates["websocket_chat"]
+    # The queues of the AI requests and of the purges, RecentMessages and SearchIndexer
+    template.resource_count_is("AWS::Lambda::EventSourceMapping", 4)
+    template.has_resource_properties(
+        "AWS::AppSync::Resolver", {"FieldName": "searchMessages"}
+    )
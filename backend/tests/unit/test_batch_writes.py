@@ -0,0 +1,59 @@
+import pytest
+
+from shared_runtime.batch_writes import batch_put, UnprocessedItemsError
+
+
+class StubClient:
+    # Leaves the last item of every call unprocessed, 'failures' times per item
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.attempts = {}
+        self.written = []
+        self.calls = []
+
+    def batch_write_item(self, RequestItems):
+        ((table_name, requests),) = RequestItems.items()
+        self.calls.append(len(requests))
+        *processed, last = requests
+        key = last["PutRequest"]["Item"]["SK"]
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        if self.attempts[key] <= self.failures:
+            self.written.extend(request["PutRequest"]["Item"] for request in processed)
+            return {"UnprocessedItems": {table_name: [last]}}
+        self.written.extend(request["PutRequest"]["Item"] for request in requests)
+        return {"UnprocessedItems": {}}
+
+
+class StubTable:
+    name = "Messages"
+
+    def __init__(self, client):
+        self.meta = type("Meta", (), {"client": client})
+
+
+def items(count: int) -> list:
+    return [{"PK": "ROOM#global", "SK": "MSG#%03d" % i} for i in range(count)]
+
+
+def test_items_are_written_in_chunks_and_unprocessed_ones_retried():
+    client = StubClient(failures=1)
+    assert batch_put(StubTable(client), items(60), sleep=lambda _: None) == 60
+    assert sorted(item["SK"] for item in client.written) == [
+        item["SK"] for item in items(60)
+    ]
+    # 25 + the retry of its last item, 25 + 1, 10 + 1
+    assert client.calls == [25, 1, 25, 1, 10, 1]
+
+
+def test_items_left_unprocessed_raise():
+    client = StubClient(failures=100)
+    with pytest.raises(UnprocessedItemsError):
+        batch_put(StubTable(client), items(3), max_attempts=3, sleep=lambda _: None)
+
+
+def test_no_backoff_after_the_last_attempt():
+    client = StubClient(failures=100)
+    delays = []
+    with pytest.raises(UnprocessedItemsError):
+        batch_put(StubTable(client), items(3), max_attempts=3, sleep=delays.append)
+    assert len(client.calls) == 3 and len(delays) == 2
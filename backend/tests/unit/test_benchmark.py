@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+)
+
+
+@pytest.fixture(scope="module")
+def results(tmp_path_factory):
+    for module in ["moto", "boto3", "openai", "aws_lambda_powertools", "aws_xray_sdk"]:
+        pytest.importorskip(module)
+    output = tmp_path_factory.mktemp("benchmark") / "results.json"
+    # In its own interpreter: the harness starts moto and sets the functions' environment variables
+    subprocess.run(
+        [
+            sys.executable,
+            "tests/benchmark/run.py",
+            "--sizes",
+            "1000",
+            "--iterations",
+            "3",
+            "--allocation-iterations",
+            "1",
+            "--json",
+            str(output),
+        ],
+        cwd=BACKEND_DIR,
+        check=True,
+        capture_output=True,
+    )
+    with open(output) as f:
+        return {result["scenario"]: result for result in json.load(f)}
+
+
+def test_every_scenario_runs_without_errors(results):
+    assert len(results) == 11
+    assert all(result["errors"] == 0 for result in results.values())
+
+
+def test_reads_do_not_scan_the_room(results):
+    # One page of each of the two audiences, whatever the size of the table
+    assert results["query_messages"]["items_read_per_call"] <= 2 * 50 + 1
+    assert results["query_messages_next_page"]["items_read_per_call"] <= 2 * (
+        2 * 50 + 1
+    )
+    assert results["delete_all_messages_clear"]["items_read_per_call"] == 0
+
+
+def test_first_page_is_one_read_of_the_recent_item(results):
+    assert results["query_messages_recent"]["items_read_per_call"] == 1
+    assert results["query_messages_recent"]["api_calls_per_call"] == 1
+
+
+def test_deltas_do_not_depend_on_the_size_of_the_room(results):
+    # One page of each audience from the SyncIndex, the META item and the username of the caller
+    assert results["messages_since"]["items_read_per_call"] <= 2 * (50 + 1) + 2
+
+
+def test_search_reads_the_posting_lists_not_the_room(results):
+    # 2 audiences x 3 terms lists of at most 200 postings, the META item, one page of messages and the usernames
+    assert results["search_messages"]["items_read_per_call"] <= 6 * 200 + 1 + 50 + 10
+
+
+def test_batches_are_written_25_messages_per_call(results):
+    # Rate limit (at most 2 writes), retention read and 4 BatchWriteItem calls for the 100 messages. The username
+    # is cached after the first call
+    assert results["send_messages"]["api_calls_per_call"] <= 2 + 1 + 4 + 1
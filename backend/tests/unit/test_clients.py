@@ -0,0 +1,68 @@
+from time import perf_counter, sleep
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+import pytest
+
+from shared_runtime import clients
+from shared_runtime.deadlines import Deadline, DeadlineExceeded, deadline
+
+
+def test_timeouts_fit_in_what_is_left_of_the_invocation(lambda_context):
+    invocation = Deadline()
+    assert invocation.timeouts(1, 10) == (1, 10)  # Outside of an invocation
+    invocation.start(lambda_context(3000))
+    connect_timeout, read_timeout = invocation.timeouts(1, 10)
+    assert connect_timeout == 1 and 2.5 < read_timeout <= 2.75
+    invocation.start(lambda_context(100))
+    with pytest.raises(DeadlineExceeded):
+        invocation.timeouts(1, 10)
+
+
+def test_clients_pool_keep_alive_connections_and_retry_adaptively():
+    config = clients.client_config()
+    assert config.tcp_keepalive
+    assert config.max_pool_connections == clients.max_pool_connections
+    assert config.retries == {"mode": "adaptive", "max_attempts": 3}
+    assert config.connect_timeout == 1 and config.read_timeout == 10
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        sleep(3)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_every_attempt_reads_within_what_is_left_of_the_invocation(lambda_context):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    dynamodb = clients._configure(
+        boto3.client(
+            "dynamodb",
+            region_name="us-east-1",
+            endpoint_url="http://127.0.0.1:%d" % server.server_port,
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+            config=clients.client_config(),
+        )
+    )
+    deadline.start(lambda_context(1000))
+    started_at = perf_counter()
+    try:
+        # The first attempt is cut at the deadline, and is not retried
+        with pytest.raises(DeadlineExceeded):
+            dynamodb.list_tables()
+        assert perf_counter() - started_at < 1.5
+    finally:
+        deadline.start(None)
+        server.shutdown()
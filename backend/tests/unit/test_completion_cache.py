@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "src/websocket_chat/aws_lambda/runtime/ai_response_worker",
+    ),
+)
+
+from completion_cache import CompletionCache, completion_key  # noqa: E402
+
+PARAMS = {"model": "gpt-3.5-turbo", "temperature": 0.5}
+
+
+def chat_inputs(*history: str, prompt: str = "Support the fleet") -> list:
+    return [
+        {"role": "system", "content": "You are Pericles"},
+        *({"role": "user", "content": content} for content in history),
+        {"role": "user", "content": "User prompt: " + prompt},
+    ]
+
+
+def test_keys_ignore_case_whitespace_and_old_history():
+    key = completion_key(chat_inputs("a", "b", "c"), 2, PARAMS)
+    assert key == completion_key(
+        chat_inputs("z", "B ", "c", prompt="support  the FLEET"), 2, PARAMS
+    )
+    assert key != completion_key(chat_inputs("a", "b", "d"), 2, PARAMS)
+    assert key != completion_key(chat_inputs("a", "b", "c"), 2, {**PARAMS, "n": 2})
+    assert completion_key(chat_inputs("a"), 0, PARAMS) == completion_key(
+        chat_inputs("b"), 0, PARAMS
+    )
+
+
+def test_hits_come_from_the_container_then_from_the_table(table, stub_metrics):
+    cache = CompletionCache(table, stub_metrics, ttl_seconds=60)
+    key = cache.key(chat_inputs("a"), PARAMS)
+    assert cache.get(key) is None
+    cache.put(key, "Athens must rule the sea.")
+    assert cache.get(key) == "Athens must rule the sea."
+    # Another container
+    other = CompletionCache(table, stub_metrics, ttl_seconds=60)
+    assert other.get(key) == "Athens must rule the sea."
+    assert stub_metrics.counts == {
+        "CompletionCacheMisses": 1,
+        "CompletionCacheHits": 2,
+        "CompletionCacheTableHits": 1,
+    }
+
+
+def test_expired_table_entries_are_misses(table, stub_metrics):
+    now = [1000.0]
+    cache = CompletionCache(table, stub_metrics, ttl_seconds=60)
+    later = CompletionCache(table, stub_metrics, ttl_seconds=60, clock=lambda: now[0])
+    key = cache.key(chat_inputs("a"), PARAMS)
+    later.put(key, "Athens must rule the sea.")
+    cache.put(cache.key(chat_inputs("b"), PARAMS), "")  # Empty answers aren't kept
+    now[0] += 61
+    assert (
+        CompletionCache(table, stub_metrics, 60, clock=lambda: now[0]).get(key) is None
+    )
+    assert table.scan()["Count"] == 1
@@ -0,0 +1,147 @@
+import os
+import sys
+from time import perf_counter
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "tests/benchmark"))
+sys.path.insert(
+    0,
+    os.path.join(
+        BACKEND_DIR, "src/websocket_chat/aws_lambda/runtime/ai_response_worker"
+    ),
+)
+
+from fake_endpoints import FakeEndpoints  # noqa: E402
+from completion_router import (  # noqa: E402
+    AllCircuitsOpen,
+    CircuitBreaker,
+    CompletionRouter,
+    LatencyWindow,
+    Upstream,
+)
+
+openai = pytest.importorskip("openai")
+
+
+@pytest.fixture
+def endpoints():
+    with FakeEndpoints(completion_text="Primary") as primary, FakeEndpoints(
+        completion_text="Backup"
+    ) as backup:
+        yield primary, backup
+
+
+def upstreams(primary: FakeEndpoints, backup: FakeEndpoints) -> list:
+    return [
+        Upstream("primary", "gpt-3.5-turbo", primary.url + "/v1"),
+        Upstream("backup", "gpt-3.5-turbo-16k", backup.url + "/v1"),
+    ]
+
+
+def complete(router: CompletionRouter) -> str:
+    response = router.complete(
+        lambda upstream: openai.ChatCompletion.create(
+            model=upstream.model,
+            api_base=upstream.api_base,
+            api_key="sk-test",
+            messages=[{"role": "user", "content": "Support the fleet"}],
+            request_timeout=5,
+        )
+    )
+    return response["choices"][0]["message"]["content"]
+
+
+def failures() -> tuple:
+    from openai.error import APIError
+
+    return (APIError,)
+
+
+def test_hedges_at_a_percentile_of_the_recent_latencies():
+    window = LatencyWindow(size=100)
+    for milliseconds in range(1, 121):
+        window.add(milliseconds / 1000)
+    assert window.percentile(95, min_samples=20) == 0.115
+    # Too few samples
+    assert LatencyWindow().percentile(95, min_samples=20) is None
+
+
+def test_a_slow_upstream_loses_to_the_hedged_request(endpoints, stub_metrics):
+    primary, backup = endpoints
+    primary.latency_seconds = 2
+    router = CompletionRouter(
+        upstreams(primary, backup),
+        stub_metrics,
+        failures(),
+        default_hedge_delay_seconds=0.05,
+    )
+    started_at = perf_counter()
+    assert complete(router) == "Backup"
+    assert perf_counter() - started_at < 1
+    assert stub_metrics.counts == {"AiHedgedRequests": 1, "AiHedgeWins": 1}
+    # A fast upstream is not hedged
+    primary.latency_seconds = 0
+    assert complete(router) == "Primary"
+    assert stub_metrics.counts["AiHedgedRequests"] == 1
+
+
+def test_failing_upstreams_are_failed_over_and_skipped_while_their_circuit_is_open(
+    endpoints, clock, stub_metrics
+):
+    primary, backup = endpoints
+    primary.error_status = 500
+    router = CompletionRouter(
+        upstreams(primary, backup),
+        stub_metrics,
+        failures(),
+        hedge_percentile=0,
+        failure_threshold=2,
+        cooldown_seconds=30,
+        clock=clock,
+    )
+    assert [complete(router) for _ in range(3)] == ["Backup"] * 3
+    # The third completion went straight to the backup
+    assert primary.request_counts["completions"] == 2
+    assert stub_metrics.counts == {"AiFailovers": 2}
+    # After the cooldown the primary is tried again, and closes its circuit
+    primary.error_status = None
+    clock.now = 30
+    assert complete(router) == "Primary"
+    # Without any healthy upstream the completion fails right away
+    primary.error_status = backup.error_status = 500
+    for _ in range(2):
+        with pytest.raises(openai.error.APIError):
+            complete(router)
+    with pytest.raises(AllCircuitsOpen):
+        complete(router)
+
+
+def test_a_single_request_probes_an_upstream_after_the_cooldown(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.record_failure()
+    assert not breaker.allows()
+    clock.now = 30
+    assert breaker.allows()
+    # Until the probe reports
+    assert not breaker.allows()
+    assert breaker.record_failure()
+    clock.now = 59
+    assert not breaker.allows()
+    clock.now = 60
+    assert breaker.allows()
+    breaker.record_success()
+    assert breaker.allows() and breaker.allows()
+    # A probe that never reports is replaced after another cooldown
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now = 90
+    assert breaker.allows()
+    clock.now = 119
+    assert not breaker.allows()
+    clock.now = 120
+    assert breaker.allows()
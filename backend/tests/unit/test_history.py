@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "src/websocket_chat/aws_lambda/runtime/ai_response_worker",
+    ),
+)
+
+from history import (  # noqa: E402
+    build_chat_history,
+    estimate_tokens,
+    truncate_to_tokens,
+    query_recent_ai_messages,
+)
+from shared_runtime.messages import ulid_from_timestamp  # noqa: E402
+from shared_runtime.message_items import compact_message_item  # noqa: E402
+
+
+def test_history_is_oldest_first_with_roles_per_tenant():
+    items = [  # Newest first, as queried
+        {"text": "third", "tenantId": "me"},
+        {"text": "second", "tenantId": "other"},
+        {"text": "first", "tenantId": "me"},
+    ]
+    history = build_chat_history(items, "me", 1000, 100)
+    assert history == [
+        {"role": "assistant", "content": "first"},
+        {"role": "user", "content": "second"},
+        {"role": "assistant", "content": "third"},
+    ]
+
+
+def test_history_keeps_the_newest_turns_within_the_token_budget():
+    items = [{"text": "x" * 40, "tenantId": "other"} for _ in range(50)]
+    budget = 5 * estimate_tokens("x" * 40)
+    history = build_chat_history(items, "me", budget, 100)
+    assert len([turn for turn in history if turn["role"] == "user"]) == 5
+    assert history[0]["role"] == "system"  # Notes the omitted older turns
+
+
+def test_long_turns_are_truncated():
+    text = truncate_to_tokens("word " * 1000, 20)
+    assert estimate_tokens(text) <= 20
+    assert text.endswith("...")
+
+
+def test_expired_turns_are_left_out_of_the_history(table):
+    # Past their retention, but not deleted by the TTL yet
+    for number, expires_at in enumerate((1, 4_000_000_000)):
+        message_id = ulid_from_timestamp(1_700_000_000_000 + number, number)
+        table.put_item(
+            Item=compact_message_item(
+                "global", message_id, "t1", "Turn %d" % number, True, expires_at
+            )
+        )
+    items = query_recent_ai_messages(table, "global", 20)
+    assert [item["text"] for item in items] == ["Turn 1"]
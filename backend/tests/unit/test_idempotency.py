@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+
+import pytest
+
+from shared_runtime.idempotency import (
+    idempotency_key_or_none,
+    idempotency_item_key,
+    claim,
+    claim_write,
+    store_response,
+    release,
+)
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "tests/benchmark",
+    ),
+)
+
+
+def test_keys_are_validated():
+    assert idempotency_key_or_none(None) is None
+    assert idempotency_key_or_none("a-b_C9") == "a-b_C9"
+    for key in ("", "a b", "x" * 65):
+        with pytest.raises(ValueError):
+            idempotency_key_or_none(key)
+
+
+def test_a_retry_gets_the_first_response(table):
+    item_key = idempotency_item_key("global", "sendMessage", "t1", "k1")
+    assert claim(table, item_key, {"id": "1"}) == ({"id": "1"}, True)
+    assert claim(table, item_key, {"id": "2"}) == ({"id": "1"}, False)
+    # Same key from another tenant or for another mutation
+    for other_key in (
+        idempotency_item_key("global", "sendMessage", "t2", "k1"),
+        idempotency_item_key("global", "requestAiResponse", "t1", "k1"),
+    ):
+        assert claim(table, other_key, {"id": "3"}) == ({"id": "3"}, True)
+
+
+def test_stored_and_released_responses(table):
+    item_key = idempotency_item_key("global", "requestAiResponse", "t1", "k1")
+    claim(table, item_key, {"id": "1", "status": "PENDING"})
+    store_response(table, item_key, {"id": "1", "status": "COMPLETE"})
+    assert claim(table, item_key, {"id": "2"})[0]["status"] == "COMPLETE"
+    release(table, item_key)
+    assert claim(table, item_key, {"id": "2"}) == ({"id": "2"}, True)
+    # Storing under an expired claim does not bring it back
+    other_key = idempotency_item_key("global", "requestAiResponse", "t1", "k2")
+    store_response(table, other_key, {"id": "3"})
+    assert "Item" not in table.get_item(Key=other_key)
+
+
+def test_a_retry_writes_with_the_first_written_id(table):
+    item_key = idempotency_item_key("global", "sendMessage", "t1", "k1")
+    assert claim_write(table, item_key, {"id": "1"}, "W1") == ({"id": "1"}, "W1", True)
+    assert claim_write(table, item_key, {"id": "2"}, "W2") == ({"id": "1"}, "W1", False)
+    # A claim stored before WrittenId
+    old_key = idempotency_item_key("global", "sendMessage", "t1", "k2")
+    claim(table, old_key, {"id": "3"})
+    assert claim_write(table, old_key, {"id": "4"}, "W4") == ({"id": "3"}, "W4", False)
+
+
+def test_a_retried_message_stays_at_its_place_in_the_sync_index(table, monkeypatch):
+    from harness import FUNCTIONS_DIR, LambdaContext, load_handler
+
+    for name, value in {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "USER_POOL_ARN": "arn:aws:cognito-idp:us-east-1:123456789012:userpool/pool",
+        "USER_PROFILES_TABLE_NAME": "Profiles",
+        "MESSAGES_TABLE_NAME": "Messages",
+    }.items():
+        monkeypatch.setenv(name, value)
+    function = load_handler(os.path.join(FUNCTIONS_DIR, "send_message"), "send_message")
+    monkeypatch.setattr(function.username_resolver, "resolve", lambda _: "Pericles")
+    event = {
+        "arguments": {"message": {"text": "Hold the walls", "idempotencyKey": "k1"}},
+        "identity": {"claims": {"sub": "t1"}},
+    }
+
+    def written_ids() -> list:
+        items = table.scan()["Items"]
+        return [item["W"] for item in items if item["SK"].startswith("MSG#")]
+
+    first = function.handler(event, LambdaContext())
+    first_written_ids = written_ids()
+    assert function.handler(event, LambdaContext()) == first
+    assert written_ids() == first_written_ids and len(first_written_ids) == 1
+
+
+def test_a_redelivered_ai_request_delivers_the_stored_answer(table, monkeypatch):
+    from harness import FUNCTIONS_DIR, LambdaContext, load_handler
+    from shared_runtime.messages import message_key
+    from shared_runtime.message_items import compact_message_item, sync_cursor
+
+    for name, value in {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "MESSAGES_TABLE_NAME": "Messages",
+        "AWS_REGION": "us-east-1",
+        "GRAPHQL_URL": "https://example.appsync-api.us-east-1.amazonaws.com/graphql",
+    }.items():
+        monkeypatch.setenv(name, value)
+    function = load_handler(
+        os.path.join(FUNCTIONS_DIR, "ai_response_worker"), "ai_response_worker"
+    )
+    published = []
+    monkeypatch.setattr(
+        function.appsync_client,
+        "execute",
+        lambda query, variables: published.append(variables["message"]),
+    )
+    request = {
+        "messageId": "01H0000000000000000000000A",
+        "roomId": "global",
+        "tenantId": "t1",
+        "username": "Pericles",
+        "text": "Defend the fleet",
+        "idempotencyKey": "k1",
+    }
+    request_key = idempotency_item_key("global", "requestAiResponse", "t1", "k1")
+    claim(table, request_key, {"id": request["messageId"], "status": "PENDING"})
+    # A delivery wrote the answer, then failed before storing and publishing it
+    table.put_item(
+        Item=compact_message_item(
+            "global",
+            request["messageId"],
+            "t1",
+            "Ships",
+            True,
+            written_id="01H0000000000000000000000B",
+        )
+    )
+    event = {
+        "Records": [
+            {
+                "messageId": "m1",
+                "receiptHandle": "r1",
+                "body": json.dumps(request),
+                "attributes": {"ApproximateReceiveCount": "2"},
+                "messageAttributes": {},
+                "md5OfBody": "",
+                "eventSource": "aws:sqs",
+                "eventSourceARN": "arn:aws:sqs:us-east-1:123456789012:queue",
+                "awsRegion": "us-east-1",
+            }
+        ]
+    }
+
+    assert function.handler(event, LambdaContext()) == {"batchItemFailures": []}
+    cursor = sync_cursor("01H0000000000000000000000B")
+    assert [
+        (message["text"], message["status"], message["cursor"]) for message in published
+    ] == [("Ships", "COMPLETE", cursor)]
+    stored = table.get_item(Key=request_key)["Item"]["Response"]
+    assert stored["text"] == "Ships" and stored["cursor"] == cursor
+    assert (
+        table.get_item(Key=message_key("global", request["messageId"]))["Item"]["X"]
+        == "Ships"
+    )
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from shared_runtime.clients import LazyProxy
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+SHARED_RUNTIME_DIR = os.path.join(BACKEND_DIR, "aws_lambda_shared", "shared_runtime", "python")
+
+# Import time budget of each handler in milliseconds, and the heavy modules it may import. Otherwise boto3 and
+# openai are only loaded on first use. Measured at ~35 ms per handler with tracing disabled
+IMPORT_TIME_BUDGETS = {
+    "src/websocket_chat/aws_lambda/runtime/query_messages": (150, []),
+    "src/websocket_chat/aws_lambda/runtime/send_message": (150, []),
+    "src/websocket_chat/aws_lambda/runtime/request_ai_response": (150, []),
+    # The Powertools batch utility imports boto3 (its data classes do), ~200 ms
+    "src/websocket_chat/aws_lambda/runtime/ai_response_worker": (400, ["boto3"]),
+    "src/websocket_chat/aws_lambda/runtime/delete_all_messages": (150, []),
+    "src/websocket_chat/aws_lambda/runtime/recent_messages": (150, []),
+    "src/user_pool/aws_lambda/runtime/sync_user_profile": (150, []),
+}
+
+HANDLER_ENV = {
+    "AWS_REGION": "eu-west-1",
+    "AWS_DEFAULT_REGION": "eu-west-1",
+    "POWERTOOLS_TRACE_DISABLED": "true",
+    "MESSAGES_TABLE_NAME": "Messages",
+    "USER_PROFILES_TABLE_NAME": "UserProfiles",
+    "USER_POOL_ARN": "arn:aws:cognito-idp:eu-west-1:123456789012:userpool/eu-west-1_test",
+    "AI_RESPONSE_QUEUE_URL": "https://sqs.eu-west-1.amazonaws.com/123456789012/AiResponses",
+    "PURGE_QUEUE_URL": "https://sqs.eu-west-1.amazonaws.com/123456789012/Purges",
+    "GRAPHQL_URL": "https://example.appsync-api.eu-west-1.amazonaws.com/graphql",
+    "OPENAI_TOKEN_SECRET_NAME": "OPENAI_TOKEN",
+}
+
+MEASURE_IMPORT = """
+import sys, json
+from time import perf_counter
+started_at = perf_counter()
+import lambda_function
+print(json.dumps({
+    "milliseconds": (perf_counter() - started_at) * 1000,
+    "modules": [name for name in ("boto3", "openai") if name in sys.modules],
+}))
+"""
+
+
+def measure_import(function_dir: str) -> dict:
+    # A fresh interpreter per measurement, as in a cold start. The best of 3 runs filters out noise
+    code_dir = os.path.join(BACKEND_DIR, function_dir)
+    env = {
+        **os.environ,
+        **HANDLER_ENV,
+        "PYTHONPATH": os.pathsep.join([code_dir, SHARED_RUNTIME_DIR]),
+    }
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", MEASURE_IMPORT],
+                cwd=code_dir,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+        for _ in range(3)
+    ]
+    return min(runs, key=lambda run: run["milliseconds"])
+
+
+@pytest.mark.parametrize("function_dir", sorted(IMPORT_TIME_BUDGETS))
+def test_handler_import_time_is_within_budget(function_dir):
+    pytest.importorskip("aws_lambda_powertools")
+    pytest.importorskip("boto3")
+    budget_ms, allowed_modules = IMPORT_TIME_BUDGETS[function_dir]
+    measurement = measure_import(function_dir)
+    assert set(measurement["modules"]) <= set(allowed_modules)
+    assert measurement["milliseconds"] <= budget_ms
+
+
+def test_lazy_proxy_creates_the_object_once_on_first_use():
+    created = []
+
+    def factory():
+        created.append(1)
+        return {"answer": 42}
+
+    proxy = LazyProxy(factory)
+    assert created == []
+    assert proxy.get("answer") == 42
+    assert proxy.get("answer") == 42
+    assert created == [1]
@@ -0,0 +1,95 @@
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+import pytest
+
+from shared_runtime import instrumentation
+from shared_runtime.instrumentation import (
+    count_connections,
+    dependency_call,
+    instrument_client,
+    instrument_handler,
+    usage,
+)
+
+
+@pytest.fixture
+def metrics(monkeypatch, stub_metrics):
+    monkeypatch.setattr(instrumentation, "metrics", stub_metrics)
+    monkeypatch.setattr(instrumentation, "cost_sample_rate", 1.0)
+    monkeypatch.setattr(instrumentation, "_cold_start", False)
+    return stub_metrics
+
+
+@pytest.fixture
+def dynamodb(table):
+    # Without the type conversions of the table resource
+    return instrument_client(boto3.client("dynamodb", region_name="us-east-1"))
+
+
+def test_handlers_emit_the_calls_capacity_and_items_of_the_invocation(
+    metrics, dynamodb, lambda_context
+):
+    @instrument_handler
+    def handler(event, context):
+        for number in range(3):
+            dynamodb.put_item(
+                TableName="Messages",
+                Item={"PK": {"S": "ROOM#%d" % number}, "SK": {"S": "META"}},
+            )
+        dynamodb.scan(
+            TableName="Messages",
+            FilterExpression="PK = :pk",
+            ExpressionAttributeValues={":pk": {"S": "ROOM#0"}},
+        )
+        with dependency_call("OpenAI"):
+            usage.add_tokens(100, 20)
+
+    handler({}, lambda_context())
+    assert metrics.values["DynamoDBCalls"] == [4]
+    assert metrics.values["OpenAICalls"] == [1]
+    assert metrics.values["DynamoDBWriteCapacity"] == [3]
+    assert metrics.values["DynamoDBScannedItems"] == [3]
+    assert metrics.values["DynamoDBReturnedItems"] == [1]
+    assert metrics.values["OpenAIPromptTokens"] == [100]
+    assert len(metrics.values["EstimatedCostMicroDollars"]) == 1
+    # The next invocation starts from zero
+    handler({}, lambda_context())
+    assert metrics.values["DynamoDBWriteCapacity"] == [3, 3]
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_handlers_emit_how_many_requests_reused_a_connection(metrics, lambda_context):
+    from urllib3 import PoolManager
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    pool = count_connections(PoolManager())
+
+    @instrument_handler
+    def handler(event, context):
+        for _ in range(3):
+            pool.request("GET", "http://127.0.0.1:%d/" % server.server_port)
+
+    try:
+        handler({}, lambda_context())
+        handler({}, lambda_context())
+    finally:
+        pool.clear()
+        server.shutdown()
+    assert metrics.values["HttpRequests"] == [3, 3]
+    # The warm invocation reuses the connection of the first one
+    assert metrics.values["HttpNewConnections"] == [1, 0]
@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "benchmark"
+    ),
+)
+
+from memory_sweep import modeled_duration_ms, sweep, suggest  # noqa: E402
+
+SAMPLE = {"wall_ms": 40.0, "compute_ms": 10.0, "api_calls": 2, "api_ms": 20.0}
+
+
+def test_compute_scales_with_the_cpu_share_up_to_a_full_vcpu():
+    # 10 ms of compute, 2 calls of 5 ms and 10 ms waiting on other services
+    assert modeled_duration_ms(SAMPLE, 1769, 5, 1.0) == 30.0
+    assert modeled_duration_ms(SAMPLE, 3008, 5, 1.0) == 30.0
+    assert round(modeled_duration_ms(SAMPLE, 128, 5, 1.0), 1) == 158.2
+
+
+def test_suggests_the_cheapest_size_that_meets_the_target():
+    rows = sweep([SAMPLE] * 10, "arm64", 5, 1.0, memory_sizes=[128, 512, 1769])
+    assert suggest(rows, 100)["memory_size"] == 512
+    assert suggest(rows, 200)["memory_size"] == 128
+    missed = suggest(rows, 10)
+    assert (missed["memory_size"], missed["meets"]) == (1769, False)
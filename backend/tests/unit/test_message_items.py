@@ -0,0 +1,252 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "scripts",
+    ),
+)
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "tests/benchmark",
+    ),
+)
+
+from migrate_messages import main, migrate_table, set_room_retention
+from shared_runtime.messages import (
+    message_key,
+    ulid_from_timestamp,
+    ulid_timestamp,
+    visible_to,
+)
+from shared_runtime.message_items import (
+    compact_message_item,
+    read_message_item,
+    sync_cursor,
+    expires_at,
+    is_expired,
+    RoomRetention,
+)
+from shared_runtime.usernames import UsernameResolver
+
+MESSAGE_ID = ulid_from_timestamp(1_700_000_000_000, 1)
+
+
+def legacy_item(room_id: str, message_id: str, tenant_id: str, ai_generated: bool):
+    return {
+        **message_key(room_id, message_id),
+        "VisibleTo": visible_to(room_id, tenant_id, ai_generated),
+        "Text": "Hello from " + tenant_id,
+        "AiGenerated": ai_generated,
+        "Username": "Orator " + tenant_id,
+        "TenantId": tenant_id,
+    }
+
+
+def test_both_versions_read_the_same():
+    for ai_generated in (False, True):
+        compact = compact_message_item("global", MESSAGE_ID, "t1", "Hi", ai_generated)
+        legacy = legacy_item("global", MESSAGE_ID, "t1", ai_generated)
+        assert "Username" not in compact and "Text" not in compact
+        expected = {
+            **read_message_item(legacy),
+            "text": "Hi",
+            "username": None,
+            "cursor": sync_cursor(compact["W"]),
+        }
+        assert read_message_item(compact) == expected
+
+
+def test_only_long_texts_that_shrink_are_compressed():
+    text = "To be or not to be, " * 50
+    item = compact_message_item("global", MESSAGE_ID, "t1", text, False, None, 100)
+    assert "Z" in item and "X" not in item
+    assert len(item["Z"]) < len(text)
+    assert read_message_item(item)["text"] == text
+    assert "X" in compact_message_item(
+        "global", MESSAGE_ID, "t1", "Short", False, None, 100
+    )
+
+
+def test_expiry_follows_the_room_retention(table):
+    assert expires_at(MESSAGE_ID, None) is None
+    assert expires_at(MESSAGE_ID, 2) == 1_700_000_000 + 2 * 86400
+    set_room_retention(table, "short", 1)
+    set_room_retention(table, "kept", 0)
+    retention = RoomRetention(table, default_days=30)
+    assert [retention.days(room) for room in ("short", "kept", "other")] == [1, 0, 30]
+    item = compact_message_item(
+        "short",
+        MESSAGE_ID,
+        "t1",
+        "Hi",
+        False,
+        retention.expires_at("short", MESSAGE_ID),
+    )
+    assert is_expired(item, now=1_700_000_000 + 86400)
+    assert not is_expired(item, now=1_700_000_000)
+
+
+def test_cursors_rewind_the_write_by_the_settle_time():
+    written_id = ulid_from_timestamp(1_700_000_005_000, 42)
+    item = compact_message_item(
+        "global", MESSAGE_ID, "t1", "Hi", False, written_id=written_id
+    )
+    assert item["W"] == written_id
+    # Before the writes of the last 5 seconds, whatever their randomness
+    assert read_message_item(item)["cursor"] == ulid_from_timestamp(1_700_000_000_000)
+    assert sync_cursor(written_id) < ulid_from_timestamp(1_700_000_000_000, 1)
+
+
+def test_catch_up_pages_rewind_to_the_messages_still_landing(table, monkeypatch):
+    from time import time
+    from harness import FUNCTIONS_DIR, LambdaContext, load_handler
+
+    for name, value in {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "MESSAGES_TABLE_NAME": "Messages",
+        "USER_PROFILES_TABLE_NAME": "Profiles",
+    }.items():
+        monkeypatch.setenv(name, value)
+    function = load_handler(
+        os.path.join(FUNCTIONS_DIR, "messages_since"), "messages_since"
+    )
+    monkeypatch.setattr(
+        function.username_resolver,
+        "resolve_tenants",
+        lambda tenant_ids: {tenant_id: "Orator" for tenant_id in tenant_ids},
+    )
+    now_ms = int(time() * 1000)
+    # Two settled writes, then three of the last seconds
+    written_ids = [
+        ulid_from_timestamp(now_ms - age_ms, 1)
+        for age_ms in (60_000, 59_000, 3_000, 2_000, 1_000)
+    ]
+    for index, written_id in enumerate(written_ids):
+        table.put_item(
+            Item=compact_message_item(
+                "global",
+                ulid_from_timestamp(1_700_000_000_000, index),
+                "t1",
+                "Hi",
+                False,
+                written_id=written_id,
+            )
+        )
+
+    def catch_up(cursor: str) -> dict:
+        event = {
+            "arguments": {"cursor": cursor, "limit": 2},
+            "identity": {"claims": {"sub": "t1"}},
+        }
+        return function.handler(event, LambdaContext())
+
+    first = catch_up(ulid_from_timestamp(now_ms - 120_000))
+    # Settled, the next page starts right after the last message
+    assert first["hasMore"] and first["cursor"] == written_ids[1]
+    second = catch_up(first["cursor"])
+    # Still landing, the next page reads the last seconds again
+    assert second["hasMore"] and second["cursor"] == sync_cursor(written_ids[3])
+    third = catch_up(second["cursor"])
+    # Rewinding again wouldn't move past the cursor
+    assert third["hasMore"] and third["cursor"] == written_ids[3]
+    fourth = catch_up(third["cursor"])
+    assert not fourth["hasMore"]
+    assert [item["text"] for item in fourth["items"]] == ["Hi"]
+
+
+def test_usernames_of_the_authors_are_read_in_one_batch(profiles_table):
+    for tenant_id in ("t1", "t2"):
+        profiles_table.put_item(
+            Item={"TenantId": tenant_id, "PreferredUsername": "Orator " + tenant_id}
+        )
+    resolver = UsernameResolver(None, profiles_table)
+    assert resolver.resolve_tenants(["t1", "t2", "t1", "ghost"]) == {
+        "t1": "Orator t1",
+        "t2": "Orator t2",
+        "ghost": "",
+    }
+    profiles_table.delete_item(Key={"TenantId": "t1"})
+    assert resolver.resolve_tenants(["t1"]) == {"t1": "Orator t1"}  # Cached
+
+
+def test_migration_compacts_and_can_run_again(table, profiles_table):
+    profiles_table.put_item(Item={"TenantId": "t1", "PreferredUsername": "Renamed"})
+    for index, tenant_id in enumerate(("t1", "t2", "t3")):
+        message_id = ulid_from_timestamp(1_700_000_000_000 + index, index)
+        table.put_item(Item=legacy_item("global", message_id, tenant_id, index == 1))
+    compact = compact_message_item("global", MESSAGE_ID, "t4", "Already compact", False)
+    del compact["W"]  # Written before the SyncIndex
+    table.put_item(Item=compact)
+    set_room_retention(table, "global", 7)
+
+    def run():
+        return migrate_table(lambda: table, lambda: profiles_table, total_segments=2)
+
+    assert run() == (3, 1, 0, 0)
+    items = [item for item in table.scan()["Items"] if item["SK"].startswith("MSG#")]
+    assert all(item["V"] == 2 and "ExpiresAt" in item for item in items)
+    assert all(item["W"] == read_message_item(item)["id"] for item in items)
+    assert sorted(read_message_item(item)["text"] for item in items) == [
+        "Already compact",
+        "Hello from t1",
+        "Hello from t2",
+        "Hello from t3",
+    ]
+    # The usernames are kept, without overwriting the profiles
+    usernames = UsernameResolver(None, profiles_table).resolve_tenants(
+        ["t1", "t2", "t3"]
+    )
+    assert usernames == {"t1": "Renamed", "t2": "Orator t2", "t3": "Orator t3"}
+    assert run() == (0, 0, 4, 0)
+
+
+def test_migration_runs_from_the_command_line(
+    table, profiles_table, monkeypatch, capsys
+):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    table.put_item(Item=legacy_item("global", MESSAGE_ID, "t1", False))
+    compact = compact_message_item("global", MESSAGE_ID[:-1] + "Z", "t2", "Hi", False)
+    del compact["W"]
+    table.put_item(Item=compact)
+    main(["--table", "Messages", "--profiles-table", "Profiles", "--segments", "1"])
+    assert (
+        "0 moved to the global room, 1 compacted, 1 updated, 0 unchanged"
+        in capsys.readouterr().out
+    )
+
+
+def test_migration_moves_the_messages_written_before_the_rooms(table, profiles_table):
+    # As written by the first version of sendMessage, two in the same second
+    for uuid in (
+        "0f6e7a3c-27b1-4bb0-9a3e-5d2e8d1c9a01",
+        "9c1d2e3f-4a5b-4c6d-8e7f-0a1b2c3d4e5f",
+    ):
+        table.put_item(
+            Item={
+                "PK": uuid,
+                "SK": "2023-05-01T10:00:00+00:00",
+                "Text": "Hello from " + uuid[:4],
+                "AiGenerated": False,
+                "Username": "Orator",
+                "TenantId": "t1",
+            }
+        )
+
+    def run():
+        return migrate_table(lambda: table, lambda: profiles_table, total_segments=1)
+
+    assert run().moved == 2
+    items = table.scan()["Items"]
+    assert all(item["PK"] == "ROOM#global" and item["V"] == 2 for item in items)
+    ids = sorted(read_message_item(item)["id"] for item in items)
+    assert len(set(ids)) == 2
+    assert {ulid_timestamp(message_id) for message_id in ids} == {1682935200000}
+    assert UsernameResolver(None, profiles_table).resolve_tenants(["t1"]) == {
+        "t1": "Orator"
+    }
+    assert run() == (0, 0, 2, 0)
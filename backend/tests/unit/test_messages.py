@@ -0,0 +1,84 @@
+import pytest
+
+from shared_runtime.messages import (
+    DEFAULT_ROOM_ID,
+    MAX_PAGE_SIZE,
+    room_id_or_default,
+    message_key,
+    message_id_from_sk,
+    new_message_id,
+    ulid_from_timestamp,
+    ulid_timestamp,
+    encode_cursor,
+    decode_cursor,
+    page_size,
+    merge_newest_first,
+)
+
+
+def test_message_ids_sort_in_creation_order():
+    ids = [new_message_id() for _ in range(1000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_ulid_timestamp_roundtrip():
+    assert ulid_timestamp(ulid_from_timestamp(1_700_000_000_123, 42)) == 1_700_000_000_123
+
+
+def test_message_key_layout():
+    key = message_key("global", "01ABC")
+    assert key == {"PK": "ROOM#global", "SK": "MSG#01ABC"}
+    assert message_id_from_sk(key["SK"]) == "01ABC"
+
+
+def test_room_ids_default_and_cannot_break_the_key_layout():
+    assert room_id_or_default(None) == DEFAULT_ROOM_ID
+    assert room_id_or_default("agora-1") == "agora-1"
+    for room_id in ["", "a#MSG", "x" * 65]:
+        with pytest.raises(ValueError):
+            room_id_or_default(room_id)
+
+
+def test_cursor_roundtrip():
+    key = {"PK": "ROOM#global", "SK": "MSG#01ABC"}
+    assert decode_cursor(encode_cursor(key)) == key
+    assert encode_cursor(None) is None
+    assert decode_cursor(None) is None
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_page_size_is_clamped():
+    assert page_size(None) > 0
+    assert page_size(0) == 1
+    assert page_size(10_000) == MAX_PAGE_SIZE
+
+
+def _item(audience, message_id):
+    return {"PK": "ROOM#global", "SK": "MSG#" + message_id, "VisibleTo": audience}
+
+
+def test_merge_newest_first_pages_through_both_audiences():
+    ai = [_item("ai", id_) for id_ in ["09", "07", "03", "01"]]
+    own = [_item("own", id_) for id_ in ["08", "02"]]
+    seen = []
+    start_keys = {"ai": None, "own": None}
+    while start_keys:
+        # Simulates a Query with Limit=2 on each audience partition
+        pages = {}
+        for audience, items in (("ai", ai), ("own", own)):
+            if audience not in start_keys:
+                continue
+            start = start_keys[audience]
+            remaining = [i for i in items if start is None or i["SK"] < start["SK"]]
+            page = remaining[:2]
+            last_key = (
+                {k: page[-1][k] for k in ("PK", "SK", "VisibleTo")}
+                if len(remaining) > 2
+                else None
+            )
+            pages[audience] = (page, last_key)
+        merged, start_keys = merge_newest_first(pages, start_keys, 2)
+        seen.extend(item["SK"] for item in merged)
+    assert seen == ["MSG#09", "MSG#08", "MSG#07", "MSG#03", "MSG#02", "MSG#01"]
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "scripts",
+    ),
+)
+
+from move_messages_to_rooms import is_pre_room_item, moved_item
+from shared_runtime.messages import message_id_from_sk, ulid_timestamp
+
+
+def pre_room_item(uuid: str) -> dict:
+    # As written by the first version of sendMessage
+    return {
+        "PK": uuid,
+        "SK": "2023-05-01T10:00:00+00:00",
+        "Text": "Hello",
+        "AiGenerated": False,
+        "Username": "Orator",
+        "TenantId": "t1",
+    }
+
+
+def test_messages_written_before_the_rooms_move_to_the_global_room():
+    first = pre_room_item("0f6e7a3c-27b1-4bb0-9a3e-5d2e8d1c9a01")
+    second = pre_room_item("9c1d2e3f-4a5b-4c6d-8e7f-0a1b2c3d4e5f")
+    assert is_pre_room_item(first)
+    moved = [moved_item(first), moved_item(second)]
+    assert all(item["PK"] == "ROOM#global" for item in moved)
+    assert moved[0]["Text"] == "Hello" and moved[0]["TenantId"] == "t1"
+    ids = [message_id_from_sk(item["SK"]) for item in moved]
+    # Same second, different uuids
+    assert ids[0] != ids[1]
+    assert {ulid_timestamp(message_id) for message_id in ids} == {1682935200000}
+    # A second run computes the same ids, and skips the moved items
+    assert moved_item(first) == moved[0]
+    assert not is_pre_room_item(moved[0])
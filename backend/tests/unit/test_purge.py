@@ -0,0 +1,127 @@
+import os
+import sys
+import threading
+import time
+
+import boto3
+import pytest
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "src/websocket_chat/aws_lambda/runtime/delete_all_messages",
+    ),
+)
+
+from shared_runtime.messages import message_key, room_meta_key, room_recent_key
+from shared_runtime.idempotency import idempotency_item_key
+from shared_runtime import batch_writes
+from shared_runtime.batch_writes import client_batch_delete, UnprocessedItemsError
+from shared_runtime.deadlines import deadline
+from purge import purge_partition
+
+
+class StubDynamoDB:
+    # Low-level client stand-in: a paginated table that leaves some deletes unprocessed. Items are spread round-robin
+    # over the 'rooms'
+    def __init__(self, item_count: int, page_size: int = 30, unprocessed_every: int = 3, rooms=("global",)):
+        self.items = {
+            str(i): {"PK": {"S": "ROOM#" + rooms[i % len(rooms)]}, "SK": {"S": "MSG#%06d" % i}}
+            for i in range(item_count)
+        }
+        self.page_size = page_size
+        self.unprocessed_every = unprocessed_every
+        self.batch_calls = 0
+        # Number of items left at each query
+        self.items_at_query = []
+        self.lock = threading.Lock()
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ProjectionExpression, ExclusiveStartKey=None):
+        pk = ExpressionAttributeValues[":pk"]["S"]
+        with self.lock:
+            self.items_at_query.append(len(self.items))
+            keys = sorted(int(k) for k, item in self.items.items() if item["PK"]["S"] == pk)
+            items = dict(self.items)
+        if ExclusiveStartKey:
+            keys = [k for k in keys if k > int(ExclusiveStartKey["SK"]["S"][4:])]
+        page = keys[: self.page_size]
+        response = {"Items": [items[str(k)] for k in page]}
+        if len(keys) > self.page_size:
+            response["LastEvaluatedKey"] = items[str(page[-1])]
+        return response
+
+    def batch_write_item(self, RequestItems):
+        (table_name, requests), = RequestItems.items()
+        assert len(requests) <= 25
+        time.sleep(0.001)
+        with self.lock:
+            self.batch_calls += 1
+            unprocessed = requests[:1] if self.batch_calls % self.unprocessed_every == 0 else []
+            for request in requests[len(unprocessed):]:
+                sk = request["DeleteRequest"]["Key"]["SK"]["S"]
+                self.items.pop(str(int(sk[4:])), None)
+        return {"UnprocessedItems": {table_name: unprocessed} if unprocessed else {}}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff_sleep(monkeypatch):
+    monkeypatch.setattr(batch_writes, "backoff_delay", lambda *args, **kwargs: 0)
+
+
+def test_purge_deletes_every_page_with_a_bounded_number_of_batches_in_flight():
+    client = StubDynamoDB(3000, page_size=1000)
+    result = purge_partition(client, "Messages", "ROOM#global", max_workers=4)
+    assert result.deleted == 3000 and result.complete
+    assert client.items == {}
+    # At most 2 x 4 batches of 25 keys wait to be deleted when the next page is read
+    assert [items <= 3000 - 1000 * page + 200 for page, items in enumerate(client.items_at_query)] == [True] * 3
+
+
+def test_purge_stops_reading_pages_at_the_deadline_and_resumes(lambda_context):
+    client = StubDynamoDB(100, unprocessed_every=1000)
+    deadline.start(lambda_context(remaining_ms=1000))
+    try:
+        result = purge_partition(client, "Messages", "ROOM#global", reserve_seconds=5)
+    finally:
+        deadline.start(None)
+    # The page read before running out of time is deleted
+    assert (result.deleted, result.complete) == (30, False)
+    assert len(client.items) == 70
+    result = purge_partition(client, "Messages", "ROOM#global")
+    assert (result.deleted, result.complete) == (70, True)
+    assert client.items == {}
+
+
+def test_purge_partition_only_deletes_the_room():
+    client = StubDynamoDB(300, rooms=("global", "agora"))
+    result = purge_partition(client, "Messages", "ROOM#agora", max_workers=4)
+    assert result.deleted == 150
+    assert len(client.items) == 150
+    assert all(item["PK"]["S"] == "ROOM#global" for item in client.items.values())
+
+
+def test_batch_delete_gives_up_on_items_that_stay_unprocessed():
+    client = StubDynamoDB(10, unprocessed_every=1)
+    keys = list(client.items.values())
+    with pytest.raises(UnprocessedItemsError):
+        client_batch_delete(
+            client, "Messages", keys, max_attempts=3, sleep=lambda _: None
+        )
+
+
+def test_purge_partition_keeps_the_settings_and_idempotency_items_of_the_room(table):
+    client = boto3.client("dynamodb", region_name="us-east-1")
+    kept = [
+        {**room_meta_key("agora"), "RetentionDays": 30},
+        room_recent_key("agora"),
+        idempotency_item_key("agora", "sendMessage", "t1", "k1"),
+    ]
+    for item in kept + [message_key("agora", "01H%023d" % i) for i in range(30)]:
+        table.put_item(Item=item)
+    result = purge_partition(client, "Messages", "ROOM#agora", max_workers=2)
+    assert result.deleted == 30
+    assert sorted(item["SK"] for item in table.scan()["Items"]) == sorted(
+        item["SK"] for item in kept
+    )
+    assert table.get_item(Key=room_meta_key("agora"))["Item"]["RetentionDays"] == 30
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from shared_runtime.queues import LocalQueue
+from shared_runtime.retry import retry_with_backoff
+
+
+def make_worker(failures_before_success: dict):
+    # Lambda handler that reports partial batch failures, like the ai_response_worker function
+    processed = []
+
+    def handler(event, context):
+        failures = []
+        for record in event["Records"]:
+            body = json.loads(record["body"])
+            if int(record["attributes"]["ApproximateReceiveCount"]) <= failures_before_success.get(body["id"], 0):
+                failures.append({"itemIdentifier": record["messageId"]})
+            else:
+                processed.append(body["id"])
+        return {"batchItemFailures": failures}
+
+    return handler, processed
+
+
+def test_local_queue_redelivers_failed_messages():
+    handler, processed = make_worker({"a": 2})
+    queue = LocalQueue(handler, max_receive_count=3)
+    queue.send({"id": "a"})
+    queue.send({"id": "b"})
+    queue.drain()
+    assert sorted(processed) == ["a", "b"]
+    assert queue.dead_letters == []
+
+
+def test_local_queue_moves_poison_messages_to_the_dead_letter_queue():
+    handler, processed = make_worker({"a": 10})
+    queue = LocalQueue(handler, max_receive_count=3, batch_size=5)
+    queue.send({"id": "a"})
+    queue.send({"id": "b"})
+    queue.drain()
+    assert processed == ["b"]
+    assert [json.loads(body)["id"] for body in queue.dead_letters] == ["a"]
+
+
+def test_retry_with_backoff_retries_only_retryable_errors():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError()
+        return "ok"
+
+    assert retry_with_backoff(flaky, (TimeoutError,), attempts=3, sleep=lambda _: None) == "ok"
+
+    def broken():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        retry_with_backoff(broken, (TimeoutError,), attempts=3, sleep=lambda _: None)
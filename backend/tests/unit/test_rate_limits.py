@@ -0,0 +1,112 @@
+import os
+import sys
+
+import pytest
+
+from shared_runtime.rate_limits import RateLimiter, RateLimitExceeded
+
+BACKEND_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "tests/benchmark"))
+
+
+def test_bursts_then_refills_at_the_rate(table, stub_metrics):
+    now = [1000.0]
+    limiter = RateLimiter(table, "Test", 60, 3, stub_metrics, clock=lambda: now[0])
+    for _ in range(3):
+        limiter.take("t1")
+    with pytest.raises(RateLimitExceeded) as e:
+        limiter.take("t1")
+    assert e.value.retry_after_seconds == 1.0
+    limiter.take("t2")  # Other tenants are not affected
+    now[0] += 1
+    limiter.take("t1")
+    with pytest.raises(RateLimitExceeded):
+        limiter.take("t1")
+    assert stub_metrics.counts == {"TestRateLimited": 2}
+
+
+def test_costs_take_several_tokens(table):
+    now = [1000.0]
+    limiter = RateLimiter(table, "Tokens", 600, 1000, clock=lambda: now[0])
+    limiter.take("global", 800)
+    with pytest.raises(RateLimitExceeded) as e:
+        limiter.take("global", 800)
+    # 600 more tokens needed, at 10 per second
+    assert e.value.retry_after_seconds == 60.0
+    now[0] += 60
+    limiter.take("global", 800)
+
+
+def test_retries_of_a_claimed_ai_request_take_no_tokens(table, monkeypatch):
+    from harness import FUNCTIONS_DIR, LambdaContext, load_handler
+
+    for name, value in {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "USER_POOL_ARN": "arn:aws:cognito-idp:us-east-1:123456789012:userpool/pool",
+        "USER_PROFILES_TABLE_NAME": "Profiles",
+        "MESSAGES_TABLE_NAME": "Messages",
+        "AI_RESPONSE_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/1/queue",
+        "TENANT_AI_REQUESTS_BURST": "1",
+    }.items():
+        monkeypatch.setenv(name, value)
+    function = load_handler(
+        os.path.join(FUNCTIONS_DIR, "request_ai_response"), "request_ai_response"
+    )
+    monkeypatch.setattr(function.username_resolver, "resolve", lambda _: "Pericles")
+    queued = []
+    monkeypatch.setattr(function.ai_response_queue, "send", queued.append)
+
+    def request(idempotency_key: str) -> dict:
+        event = {
+            "arguments": {
+                "message": {
+                    "text": "Defend the fleet",
+                    "idempotencyKey": idempotency_key,
+                }
+            },
+            "identity": {"claims": {"sub": "t1"}},
+        }
+        return function.handler(event, LambdaContext())
+
+    first = request("k1")
+    # The tenant's only token is used, the retry gets the pending message anyway
+    assert request("k1") == first
+    assert len(queued) == 1
+    with pytest.raises(RateLimitExceeded):
+        request("k2")
+    # The rejected request released its key, so it can be retried later
+    assert len(table.scan()["Items"]) == 3  # The claim of k1 and the two buckets
+
+
+def test_retries_of_a_claimed_message_take_no_tokens(table, monkeypatch):
+    from harness import FUNCTIONS_DIR, LambdaContext, load_handler
+
+    for name, value in {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "USER_POOL_ARN": "arn:aws:cognito-idp:us-east-1:123456789012:userpool/pool",
+        "USER_PROFILES_TABLE_NAME": "Profiles",
+        "MESSAGES_TABLE_NAME": "Messages",
+        "TENANT_MESSAGES_BURST": "1",
+    }.items():
+        monkeypatch.setenv(name, value)
+    function = load_handler(os.path.join(FUNCTIONS_DIR, "send_message"), "send_message")
+    monkeypatch.setattr(function.username_resolver, "resolve", lambda _: "Pericles")
+
+    def send(idempotency_key: str) -> dict:
+        event = {
+            "arguments": {
+                "message": {"text": "Hold the walls", "idempotencyKey": idempotency_key}
+            },
+            "identity": {"claims": {"sub": "t1"}},
+        }
+        return function.handler(event, LambdaContext())
+
+    first = send("k1")
+    # The tenant's only token is used, the retry gets the message anyway
+    assert send("k1") == first
+    with pytest.raises(RateLimitExceeded):
+        send("k2")
+    # The rejected message released its key, so it can be retried later
+    assert not any("#k2" in item["SK"] for item in table.scan()["Items"])
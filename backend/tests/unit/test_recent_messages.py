@@ -0,0 +1,106 @@
+import pytest
+
+from shared_runtime.messages import (
+    ai_audience,
+    tenant_audience,
+    message_key,
+    visible_to,
+    decode_cursor,
+    encode_cursor,
+)
+from shared_runtime.recent_messages import (
+    apply_changes,
+    empty_recent,
+    recent_page,
+    room_changes,
+)
+
+AUDIENCES = [ai_audience("global"), tenant_audience("global", "t1")]
+
+
+def message(number: int, tenant_id: str = "t1", ai_generated: bool = False) -> dict:
+    return {
+        **message_key("global", "%04d" % number),
+        "VisibleTo": visible_to("global", tenant_id, ai_generated),
+        "Text": "Message %d" % number,
+        "AiGenerated": ai_generated,
+        "Username": "Cicero",
+        "TenantId": tenant_id,
+    }
+
+
+def test_changes_keep_the_newest_messages_first_and_evict_the_oldest():
+    changes = [
+        ("put", message(number, ai_generated=number % 2 == 0)) for number in range(6)
+    ]
+    recent = apply_changes(empty_recent(), changes + [("remove", "MSG#0005")], 3)
+    assert [m["SK"] for m in recent["Messages"]] == ["MSG#0004", "MSG#0003", "MSG#0002"]
+    assert recent["CompleteAfter"] == "MSG#0001"
+    # Replaying the batch changes nothing
+    assert apply_changes(recent, changes + [("remove", "MSG#0005")], 3) == recent
+
+
+def test_clearing_drops_the_messages_up_to_the_watermark():
+    recent = apply_changes(empty_recent(), [("put", message(n)) for n in range(4)])
+    recent = apply_changes(recent, [("clear", "MSG#0001"), ("put", message(1))])
+    assert [m["SK"] for m in recent["Messages"]] == ["MSG#0003", "MSG#0002"]
+
+
+def test_a_complete_view_answers_and_exhausts_the_audiences():
+    recent = apply_changes(
+        empty_recent(),
+        [
+            ("put", message(0, ai_generated=True)),
+            ("put", message(1)),
+            ("put", message(2, "t2")),
+        ],
+    )
+    items, next_start_keys = recent_page(recent, AUDIENCES, 50)
+    assert [m["SK"] for m in items] == ["MSG#0001", "MSG#0000"]
+    assert next_start_keys == {}
+
+
+def test_an_incomplete_view_only_answers_full_pages():
+    recent = apply_changes(empty_recent(), [("put", message(n)) for n in range(5)], 4)
+    assert recent_page(recent, AUDIENCES, 5) is None
+    items, next_start_keys = recent_page(recent, AUDIENCES, 2)
+    assert [m["SK"] for m in items] == ["MSG#0004", "MSG#0003"]
+    # Same cursor as the VisibilityIndex path, so the next page is queried from there
+    cursor = decode_cursor(encode_cursor(next_start_keys))
+    assert cursor[AUDIENCES[1]]["SK"] == "MSG#0003"
+    assert cursor[AUDIENCES[0]] is None
+
+
+def test_stream_records_become_changes_per_room():
+    pytest.importorskip("boto3")
+    records = [
+        {
+            "eventName": "INSERT",
+            "dynamodb": {
+                "Keys": {"PK": {"S": "ROOM#global"}, "SK": {"S": "MSG#0001"}},
+                "NewImage": {
+                    "PK": {"S": "ROOM#global"},
+                    "SK": {"S": "MSG#0001"},
+                    "AiGenerated": {"BOOL": False},
+                },
+            },
+        },
+        {
+            "eventName": "MODIFY",
+            "dynamodb": {
+                "Keys": {"PK": {"S": "ROOM#agora"}, "SK": {"S": "META"}},
+                "NewImage": {"ClearedBefore": {"S": "MSG#0009"}},
+            },
+        },
+        {
+            "eventName": "REMOVE",
+            "dynamodb": {"Keys": {"PK": {"S": "ROOM#global"}, "SK": {"S": "MSG#0000"}}},
+        },
+    ]
+    assert room_changes(records) == {
+        "global": [
+            ("put", {"PK": "ROOM#global", "SK": "MSG#0001", "AiGenerated": False}),
+            ("remove", "MSG#0000"),
+        ],
+        "agora": [("clear", "MSG#0009")],
+    }
@@ -0,0 +1,134 @@
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+from shared_runtime.messages import (
+    ai_audience,
+    tenant_audience,
+    ulid_from_timestamp,
+    message_sk,
+)
+from shared_runtime.message_items import compact_message_item
+from shared_runtime.batch_writes import batch_put, batch_delete
+from shared_runtime.search import (
+    terms,
+    query_terms,
+    posting_pk,
+    posting_changes,
+    rank,
+    get_messages,
+)
+
+serializer = TypeSerializer()
+
+
+def message(number: int, text: str, tenant_id: str = "t1", ai_generated=False):
+    message_id = ulid_from_timestamp(1_700_000_000_000 + number, number)
+    return compact_message_item("global", message_id, tenant_id, text, ai_generated)
+
+
+def record(event_name: str, old: dict = None, new: dict = None) -> dict:
+    item = new or old
+    images = {}
+    if old:
+        images["OldImage"] = {k: serializer.serialize(v) for k, v in old.items()}
+    if new:
+        images["NewImage"] = {k: serializer.serialize(v) for k, v in new.items()}
+    return {
+        "eventName": event_name,
+        "dynamodb": {
+            "Keys": {"PK": {"S": item["PK"]}, "SK": {"S": item["SK"]}},
+            **images,
+        },
+    }
+
+
+def test_terms_are_casefolded_words_without_stop_words():
+    assert terms("The Athenians, the ATHENIANS and Sparta!") == {
+        "athenians": 2,
+        "sparta": 1,
+    }
+    assert query_terms("Sparta sparta Athens") == ["sparta", "athens"]
+    with pytest.raises(ValueError):
+        query_terms("the and of")
+
+
+def test_stream_records_become_posting_changes():
+    sent = message(1, "Sparta and Athens")
+    puts, deletes = posting_changes([record("INSERT", new=sent)])
+    audience = tenant_audience("global", "t1")
+    assert sorted(posting["PK"] for posting in puts) == [
+        posting_pk(audience, "athens"),
+        posting_pk(audience, "sparta"),
+    ]
+    assert deletes == []
+    # Setting an attribute that is not indexed changes nothing
+    migrated = {**sent, "W": ulid_from_timestamp(1_700_000_000_000)}
+    assert posting_changes([record("MODIFY", sent, migrated)]) == ([], [])
+    # A message sent and purged within the batch only leaves the deletes
+    puts, deletes = posting_changes(
+        [record("INSERT", new=sent), record("REMOVE", old=sent)]
+    )
+    assert puts == [] and len(deletes) == 2
+
+
+def test_rare_terms_and_repeated_hits_rank_first():
+    postings = [
+        (
+            "athens",
+            [{"SK": "03", "Hits": 1}, {"SK": "02", "Hits": 3}, {"SK": "01", "Hits": 1}],
+        ),
+        ("sparta", [{"SK": "01", "Hits": 1}]),
+    ]
+    assert rank(postings) == ["01", "02", "03"]
+    # Up to the watermark of the last clear, and expired, messages are not found
+    postings.append(("sparta", [{"SK": "04", "Hits": 1, "ExpiresAt": 1}]))
+    assert rank(postings, cleared_before=message_sk("01")) == ["02", "03"]
+
+
+def test_the_index_follows_the_messages_and_their_audiences(table):
+    messages = [
+        message(1, "Defend Athens from Sparta"),
+        message(2, "Athens will stand", "t2"),
+        message(3, "Athens, Athens", ai_generated=True),
+    ]
+    batch_put(table, messages)
+    puts, _ = posting_changes([record("INSERT", new=m) for m in messages])
+    batch_put(table, puts)
+
+    def search(query: str) -> list:
+        lists = [
+            (
+                term,
+                table.query(
+                    KeyConditionExpression="PK = :pk",
+                    ExpressionAttributeValues={":pk": posting_pk(audience, term)},
+                )["Items"],
+            )
+            for audience in (ai_audience("global"), tenant_audience("global", "t1"))
+            for term in query_terms(query)
+        ]
+        found = get_messages(table, "global", rank(lists))
+        return [item["SK"] for item in found]
+
+    # The messages of t2 are not visible to t1
+    assert search("athens") == [messages[2]["SK"], messages[0]["SK"]]
+    assert search("athens sparta") == [messages[0]["SK"], messages[2]["SK"]]
+    # Purged
+    table.delete_item(Key={"PK": messages[0]["PK"], "SK": messages[0]["SK"]})
+    _, deletes = posting_changes([record("REMOVE", old=messages[0])])
+    batch_delete(table, deletes)
+    assert search("sparta") == []
+
+
+def test_messages_still_unprocessed_are_reported(caplog):
+    class ThrottledClient:
+        def batch_get_item(self, RequestItems):
+            return {"Responses": {}, "UnprocessedKeys": RequestItems}
+
+    class ThrottledTable:
+        name = "Messages"
+        meta = type("Meta", (), {"client": ThrottledClient()})
+
+    ids = [ulid_from_timestamp(1_700_000_000_000, number) for number in range(2)]
+    assert get_messages(ThrottledTable(), "global", ids) == []
+    assert "2 messages left out of the results" in caplog.text
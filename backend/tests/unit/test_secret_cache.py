@@ -0,0 +1,77 @@
+import json
+import time
+
+from shared_runtime.secret_cache import (
+    SecretCache,
+    get_secret_from_env,
+    refresh_secret_from_env,
+)
+
+
+class StubSecretsManager:
+    # Local stand-in for the Secrets Manager client
+    def __init__(self, secrets: dict):
+        self.secrets = secrets
+        self.calls = 0
+        self.fail = False
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("ThrottlingException")
+        return {"SecretString": self.secrets[SecretId]}
+
+
+def make_cache(stub, clock):
+    return SecretCache(
+        client_factory=lambda: stub,
+        ttl_seconds=300,
+        refresh_ahead_seconds=60,
+        clock=clock,
+    )
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_warm_reads_do_not_call_secrets_manager(clock):
+    stub = StubSecretsManager({"Token": "v1"})
+    cache = make_cache(stub, clock)
+    assert cache.get("Token") == "v1"
+    clock.now = 100
+    assert cache.get("Token") == "v1"
+    assert stub.calls == 1
+
+
+def test_refresh_ahead_serves_the_cached_value_and_refreshes_in_background(clock):
+    stub = StubSecretsManager({"Token": "v1"})
+    cache = make_cache(stub, clock)
+    cache.get("Token")
+    stub.secrets["Token"] = "v2"
+    clock.now = 250
+    assert cache.get("Token") == "v1"
+    wait_for(lambda: stub.calls == 2)
+    assert cache.get("Token") == "v2"
+
+
+def test_expired_value_is_served_when_the_refresh_fails(clock):
+    stub = StubSecretsManager({"Token": "v1"})
+    cache = make_cache(stub, clock)
+    cache.get("Token")
+    stub.fail = True
+    clock.now = 1000
+    assert cache.get("Token") == "v1"
+
+
+def test_secret_from_env_and_forced_refresh(monkeypatch, clock):
+    monkeypatch.setenv("OPENAI_TOKEN_SECRET_NAME", "OpenAIToken")
+    stub = StubSecretsManager({"OpenAIToken": json.dumps({"OpenAIToken": "sk-1"})})
+    cache = make_cache(stub, clock)
+    assert get_secret_from_env("OPENAI_TOKEN_SECRET_NAME", cache) == "sk-1"
+    stub.secrets["OpenAIToken"] = json.dumps({"OpenAIToken": "sk-2"})
+    assert get_secret_from_env("OPENAI_TOKEN_SECRET_NAME", cache) == "sk-1"
+    assert refresh_secret_from_env("OPENAI_TOKEN_SECRET_NAME", cache) == "sk-2"
+    assert get_secret_from_env("OPENAI_TOKEN_SECRET_NAME", cache) == "sk-2"
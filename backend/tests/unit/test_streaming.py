@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+        "src/websocket_chat/aws_lambda/runtime/ai_response_worker",
+    ),
+)
+
+from streaming import ChunkPublisher, stream_completion
+
+
+class StubAppSync:
+    def __init__(self):
+        self.chunks = []
+
+    def execute(self, query, variables):
+        self.chunks.append(variables["chunk"])
+
+
+def completion_chunks(tokens, clock):
+    for token in tokens:
+        clock.now += 0.04
+        yield {"choices": [{"delta": {"content": token}}]}
+
+
+def test_tokens_are_coalesced_and_published_in_order(clock):
+    appsync = StubAppSync()
+    publisher = ChunkPublisher(appsync, "m1", "global", "t1", "Cicero", 0.1, clock)
+    tokens = ["Rome", " must", " not", " fall", " to", " tyranny"]
+    text = stream_completion(completion_chunks(tokens, clock), publisher)
+    assert text == "Rome must not fall to tyranny"
+    assert "".join(chunk["text"] for chunk in appsync.chunks) == text
+    assert [chunk["seq"] for chunk in appsync.chunks] == list(range(len(appsync.chunks)))
+    assert len(appsync.chunks) < len(tokens) + 1
+    assert appsync.chunks[-1]["done"] and not any(c["done"] for c in appsync.chunks[:-1])
+
+
+def test_only_the_first_chunk_says_who_asked(clock):
+    appsync = StubAppSync()
+    publisher = ChunkPublisher(appsync, "m1", "global", "t1", "Cicero", 0, clock)
+    stream_completion(completion_chunks(["Rome", " endures"], clock), publisher)
+    assert appsync.chunks[0]["tenantId"] == "t1"
+    assert appsync.chunks[0]["username"] == "Cicero"
+    assert all("username" not in chunk for chunk in appsync.chunks[1:])
@@ -0,0 +1,60 @@
+from shared_runtime.usernames import UsernameResolver
+
+
+class StubProfilesTable:
+    def __init__(self, items: dict = None):
+        self.items = items or {}
+        self.reads = 0
+
+    def get_item(self, Key, ProjectionExpression):
+        self.reads += 1
+        item = self.items.get(Key["TenantId"])
+        return {"Item": item} if item else {}
+
+    def put_item(self, Item):
+        self.items[Item["TenantId"]] = Item
+
+
+class StubCognito:
+    def __init__(self):
+        self.calls = 0
+
+    def admin_get_user(self, UserPoolId, Username):
+        self.calls += 1
+        return {
+            "UserAttributes": [
+                {"Name": "sub", "Value": Username},
+                {"Name": "preferred_username", "Value": "Pericles"},
+            ]
+        }
+
+
+def make_resolver(table, cognito):
+    return UsernameResolver("pool", table, cognito_client_factory=lambda: cognito)
+
+
+def test_claims_win_and_nothing_is_called():
+    table, cognito = StubProfilesTable(), StubCognito()
+    resolver = make_resolver(table, cognito)
+    identity = {"claims": {"sub": "t1", "preferred_username": "Demosthenes"}}
+    assert resolver.resolve(identity) == "Demosthenes"
+    assert table.reads == 0 and cognito.calls == 0
+
+
+def test_profiles_table_then_cache():
+    table = StubProfilesTable({"t1": {"TenantId": "t1", "PreferredUsername": "Cicero"}})
+    cognito = StubCognito()
+    resolver = make_resolver(table, cognito)
+    for _ in range(3):
+        assert resolver.resolve({"claims": {"sub": "t1"}}) == "Cicero"
+    assert table.reads == 1 and cognito.calls == 0
+
+
+def test_cognito_is_the_last_resort_and_is_written_back():
+    table, cognito = StubProfilesTable(), StubCognito()
+    assert make_resolver(table, cognito).resolve({"claims": {"sub": "t1"}}) == "Pericles"
+    assert cognito.calls == 1
+    assert table.items["t1"]["PreferredUsername"] == "Pericles"
+    # A new container finds it in the table
+    assert make_resolver(table, cognito).resolve({"claims": {"sub": "t1"}}) == "Pericles"
+    assert cognito.calls == 1
@@ -2,6 +2,7 @@ import 'package:flutter/material.dart';
 import 'package:flutter/scheduler.dart';
 import 'dart:convert';
 import 'dart:async';
+import 'dart:math';
 
 import 'package:amplify_auth_cognito/amplify_auth_cognito.dart';
 import 'package:amplify_authenticator/amplify_authenticator.dart';
@@ -41,10 +42,16 @@ class MyHomePage extends StatefulWidget {
 
 class _MyHomePageState extends State<MyHomePage> {
   final TextEditingController _controller = TextEditingController();
+  // The chat room shown by this client
+  final String _roomId = 'global';
   List<dynamic> _messages = [];
   final StreamController<List<dynamic>> _streamController =
       StreamController<List<dynamic>>.broadcast();
   StreamSubscription<GraphQLResponse<dynamic>>? subscription;
+  StreamSubscription<ApiHubEvent>? _connectionSubscription;
+  // Cursor of the newest message received, to catch up with messagesSince after a reconnection
+  String? _syncCursor;
+  bool _disconnected = false;
   final ScrollController _scrollController = ScrollController();
   String? tenantId;
 
@@ -69,6 +76,7 @@ class _MyHomePageState extends State<MyHomePage> {
     });
     _receiveMessages();
     _subscribeToMessageMutations(tenantId!);
+    _catchUpOnReconnection();
   }
 
   @override
@@ -208,24 +216,33 @@ class _MyHomePageState extends State<MyHomePage> {
   Future<void> _receiveMessages() async {
     String graphQLDocument =
         """
-    query GetMessages {
-      messages {
-        text
-        tenantId
-        username
-        aiGenerated
-      } 
+    query GetMessages(\$roomId: ID) {
+      messages(roomId: \$roomId) {
+        items {
+          id
+          roomId
+          text
+          tenantId
+          username
+          aiGenerated
+          cursor
+        }
+        nextToken
+      }
     }
     """;
     try {
       final response = await Amplify.API
-          .query(request: GraphQLRequest<String>(document: graphQLDocument))
+          .query(
+              request: GraphQLRequest<String>(
+                  document: graphQLDocument, variables: {'roomId': _roomId}))
           .response;
       safePrint('Query messages data received: ${response.data}');
       safePrint('Query messages error received: ${response.errors}');
       if (response.data != null) {
         setState(() {
-          _messages = json.decode(response.data!)['messages'];
+          _messages = json.decode(response.data!)['messages']['items'];
+          _messages.forEach(_trackCursor);
           _streamController.add(_messages);
         });
         SchedulerBinding.instance.addPostFrameCallback((_) {
@@ -237,16 +254,102 @@ class _MyHomePageState extends State<MyHomePage> {
     }
   }
 
+  void _trackCursor(dynamic message) {
+    final String? cursor = message['cursor'];
+    if (cursor != null &&
+        (_syncCursor == null || cursor.compareTo(_syncCursor!) > 0)) {
+      _syncCursor = cursor;
+    }
+  }
+
+  // The subscriptions miss the messages sent while the connection is down. Once it is back, only the messages
+  // written since the newest one received are read, instead of the whole room
+  void _catchUpOnReconnection() {
+    _connectionSubscription =
+        Amplify.Hub.listen(HubChannel.Api, (ApiHubEvent event) {
+      if (event is! SubscriptionHubEvent) return;
+      if (event.status == SubscriptionStatus.pendingDisconnected ||
+          event.status == SubscriptionStatus.disconnected) {
+        _disconnected = true;
+      } else if (event.status == SubscriptionStatus.connected &&
+          _disconnected) {
+        _disconnected = false;
+        _syncCursor == null ? _receiveMessages() : _receiveMessagesSince();
+      }
+    });
+  }
+
+  Future<void> _receiveMessagesSince() async {
+    String graphQLDocument =
+        """
+    query GetMessagesSince(\$roomId: ID, \$cursor: String!) {
+      messagesSince(roomId: \$roomId, cursor: \$cursor) {
+        items {
+          id
+          roomId
+          text
+          tenantId
+          username
+          aiGenerated
+          cursor
+        }
+        cursor
+        hasMore
+      }
+    }
+    """;
+    try {
+      bool hasMore = true;
+      while (hasMore) {
+        final response = await Amplify.API
+            .query(
+                request: GraphQLRequest<String>(
+                    document: graphQLDocument,
+                    variables: {'roomId': _roomId, 'cursor': _syncCursor}))
+            .response;
+        safePrint('Messages since data error: ${response.errors}');
+        if (response.data == null) return;
+        final delta = json.decode(response.data!)['messagesSince'];
+        // The deltas can repeat messages already received
+        setState(() {
+          for (final message in delta['items']) {
+            final index =
+                _messages.indexWhere((m) => m['id'] == message['id']);
+            if (index == -1) {
+              _messages.add(message);
+            } else {
+              _messages[index] = message;
+            }
+          }
+          _streamController.add(_messages);
+        });
+        _syncCursor = delta['cursor'];
+        hasMore = delta['hasMore'];
+      }
+      SchedulerBinding.instance.addPostFrameCallback((_) {
+        _scrollToBottom();
+      });
+    } on Exception catch (e) {
+      safePrint(e);
+    }
+  }
+
   // NOTE: Having 2 different api calls for an unified behavior is not ideal because you are affording the api user to do something that the api was not designed to, but I do not wish to spend more time on this demo
   Future<void> _sendMessage({required String text}) async {
+    // Sent with both mutations, so a retry of either doesn't save or answer the message twice
+    final idempotencyKey = _newIdempotencyKey();
+    // The subscribers only get the fields selected here: the ones the subscriptions filter on and the ones they read
     String graphQLDocument =
         '''
     mutation SendMessage(\$message: SendMessageInput!) {
       sendMessage(message: \$message) {
+        id
+        roomId
         text
         tenantId
         username
         aiGenerated
+        cursor
       }
     }
   ''';
@@ -255,11 +358,20 @@ class _MyHomePageState extends State<MyHomePage> {
           .mutate(
               request:
                   GraphQLRequest<String>(document: graphQLDocument, variables: {
-            'message': {'text': text}
+            'message': {
+              'roomId': _roomId,
+              'text': text,
+              'idempotencyKey': idempotencyKey
+            }
           }))
           .response;
       safePrint('Send message data received: ${response.data}');
       safePrint('Send message data error: ${response.errors}');
+      // E.g. RateLimitExceeded, don't ask for an answer to a message that wasn't sent
+      if (response.errors.isNotEmpty) {
+        _showError(response.errors.first.message);
+        return;
+      }
     } on Exception catch (e) {
       safePrint(e);
     }
@@ -269,10 +381,13 @@ class _MyHomePageState extends State<MyHomePage> {
         '''
     mutation RequestAiResponse(\$message: SendMessageInput!) {
       requestAiResponse(message: \$message) {
+        id
+        roomId
         text
         tenantId
         username
         aiGenerated
+        status
       }
     }
   ''';
@@ -282,27 +397,51 @@ class _MyHomePageState extends State<MyHomePage> {
               request: GraphQLRequest<String>(
                   document: aiResponseDocument,
                   variables: {
-                'message': {'text': text}
+                'message': {
+                  'roomId': _roomId,
+                  'text': text,
+                  'idempotencyKey': idempotencyKey
+                }
               }))
           .response;
       safePrint('AI response data received: ${aiResponse.data}');
       safePrint('AI response data error: ${aiResponse.errors}');
+      if (aiResponse.errors.isNotEmpty) {
+        _showError(aiResponse.errors.first.message);
+      }
     } on Exception catch (e) {
       safePrint(e);
     }
   }
 
+  void _showError(String message) {
+    if (!mounted) return;
+    ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text(message)));
+  }
+
+  String _newIdempotencyKey() {
+    final random = Random.secure();
+    return base64Url
+        .encode(List<int>.generate(16, (_) => random.nextInt(256)))
+        .replaceAll('=', '');
+  }
+
   Future<void> _deleteAllMessages() async {
     String graphQLDocument =
         '''
-    mutation DeleteAllMessages {
-      deleteAllMessages
+    mutation DeleteAllMessages(\$roomId: ID) {
+      deleteAllMessages(roomId: \$roomId) {
+        roomId
+        mode
+      }
     }
   ''';
 
     try {
       final response = await Amplify.API
-          .mutate(request: GraphQLRequest<String>(document: graphQLDocument))
+          .mutate(
+              request: GraphQLRequest<String>(
+                  document: graphQLDocument, variables: {'roomId': _roomId}))
           .response;
       safePrint('Delete all messages data received: ${response.data}');
       safePrint('Delete all messages data error: ${response.errors}');
@@ -311,28 +450,51 @@ class _MyHomePageState extends State<MyHomePage> {
     }
   }
 
-  // NOTE: Nothing prevents the api user from subscribing to another tenant's messages, but I'm not going to spend more time on this demo
+  // The events are filtered by AppSync from the subscription arguments, and onSendMessage only accepts the caller's
+  // own tenantId. The room is known, so the events don't select it
   Future<void> _subscribeToMessageMutations(String tenantId) async {
     String onSendMessageDocument =
         '''
-    subscription OnSendMessage(\$tenantId: ID!) {
-      onSendMessage(tenantId: \$tenantId) {
+    subscription OnSendMessage(\$tenantId: ID!, \$roomId: ID) {
+      onSendMessage(tenantId: \$tenantId, roomId: \$roomId) {
+        id
         text
         tenantId
         username
         aiGenerated
+        cursor
+      }
+    }
+    ''';
+
+    // Messages the caller sent in bulk, e.g. from a bot or an import
+    String onSendMessagesDocument =
+        '''
+    subscription OnSendMessages(\$tenantId: ID!, \$roomId: ID) {
+      onSendMessages(tenantId: \$tenantId, roomId: \$roomId) {
+        items {
+          id
+          text
+          tenantId
+          username
+          aiGenerated
+          cursor
+        }
       }
     }
     ''';
 
     String onRequestAiResponseDocument =
         '''
-    subscription OnRequestAiResponse {
-      onRequestAiResponse {
+    subscription OnRequestAiResponse(\$roomId: ID) {
+      onRequestAiResponse(roomId: \$roomId) {
+        id
         text
         aiGenerated
         tenantId
         username
+        status
+        cursor
       }
     }
     ''';
@@ -340,8 +502,25 @@ class _MyHomePageState extends State<MyHomePage> {
     // Add the onDeleteAllMessages subscription
     String onDeleteAllMessagesDocument =
         '''
-    subscription OnDeleteAllMessages {
-      onDeleteAllMessages
+    subscription OnDeleteAllMessages(\$roomId: ID) {
+      onDeleteAllMessages(roomId: \$roomId) {
+        mode
+      }
+    }
+    ''';
+
+    // Tokens of the AI responses, while they are being generated. Only the first chunk carries tenantId and username
+    String onAiResponseChunkDocument =
+        '''
+    subscription OnAiResponseChunk(\$roomId: ID) {
+      onAiResponseChunk(roomId: \$roomId) {
+        messageId
+        tenantId
+        username
+        seq
+        text
+        done
+      }
     }
     ''';
 
@@ -351,16 +530,26 @@ class _MyHomePageState extends State<MyHomePage> {
         Amplify.API.subscribe(
             GraphQLRequest<String>(
               document: onSendMessageDocument,
-              variables: {'tenantId': tenantId},
+              variables: {'tenantId': tenantId, 'roomId': _roomId},
             ), onEstablished: () {
       safePrint('OnSendMessage subscription established');
     });
 
+    final Stream<GraphQLResponse<dynamic>> onSendMessagesOperation =
+        Amplify.API.subscribe(
+            GraphQLRequest<String>(
+              document: onSendMessagesDocument,
+              variables: {'tenantId': tenantId, 'roomId': _roomId},
+            ), onEstablished: () {
+      safePrint('OnSendMessages subscription established');
+    });
+
     // Subscribe to onRequestAiResponse
     final Stream<GraphQLResponse<dynamic>> onRequestAiResponseOperation =
         Amplify.API.subscribe(
             GraphQLRequest<String>(
               document: onRequestAiResponseDocument,
+              variables: {'roomId': _roomId},
             ), onEstablished: () {
       safePrint('OnRequestAiResponse subscription established');
     });
@@ -369,15 +558,27 @@ class _MyHomePageState extends State<MyHomePage> {
         Amplify.API.subscribe(
             GraphQLRequest<String>(
               document: onDeleteAllMessagesDocument,
+              variables: {'roomId': _roomId},
             ), onEstablished: () {
       safePrint('OnDeleteAllMessages subscription established');
     });
 
+    final Stream<GraphQLResponse<dynamic>> onAiResponseChunkOperation =
+        Amplify.API.subscribe(
+            GraphQLRequest<String>(
+              document: onAiResponseChunkDocument,
+              variables: {'roomId': _roomId},
+            ), onEstablished: () {
+      safePrint('OnAiResponseChunk subscription established');
+    });
+
     // Combine the subscription streams using Rx.merge
     final allSubscriptions = Rx.merge([
       onSendMessageOperation,
+      onSendMessagesOperation,
       onRequestAiResponseOperation,
       onDeleteAllMessagesOperation,
+      onAiResponseChunkOperation,
     ]);
 
     subscription = allSubscriptions.listen(
@@ -387,13 +588,65 @@ class _MyHomePageState extends State<MyHomePage> {
         final messageData = json.decode(event.data!);
 
         if (messageData['onSendMessage'] != null) {
+          // A retried sendMessage publishes the same message again
+          final message = messageData['onSendMessage'];
+          _trackCursor(message);
+          setState(() {
+            if (!_messages.any((m) => m['id'] == message['id'])) {
+              _messages.add(message);
+            }
+            _streamController.add(_messages);
+          });
+        } else if (messageData['onSendMessages'] != null) {
+          final messages = messageData['onSendMessages']['items'];
+          messages.forEach(_trackCursor);
           setState(() {
-            _messages.add(messageData['onSendMessage']);
+            for (final message in messages) {
+              if (!_messages.any((m) => m['id'] == message['id'])) {
+                _messages.add(message);
+              }
+            }
             _streamController.add(_messages);
           });
         } else if (messageData['onRequestAiResponse'] != null) {
+          // The request is published PENDING first, then COMPLETE (or FAILED) with the answer. The answer replaces
+          // the pending/partial message with the same id
+          final message = messageData['onRequestAiResponse'];
+          _trackCursor(message);
+          setState(() {
+            final index = _messages.indexWhere((m) => m['id'] == message['id']);
+            if (message['status'] == 'FAILED') {
+              if (index != -1) _messages.removeAt(index);
+            } else if (index == -1) {
+              _messages.add(message);
+            } else {
+              _messages[index] = message;
+            }
+            _streamController.add(_messages);
+          });
+        } else if (messageData['onAiResponseChunk'] != null) {
+          final chunk = messageData['onAiResponseChunk'];
           setState(() {
-            _messages.add(messageData['onRequestAiResponse']);
+            final index =
+                _messages.indexWhere((m) => m['id'] == chunk['messageId']);
+            if (index == -1) {
+              _messages.add({
+                'id': chunk['messageId'],
+                'roomId': _roomId,
+                'text': chunk['text'],
+                'tenantId': chunk['tenantId'],
+                'username': chunk['username'] ?? '',
+                'aiGenerated': true,
+              });
+            } else {
+              // A retried completion starts over from seq 0
+              _messages[index] = {
+                ..._messages[index],
+                'text': chunk['seq'] == 0
+                    ? chunk['text']
+                    : _messages[index]['text'] + chunk['text'],
+              };
+            }
             _streamController.add(_messages);
           });
         } else if (messageData['onDeleteAllMessages'] != null) {
@@ -421,6 +674,7 @@ class _MyHomePageState extends State<MyHomePage> {
   @override
   void dispose() {
     subscription?.cancel();
+    _connectionSubscription?.cancel();
     _streamController.close();
     _controller.dispose();
     _scrollController.dispose();